@@ -0,0 +1,1140 @@
+
+# Mediciones sin red ni ventana: yt-dlp con un extractor falso servido en local, audio sintetico,
+# un ffpyplayer simulado y una pagina de flet que solo cuenta lo que se enviaria.
+#
+#   python benchmark.py                  mide y compara contra benchmark_baseline.json
+#   python benchmark.py --grande         suma las listas de 1.000.000 de canciones
+#   python benchmark.py --solo lista,control
+#   python benchmark.py --guardar-base   guarda el resultado como nueva base
+#
+# El resultado sale en JSON por stdout (o en --salida); el ruido del reproductor va a stderr.
+# Sale con codigo 1 si alguna medicion empeoro mas que TOLERANCIA contra la base.
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import http.server
+import importlib.util
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+import wave
+from urllib.parse import urlparse
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+BASE_FILE = os.path.join(RAIZ, "benchmark_baseline.json")
+TAMANOS = (10, 1000, 10000, 100000)  # Canciones por lista; --grande agrega TAMANO_GRANDE
+TAMANO_GRANDE = 1000000
+TAMANOS_INTERFAZ = (100, 10000, 50000)  # Canciones en la lista de la ventana
+TOLERANCIA = 0.5  # Cuanto puede empeorar una medicion (50%) antes de marcarla como regresion
+REPETICIONES = 2  # Veces que se vuelve a medir una seccion con regresiones antes de darlas por buenas
+REPETIBLES = {"lista", "interfaz", "reproduccion", "audio", "ordenes", "control", "arranque", "migracion", "telemetria"}  # Las que no dependen de caches que deja la primera vuelta
+MINIMOS = {"_s": 0.005, "_ms": 5.0, "_us": 2.0, "_pct": 2.0, "_bytes": 4096}  # Diferencias menores son ruido
+MP3_BIBLIOTECA = 5000  # Archivos en la carpeta de la comparacion con y sin cache de metadatos
+LATENCIA = 0.05  # Segundos que tarda el extractor falso en resolver
+ANCHO_BANDA = 4 * 1024 * 1024  # Bytes por segundo del servidor de audio local
+DURACION_SINTETICA = 1.5  # Segundos de cada cancion en el reproductor simulado
+DURACION_ERRADA = 0.5  # Cuanto de menos informa la duracion en la prueba de fin de pista con metadatos equivocados
+CLIENTES_CONTROL = 300  # Clientes simultaneos contra el control local
+ORDENES_POR_S = 5000  # Ritmo de las ordenes al azar en la prueba de carga del hilo de ordenes
+SEGUNDOS_ORDENES = 3.0
+CANCIONES_BIBLIOTECA = 100000  # Lista de la prueba del reconciliador
+ARCHIVOS_BIBLIOTECA = 5000  # De esas, las que tienen su archivo en la carpeta, guardadas con rutas de Windows
+
+
+def generar_wav(ruta, segundos, frecuencia=440.0, muestreo=8000):
+    with wave.open(ruta, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(muestreo)
+        muestras = (int(12000 * math.sin(2 * math.pi * frecuencia * i / muestreo)) for i in range(int(segundos * muestreo)))
+        f.writeframes(b"".join(struct.pack("<h", m) for m in muestras))  # Un tono: suficiente para ffprobe y ffmpeg
+
+
+def fixture_lista(n, carpeta=None, con_archivo=0, puerto=None):
+    canciones = []
+    for i in range(n):
+        video_id = f"v{i:010d}"
+        file_path = os.path.join(carpeta, f"{video_id}.wav") if i < con_archivo else None
+        canciones.append({
+            "titulo": f"Artista {i % 5000} - Canción número {i}" if i % 7 == 0 else f"Artista {i % 5000} - Cancion numero {i}",
+            "url": f"stub:{video_id}" if puerto else f"https://www.youtube.com/watch?v={video_id}",  # Con puerto, todo sale del servidor local
+            "miniatura": f"http://127.0.0.1:{puerto}/portada.jpg" if puerto else f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+            "file_path": file_path,
+            "video_id": video_id,
+            "stream_url": None,
+            "expira": None
+        })  # Mismo formato que guarda ListaReproduccion.guardar()
+    return canciones
+
+
+def escribir_lista(archivo, canciones):
+    with open(archivo, "w", encoding="utf-8") as f:
+        json.dump(canciones, f, ensure_ascii=False)
+
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return time.perf_counter() - inicio, resultado
+
+
+class ReproductorSintetico:
+    abiertos = []  # Todos los que se crearon, para contar aperturas y los que quedaron sin cerrar
+
+    def __init__(self, archivo, callback=None, ff_opts=None):
+        ReproductorSintetico.abiertos.append(self)
+        ff_opts = ff_opts or {}
+        self.callback = callback
+        self.pausado = bool(ff_opts.get("paused"))
+        self.pts = float(ff_opts.get("ss") or 0.0)
+        self.desde = time.perf_counter() + 0.02  # Lo que tarda un decoder real en dar el primer cuadro
+        self.cerrado = False
+        self.reloj = None
+        if not self.pausado:
+            self.programar()
+
+    def programar(self):
+        espera = max(DURACION_SINTETICA - self.pts + max(self.desde - time.perf_counter(), 0), 0)
+        self.reloj = threading.Timer(espera, self.fin)
+        self.reloj.daemon = True
+        self.reloj.start()
+
+    def fin(self):
+        if not self.cerrado and self.callback:
+            self.callback("eof", None)
+
+    def get_pts(self):
+        if self.pausado:
+            return self.pts
+        return min(self.pts + max(time.perf_counter() - self.desde, 0.0), DURACION_SINTETICA)
+
+    def set_pause(self, pausado):
+        if pausado and not self.pausado:
+            self.pts = self.get_pts()
+            if self.reloj:
+                self.reloj.cancel()
+        elif not pausado and self.pausado:
+            self.desde = time.perf_counter()
+            self.pausado = False
+            self.programar()
+        self.pausado = pausado
+
+    def seek(self, pts, relative=True, accurate=True):
+        pausado = self.pausado
+        self.set_pause(True)
+        self.pts = min(max(self.pts + pts if relative else pts, 0.0), DURACION_SINTETICA)
+        if not pausado:
+            self.set_pause(False)
+
+    def get_metadata(self):
+        return {"duration": DURACION_SINTETICA}
+
+    def get_frame(self, show=True):
+        return (None, 0.0)
+
+    def set_volume(self, volumen):
+        pass
+
+    def close_player(self):
+        self.cerrado = True
+        if self.reloj:
+            self.reloj.cancel()
+
+
+class PaginaFalsa:
+    def __init__(self):
+        self.controls = []
+        self.updates = 0  # page.update()
+        self.enviados = 0  # Controles nuevos que viajarian enteros en esos updates
+        self.recorridos = 0  # Controles que flet compara en esos updates
+        self.vistos = set()
+        self.on_disconnect = None
+
+    def add(self, *controles):
+        self.controls.extend(controles)
+        self.update()
+
+    def update(self, *controles):
+        self.enviar(self.controls)
+
+    def enviar(self, controles):
+        self.updates += 1
+        recorridos = todos(controles)
+        self.recorridos += len(recorridos)
+        nuevos = [c for c in recorridos if id(c) not in self.vistos]
+        self.vistos.update(id(c) for c in nuevos)
+        self.enviados += len(nuevos)  # Flet solo manda entero lo que el cliente no tiene
+
+    def run_thread(self, funcion, *args):
+        threading.Thread(target=funcion, args=args, daemon=True).start()
+
+
+def todos(controles, salida=None):
+    salida = [] if salida is None else salida
+    for control in controles:
+        salida.append(control)
+        for atributo in ("controls", "content"):
+            valor = getattr(control, atributo, None)
+            if isinstance(valor, list):
+                todos(valor, salida)
+            elif valor is not None and hasattr(valor, "_get_children"):
+                todos([valor], salida)
+    return salida
+
+
+class ServidorAudio(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        ruta = urlparse(self.path).path
+        self.server.pedidos.append(ruta)
+        datos = self.server.archivos.get(ruta)
+        if datos is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        bloque = 16 * 1024
+        with contextlib.suppress(ConnectionError):  # Una precarga cancelada corta la conexion a mitad
+            for i in range(0, len(datos), bloque):
+                self.wfile.write(datos[i:i + bloque])
+                if self.server.ancho_banda:
+                    time.sleep(bloque / self.server.ancho_banda)  # Ancho de banda limitado, como una red real
+
+    def log_message(self, *args):
+        pass
+
+
+def abrir_servidor_audio(ancho_banda):
+    servidor = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ServidorAudio)
+    servidor.archivos = {}
+    servidor.pedidos = []
+    servidor.ancho_banda = ancho_banda
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+def instalar_extractor(m, servidor, latencia):
+    from yt_dlp.extractor.common import InfoExtractor
+
+    puerto = servidor.server_address[1]
+    resueltos = []
+
+    class ExtractorLocal(InfoExtractor):
+        _VALID_URL = r"stub:(?P<id>[\w-]+)"
+        IE_NAME = "Local"
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            resueltos.append(video_id)
+            time.sleep(latencia)  # Lo que tardaria YouTube en contestar
+            ruta = f"/{video_id}.wav"
+            if ruta not in servidor.archivos:
+                servidor.archivos[ruta] = servidor.archivos["/base.wav"]
+            return {
+                "id": video_id,
+                "title": f"Cancion {video_id}",
+                "webpage_url": url,
+                "thumbnail": f"http://127.0.0.1:{puerto}/portada.jpg",
+                "formats": [{
+                    "url": f"http://127.0.0.1:{puerto}{ruta}?expire={int(time.time()) + 6 * 3600}",
+                    "ext": "wav", "format_id": "audio", "acodec": "pcm_s16le", "vcodec": "none"
+                }]
+            }
+
+    def agregar(ydl):
+        extractor = ExtractorLocal()
+        extractor.set_downloader(ydl)
+        ydl._ies = {"Local": extractor, **ydl._ies}  # Primero, para que tome las urls stub:
+        ydl._ies_instances["Local"] = extractor
+
+    original = m.InstanciaYoutubeDL.__init__
+
+    def iniciar(instancia, opciones):
+        original(instancia, opciones)
+        agregar(instancia.ydl)
+
+    m.InstanciaYoutubeDL.__init__ = iniciar
+    return resueltos, agregar
+
+
+def cargar_reproductor(carpeta):
+    shutil.copy(os.path.join(RAIZ, "main.py"), carpeta)  # BASE_DIR queda en la carpeta temporal: no toca la musica real
+    spec = importlib.util.spec_from_file_location("reproductor_benchmark", os.path.join(carpeta, "main.py"))
+    m = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    m.MediaPlayer = ReproductorSintetico
+    m.PUERTO_METRICAS = None
+    return m
+
+
+def reiniciar_caches(m):
+    for archivo in os.listdir(m.MUSIC_FOLDER):
+        ruta = os.path.join(m.MUSIC_FOLDER, archivo)
+        if os.path.isfile(ruta):
+            os.remove(ruta)
+    m.cache_descargas = m.CacheDescargas(m.MUSIC_FOLDER, m.MANIFIESTO_FILE, m.MAX_MB_MUSICA * 1024 * 1024)
+
+
+def recorrer_viejo(lista):
+    canciones, nodo = [], lista.PTR
+    for _ in range(lista.longitud):
+        canciones.append(nodo)
+        nodo = nodo.siguiente
+    return canciones  # Como ListaReproduccion.recorrer() antes del indice: siguiendo los punteros
+
+
+def eliminar_viejo(lista, cancion):
+    cancion.anterior.siguiente = cancion.siguiente  # ListaReproduccion.eliminar() antes del indice
+    cancion.siguiente.anterior = cancion.anterior
+    if lista.PTR is cancion:
+        lista.PTR = cancion.siguiente
+    lista.longitud -= 1
+
+
+def medir_lista(m, n):
+    carpeta = tempfile.mkdtemp(prefix="lista_")
+    archivo = os.path.join(carpeta, "playlist.json")
+    escribir_lista(archivo, fixture_lista(n))
+    resultado = {}
+    lista = m.ListaReproduccion()
+
+    resultado["cargar_s"], _ = cronometrar(lista.cargar, archivo)
+    resultado["completar_s"], _ = cronometrar(lista.completar, threading.RLock())
+    resultado["guardar_s"], _ = cronometrar(lista.guardar, os.path.join(carpeta, "copia.json"))
+    resultado["recorrer_s"], _ = cronometrar(lambda: sum(1 for _ in lista.recorrer()))
+
+    azar = random.Random(n)
+    movimientos = 1000
+    canciones = [lista.orden[azar.randrange(n)] for _ in range(movimientos)]
+    segundos, _ = cronometrar(lambda: [lista.mover(c, azar.choice((-1, 1))) for c in canciones])
+    resultado["mover_us"] = segundos / movimientos * 1e6
+
+    viejas = 100  # El camino de antes es O(n) por operacion: menos repeticiones
+    segundos, _ = cronometrar(lambda: [recorrer_viejo(lista).index(c) for c in canciones[:viejas]])
+    resultado["viejo_posicion_us"] = segundos / viejas * 1e6  # recorrer() y list.index() en cada click
+    segundos, _ = cronometrar(lambda: [lista.posicion(c) for c in canciones])
+    resultado["posicion_us"] = segundos / movimientos * 1e6
+    segundos, _ = cronometrar(lambda: [(recorrer_viejo(lista).index(c), lista.mover(c, 1)) for c in canciones[:viejas]])
+    resultado["viejo_mover_us"] = segundos / viejas * 1e6
+
+    vieja = m.ListaReproduccion()
+    vieja.cargar(archivo)
+    borrar = azar.sample(vieja.orden, min(viejas, n // 10))
+    segundos, _ = cronometrar(lambda: [(eliminar_viejo(vieja, c), recorrer_viejo(vieja)) for c in borrar])
+    resultado["viejo_eliminar_us"] = segundos / len(borrar) * 1e6  # Desenlazar y el recorrer() de guardar y redibujar
+    borrar = azar.sample(lista.orden, min(viejas, n // 10))
+    segundos, _ = cronometrar(lambda: [(lista.eliminar(c), lista.posicion(azar.choice(lista.orden))) for c in borrar])
+    resultado["eliminar_us"] = segundos / len(borrar) * 1e6  # Con una consulta de posicion detras, como hace la interfaz
+    canciones = [c for c in canciones if lista.contiene(c)]
+
+    lista.abrir_diario(archivo)
+    segundos, _ = cronometrar(lambda: [(lista.mover(c, 1), lista.guardar_cambios()) for c in canciones[:200]])
+    resultado["diario_op_ms"] = segundos / 200 * 1000  # Una linea con fsync por operacion
+    antes = lista.ops_diario
+    lista.mover(lista.orden[0], 50)
+    lista.guardar_cambios()
+    resultado["diario_lineas_mover_50"] = lista.ops_diario - antes  # Cincuenta lugares de un salto: una sola linea
+
+    bloque = sorted(azar.sample(lista.orden, max(n // 500, 1) * 2), key=lista.posicion)  # 200 canciones salteadas en 100.000
+    segundos, _ = cronometrar(lambda: (lista.empalmar(bloque, 0), lista.guardar_cambios()))
+    resultado["empalmar_bloque_ms"] = segundos * 1000  # Mover todo el bloque al principio: una linea en el diario
+    segundos, _ = cronometrar(lambda: (lista.eliminar_varias(bloque), lista.guardar_cambios()))
+    resultado["eliminar_bloque_ms"] = segundos * 1000
+
+    segundos, _ = cronometrar(lista.buscar, "artsta")
+    resultado["primera_aproximada_ms"] = segundos * 1000  # Arma los trigramas, que no se guardan hasta que hacen falta
+    resultado["tipeos_sin_resultado"] = sum(not lista.buscar(c, limite=10) for c in ("cancoin", "artsita", "nmuero"))  # Letras cruzadas en palabras cortas
+    consultas = [f"cancion {azar.randrange(n)}" for _ in range(100)] + [f"artsta {azar.randrange(5000)}" for _ in range(20)]
+    segundos, _ = cronometrar(lambda: [lista.buscar(c, limite=10) for c in consultas])
+    resultado["buscar_us"] = segundos / len(consultas) * 1e6  # Prefijos y, con errores de tipeo, trigramas
+
+    lista.diario = None
+    segundos, _ = cronometrar(lista.mezclar, True)
+    resultado["aleatorio_activar_ms"] = segundos * 1000  # Una copia de punteros, sin tocar la lista
+    segundos, _ = cronometrar(lambda: [lista.siguiente() for _ in range(10000)])
+    resultado["aleatorio_siguiente_us"] = segundos / 10000 * 1e6
+    segundos, _ = cronometrar(lambda: [lista.anterior() for _ in range(1000)])
+    resultado["aleatorio_anterior_us"] = segundos / 1000 * 1e6
+    nuevas = [m.NodoCancion(f"agregada {i}", None, None) for i in range(1000)]
+    segundos, _ = cronometrar(lambda: [lista.agregar(c) for c in nuevas])
+    resultado["aleatorio_agregar_us"] = segundos / len(nuevas) * 1e6
+    for cancion in azar.sample(lista.orden[-2000:], 100):
+        if cancion is not lista.PTR:
+            lista.eliminar(cancion)  # Las eliminadas se descartan al salir sorteadas
+    segundos, _ = cronometrar(lambda: [lista.siguiente() for _ in range(10000)])
+    resultado["aleatorio_siguiente_con_cambios_us"] = segundos / 10000 * 1e6
+    lista.mezclar(False)
+
+    with contextlib.suppress(OSError):
+        os.remove(archivo + ".log")
+    if n >= 100000:
+        resultado["memoria_bytes_por_cancion"] = memoria_lista(m, archivo, n)
+        resultado["memoria_sin_indice_bytes_por_cancion"] = memoria_lista(m, archivo, n, indice=False)
+        resultado["memoria_vieja_bytes_por_cancion"] = memoria_vieja(archivo, n)  # Los mismos datos en los nodos de antes
+    shutil.rmtree(carpeta, ignore_errors=True)
+    return resultado
+
+
+def memoria_lista(m, archivo, n, indice=True):
+    gc.collect()
+    tracemalloc.start()
+    lista = m.ListaReproduccion()
+    lista.cargar(archivo)
+    if indice:
+        lista.completar(threading.RLock())  # Con el indice de busqueda, como queda en uso
+    gc.collect()
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del lista
+    return actual / n
+
+
+class NodoViejo:
+    def __init__(self, titulo, url, miniatura, file_path=None):
+        self.titulo = titulo
+        self.url = url
+        self.miniatura = miniatura
+        self.file_path = file_path
+        self.anterior = None
+        self.siguiente = None  # NodoCancion antes de __slots__: un __dict__ por nodo y cada texto por separado
+
+
+def memoria_vieja(archivo, n):
+    gc.collect()
+    tracemalloc.start()
+    with open(archivo, "r", encoding="utf-8") as f:
+        datos = json.load(f)
+    primero = anterior = None
+    for d in datos:
+        nodo = NodoViejo(d["titulo"], d["url"], d["miniatura"], d.get("file_path"))  # Como cargar() y agregar() de antes
+        if anterior:
+            anterior.siguiente, nodo.anterior = nodo, anterior
+        else:
+            primero = nodo
+        anterior = nodo
+    primero.anterior, anterior.siguiente = anterior, primero
+    del datos, d, nodo
+    gc.collect()
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del primero, anterior
+    return actual / n
+
+
+def medir_interfaz(carpeta, servidor, n, latencia):
+    import flet as ft
+
+    m = cargar_reproductor(tempfile.mkdtemp(prefix=f"interfaz{n}_", dir=carpeta))  # Un nucleo nuevo por tamano
+    instalar_extractor(m, servidor, latencia)
+    generar_wav(os.path.join(m.MUSIC_FOLDER, "v0000000000.wav"), 1.0)
+    escribir_lista(m.PLAYLIST_FILE, fixture_lista(n, m.MUSIC_FOLDER, con_archivo=1, puerto=servidor.server_address[1]))
+
+    pagina = PaginaFalsa()
+    actualizar = ft.Control.update
+    ft.Control.update = lambda control: pagina.enviar([control])  # Sin cliente conectado: se cuenta lo que viajaria
+    try:
+        resultado = {}
+        inicio = time.perf_counter()
+        m.main(pagina)
+        resultado["ventana_ms"] = (time.perf_counter() - inicio) * 1000
+        esperar(lambda: m.reproductor.cargada and m.lista_reproduccion.longitud == n, 30)
+        esperar(lambda: m.motor.estado == "reproduciendo", 5)
+        resultado["lista_ms"] = (time.perf_counter() - inicio) * 1000
+        resultado["controles_iniciales"] = pagina.enviados
+
+        def por_accion(accion, veces):
+            esperar(lambda: not m.gestor_descargas.trabajos, 30)  # Las precargas de la accion anterior no se cuentan en esta
+            antes = (pagina.updates, pagina.enviados, pagina.recorridos)
+            segundos, _ = cronometrar(lambda: [accion(i) for i in range(veces)])
+            return {
+                "ms": segundos / veces * 1000,
+                "updates": (pagina.updates - antes[0]) / veces,
+                "controles_enviados": (pagina.enviados - antes[1]) / veces,
+                "controles_recorridos": (pagina.recorridos - antes[2]) / veces
+            }
+
+        lista = m.lista_reproduccion
+        resultado["mover"] = por_accion(lambda i: m.reproductor.mover(lista.orden[5 + i % (n // 2)], 1), 100)
+        resultado["siguiente"] = por_accion(lambda i: m.reproductor.siguiente(), 20)
+        vista = [c for c in todos(pagina.controls) if isinstance(c, ft.ListView)][0]
+        evento = type("Desplazamiento", (), {"pixels": 1e9, "max_scroll_extent": 1e9})()
+        resultado["desplazar"] = por_accion(lambda i: vista.on_scroll(evento), 10)
+
+        def agregar(i):
+            cancion = m.NodoCancion(f"nueva {i}", None, None)
+            with m.reproductor.candado:
+                lista.agregar(cancion)
+                m.reproductor.emitir("agregada", cancion=cancion, pos=lista.longitud - 1)
+        resultado["agregar"] = por_accion(agregar, 50)
+        resultado["eliminar"] = por_accion(lambda i: m.reproductor.eliminar(lista.orden[-1]), 50)
+        bloque = slice(n // 10, n // 10 + min(200, n // 5))  # El mismo bloque en las listas grandes
+        resultado["mover_bloque"] = por_accion(lambda i: m.reproductor.mover_varias(lista.orden[bloque], "inicio"), 5)
+        resultado["eliminar_bloque"] = por_accion(lambda i: m.reproductor.eliminar_varias(lista.orden[bloque]), 5)
+    finally:
+        if pagina.on_disconnect:
+            pagina.on_disconnect(None)  # La interfaz deja de escuchar al nucleo, como al cerrar la ventana
+        m.reproductor.ordenes.join()
+        m.reproductor.detener()
+        with m.gestor_descargas.candado:
+            trabajos = list(m.gestor_descargas.trabajos.values())
+        for trabajo in trabajos:
+            m.gestor_descargas.cancelar(trabajo)  # Las precargas no siguen bajando mientras se miden las otras secciones
+            trabajo.terminado.wait(10)
+        ft.Control.update = actualizar  # Las secciones siguientes no cuentan controles de esta pagina
+    return resultado
+
+
+def esperar(condicion, limite):
+    fin = time.perf_counter() + limite
+    while not condicion():
+        if time.perf_counter() > fin:
+            raise TimeoutError("La condicion no se cumplio a tiempo")
+        time.sleep(0.01)
+
+
+def llenar_lista(m, n):
+    m.reproductor.detener()
+    lista = m.lista_reproduccion
+    with m.reproductor.candado:
+        lista.diario = None
+        lista.vaciar()
+        for i in range(n):
+            ruta = os.path.join(m.MUSIC_FOLDER, f"pista{i}.wav")
+            generar_wav(ruta, 0.5)
+            lista.agregar(m.NodoCancion(f"pista {i}", None, None, ruta))
+
+
+def medir_reproduccion(m):
+    reiniciar_caches(m)
+    llenar_lista(m, 5)
+    m.tiempos_cambio.clear()
+
+    inicio_cpu, inicio = time.process_time(), time.perf_counter()
+    m.reproductor.tocar_actual()
+    time.sleep(DURACION_SINTETICA * 4 + 0.5)  # Varios relevos seguidos
+    cpu_sonando = (time.process_time() - inicio_cpu) / (time.perf_counter() - inicio)
+
+    m.reproductor.pausar()
+    inicio_cpu, inicio = time.process_time(), time.perf_counter()
+    time.sleep(2.0)
+    cpu_pausado = (time.process_time() - inicio_cpu) / (time.perf_counter() - inicio)
+    m.reproductor.detener()
+
+    resultado = {
+        "cpu_sonando_pct": cpu_sonando * 100,
+        "cpu_pausado_pct": cpu_pausado * 100  # El motor no deberia despertarse en pausa
+    }
+    for modo, tiempos in m.tiempos_cambio.items():
+        resultado[f"cambio_{modo}_ms"] = statistics.mean(tiempos) * 1000
+
+    archivo = m.lista_reproduccion.orden[0].file_path
+    viejos, nuevos = [], []
+    errados_viejos, errados = [], []
+    for _ in range(5):
+        player = m.MediaPlayer(archivo)
+        viejos.append(fin_viejo(DURACION_SINTETICA) - (player.desde + DURACION_SINTETICA))
+        player.close_player()
+        nuevos.append(fin_nuevo(m, archivo))
+    for _ in range(3):
+        player = m.MediaPlayer(archivo)
+        errados_viejos.append(fin_viejo(DURACION_SINTETICA - DURACION_ERRADA) - (player.desde + DURACION_SINTETICA))
+        player.close_player()
+        errados.append(fin_nuevo(m, archivo, DURACION_ERRADA))
+    resultado["fin_latencia_vieja_ms"] = statistics.mean(abs(t) for t in viejos) * 1000  # Error contra el final real, antes o despues
+    resultado["fin_latencia_vieja_max_ms"] = max(abs(t) for t in viejos) * 1000
+    resultado["fin_latencia_ms"] = statistics.mean(abs(t) for t in nuevos) * 1000
+    resultado["fin_latencia_max_ms"] = max(abs(t) for t in nuevos) * 1000
+    resultado["fin_duracion_errada_vieja_ms"] = statistics.mean(abs(t) for t in errados_viejos) * 1000  # ffprobe y ffpyplayer dicen menos de lo que dura
+    resultado["fin_duracion_errada_ms"] = statistics.mean(abs(t) for t in errados) * 1000
+    return resultado
+
+
+def fin_viejo(duracion):
+    transcurrido, ultimo_reloj = 0.0, time.time()
+    while True:
+        tiempo_actual = time.time()
+        transcurrido += tiempo_actual - ultimo_reloj
+        if transcurrido >= duracion:
+            return time.perf_counter()  # El bucle de reproducir_mp3(): reloj de pared contra la duracion de ffprobe
+        ultimo_reloj = tiempo_actual
+        time.sleep(0.1)
+
+
+def fin_nuevo(m, archivo, error=0.0):
+    class Errado(ReproductorSintetico):
+        def get_metadata(self):
+            return {"duration": DURACION_SINTETICA - error}
+
+    motor = m.MotorReproduccion()
+    terminada = threading.Event()
+    marcas = []
+    clase, m.MediaPlayer = m.MediaPlayer, Errado
+    try:
+        motor.reproducir(archivo, al_terminar=lambda cortado: (marcas.append(time.perf_counter()), terminada.set()))
+    finally:
+        m.MediaPlayer = clase
+    player = motor.player
+    terminada.wait(DURACION_SINTETICA + 5)
+    motor.detener()
+    return marcas[0] - (player.desde + DURACION_SINTETICA)  # Desde el eof del player hasta el aviso
+
+
+def agregar_viejo(m, texto, carpeta, agregar_extractor, extracciones):
+    yt_dlp = m.cargar_yt_dlp()
+
+    def preparar(ydl):
+        agregar_extractor(ydl)
+        extraer = ydl.extract_info
+        ydl.extract_info = lambda *args, **kwargs: (extracciones.append(args[0]), extraer(*args, **kwargs))[1]  # download() pasa por aca
+        return ydl
+
+    with preparar(yt_dlp.YoutubeDL({'format': 'bestaudio/best', 'quiet': True, 'noplaylist': True, 'default_search': 'ytsearch'})) as ydl:
+        info = ydl.extract_info(texto, download=False)  # obtener_info_cancion(): un YoutubeDL nuevo por cancion
+    url = info.get('url') or info.get('webpage_url')
+    opciones = {
+        'format': 'bestaudio/best', 'outtmpl': os.path.join(carpeta, "temp_viejo.%(ext)s"), 'quiet': True,
+        'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}]
+    }
+    with preparar(yt_dlp.YoutubeDL(opciones)) as ydl:
+        ydl.extract_info(url, download=False)  # descargar_mp3() volvia a resolver la url ya resuelta
+        ydl.download([url])  # Y otra vez al bajarla; recien con el mp3 empezaba a sonar
+    return os.path.join(carpeta, "temp_viejo.mp3")
+
+
+def medir_descargas(m, servidor, resueltos, agregar_extractor):
+    reiniciar_caches(m)
+    resultado = {}
+    pedidos = lambda ruta: servidor.pedidos.count(ruta)
+
+    segundos = []
+    for i in range(5):
+        duracion, _ = cronometrar(m.resolver, f"stub:resolver{i}")
+        segundos.append(duracion)
+    resultado["resolver_ms"] = statistics.mean(segundos) * 1000
+
+    total, bytes_bajados = 0.0, 0
+    for i in range(3):
+        info = m.resolver(f"stub:bajar{i}")
+        duracion, ruta = cronometrar(lambda: m.descargar_mp3(info["webpage_url"], info["title"], video_id=info["id"], info=info))
+        total += duracion
+        bytes_bajados += os.path.getsize(ruta)
+    resultado["descarga_s"] = total / 3
+    resultado["descarga_bytes_por_s"] = bytes_bajados / total
+
+    gestor = m.GestorDescargas()
+    marcas = {}
+
+    def aviso(trabajo):
+        ahora = time.perf_counter()
+        cancion = trabajo.cancion
+        if trabajo.estado == "descargando" and cancion and cancion.stream_vigente():
+            marcas.setdefault("stream", ahora)  # Desde aqui ya puede sonar por la url directa
+        if trabajo.estado == "listo":
+            marcas.setdefault("archivo", ahora)
+    inicio = time.perf_counter()
+    trabajo = gestor.agregar("stub:primera", aviso)
+    trabajo.terminado.wait(60)
+    resultado["primer_audio_stream_ms"] = (marcas["stream"] - inicio) * 1000
+    resultado["primer_audio_descarga_ms"] = (marcas["archivo"] - inicio) * 1000  # Bajar entera y recien sonar
+
+    if shutil.which("ffmpeg"):
+        carpeta = tempfile.mkdtemp(prefix="viejo_")
+        extracciones = []
+        segundos, ruta = cronometrar(agregar_viejo, m, "stub:vieja", carpeta, agregar_extractor, extracciones)
+        resultado["primer_audio_viejo_ms"] = segundos * 1000 if os.path.exists(ruta) else None
+        resultado["extracciones_por_cancion_viejo"] = len(extracciones)
+        shutil.rmtree(carpeta, ignore_errors=True)
+    else:
+        resultado["faltan"] = ["ffmpeg"]  # El camino viejo convertia a mp3 antes de sonar
+    antes = len(resueltos)
+    gestor.agregar("stub:nueva", None).terminado.wait(60)
+    resultado["extracciones_por_cancion"] = len(resueltos) - antes  # process_ie_result no vuelve a pasar por el extractor
+
+    for texto in ("stub:repetida", "stub:repetida", "stub:repetida"):
+        gestor.agregar(texto, None).terminado.wait(60)  # La misma cancion pedida tres veces, una tras otra
+    cancion = m.NodoCancion("repetida", "stub:repetida", None, video_id="repetida")
+    gestor.agregar("otra busqueda", None, cancion=cancion).terminado.wait(60)
+    resultado["descargas_redundantes"] = pedidos("/repetida.wav") - 1
+    resultado["resoluciones_redundantes"] = resueltos.count("repetida") - 1
+    resultado["disco_bytes"] = m.cache_descargas.total
+
+    precarga = gestor.agregar("stub:limitada", None, limite=64 * 1024)  # Unos segundos a este ritmo
+    time.sleep(0.3)
+    segundos, _ = cronometrar(lambda: gestor.agregar("stub:limitada", None).terminado.wait(60))
+    resultado["quitar_limite_s"] = segundos if precarga.estado == "listo" else None  # Pedida ya: sigue sin el limite de la precarga
+
+    unas = []
+    for i in range(3):
+        segundos, _ = cronometrar(lambda: gestor.agregar(f"stub:sola{i}", None).terminado.wait(60))
+        unas.append(segundos)
+    resultado["una_cancion_max_s"] = max(unas)
+    segundos, _ = cronometrar(lambda: [t.terminado.wait(60) for t in [gestor.agregar(f"stub:juntas{i}", None) for i in range(20)]])
+    resultado["veinte_juntas_s"] = segundos  # Con MAX_DESCARGAS a la vez: unas cinco tandas de la mas lenta
+    resultado["veinte_juntas_por_una"] = segundos / max(unas)
+    return resultado
+
+
+def medir_miniaturas(m, servidor):
+    url = f"http://127.0.0.1:{servidor.server_address[1]}/miniatura.jpg"
+    servidor.archivos["/miniatura.jpg"] = servidor.archivos["/portada.jpg"]
+    lista = threading.Event()
+    inicio = time.perf_counter()
+    m.cache_miniaturas.pedir(url, lista.set)
+    lista.wait(30)
+    resultado = {"primera_ms": (time.perf_counter() - inicio) * 1000}
+    segundos = timeit.timeit(lambda: m.cache_miniaturas.local(url, m.LADO_MINIATURA_FILA), number=10000)
+    resultado["local_us"] = segundos / 10000 * 1e6
+    resultado["bajadas"] = servidor.pedidos.count("/miniatura.jpg")
+    return resultado
+
+
+def probar_viejo(file_path):
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', file_path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return float(result.stdout.strip())  # Lo que hacia obtener_duracion() al empezar cada cancion, antes de la cache
+
+
+def medir_audio(m):
+    faltan = [programa for programa in ("ffprobe", "ffmpeg") if not shutil.which(programa)]
+    if faltan:
+        return {"faltan": faltan}  # Sin ellos no hay nada que comparar: cuenta como falla, no como omitido
+
+    carpeta = tempfile.mkdtemp(prefix="audio_")
+    archivos = []
+    for i in range(100):
+        ruta = os.path.join(carpeta, f"tono{i}.wav")
+        generar_wav(ruta, 10.0, 220.0 + i)
+        archivos.append(ruta)
+    resultado = {}
+
+    biblioteca = os.path.join(carpeta, "biblioteca")
+    os.makedirs(biblioteca)
+    modelo = os.path.join(carpeta, "modelo.mp3")
+    subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=2", "-ac", "1", "-b:a", "32k", modelo], check=True)
+    mp3s = [os.path.join(biblioteca, f"pista{i:04d}.mp3") for i in range(MP3_BIBLIOTECA)]
+    for ruta in mp3s:
+        shutil.copyfile(modelo, ruta)
+    muestra = random.Random(7).sample(mp3s, 50)
+
+    segundos, _ = cronometrar(lambda: [probar_viejo(r) for r in muestra])
+    resultado["inicio_viejo_ms"] = segundos / len(muestra) * 1000  # Un ffprobe por cada cancion que empieza
+
+    archivo = os.path.join(carpeta, "metadata.json")
+    cache = m.CacheMetadatos(archivo)
+    segundos, _ = cronometrar(lambda: [cache.analizar(r) for r in mp3s[:100]])
+    resultado["analizar_mp3_ms"] = segundos / 100 * 1000
+    resultado["escaneo_inicial_estimado_s"] = segundos / 100 * MP3_BIBLIOTECA  # Una sola vez, en segundo plano
+    modelo_datos = cache.obtener(mp3s[0])
+    for ruta in mp3s[100:]:
+        st = os.stat(ruta)
+        cache.datos[cache.clave(ruta)] = dict(modelo_datos, tamano=st.st_size, mtime=st.st_mtime_ns)  # Lo que dejaria el escaneo
+    cache.cambios = True
+    cache.guardar()
+
+    def arrancar():
+        nueva = m.CacheMetadatos(archivo)
+        nueva.escanear(biblioteca)
+        return nueva
+    resultado["arranque_con_cache_s"], cache = cronometrar(arrancar)  # Solo stat por archivo: ningun ffprobe
+    segundos, duraciones = cronometrar(lambda: [cache.consultar(r)["duracion"] for r in muestra])
+    resultado["inicio_cache_us"] = segundos / len(muestra) * 1e6
+    resultado["duraciones_sin_cache"] = sum(1 for d in duraciones if not d)
+
+    conversor = m.ConversorMP3()
+    antes = os.times()
+    segundos, _ = cronometrar(lambda: [f.result() for f in [conversor.convertir(a) for a in archivos]])
+    despues = os.times()
+    resultado["mp3_100_canciones_s"] = segundos
+    resultado["mp3_100_canciones_cpu_s"] = (despues.children_user - antes.children_user) + (despues.children_system - antes.children_system)
+    shutil.rmtree(carpeta, ignore_errors=True)
+    return resultado
+
+
+def medir_control(m):
+    llenar_lista(m, 50)
+    servidor = m.ServidorControl(m.reproductor, puerto=0)
+    servidor.iniciar()
+    latencias = []
+    recibidos = []
+    emitidos = []
+    contar = lambda evento, datos: emitidos.append(evento)  # Todo lo emitido deberia llegarle a cada cliente
+    m.reproductor.suscribir(contar)
+
+    descargas = []  # Por cliente, los eventos "descarga" que llegaron con el titulo del trabajo
+
+    def empujar_descarga():
+        trabajo = m.TrabajoDescarga("benchmark", "busqueda de prueba")  # Un trabajo real, por el mismo camino que el gestor
+        trabajo.avisos.append(m.reproductor.al_cambiar_descarga)
+        m.gestor_descargas.cambiar(trabajo, "resolviendo")
+        trabajo.cancion = m.NodoCancion("Pista resuelta", None, None)
+        trabajo.en_lista = True  # Que no se sume a la lista
+        m.gestor_descargas.cambiar(trabajo, "descargando")
+
+    async def cliente(i, listos, todos_listos):
+        lector, escritor = await asyncio.open_connection("127.0.0.1", servidor.puerto, limit=1 << 20)
+        pendientes = {}
+        eventos = 0
+        titulos = []
+
+        async def leer():
+            nonlocal eventos
+            while linea := await lector.readline():
+                mensaje = json.loads(linea)
+                if "evento" in mensaje:
+                    eventos += 1
+                    if mensaje["evento"] == "descarga" and mensaje["trabajo"]:
+                        titulos.append(mensaje["trabajo"]["titulo"])
+                else:
+                    pendientes.pop(mensaje["id"]).set_result(mensaje)
+
+        tarea = asyncio.create_task(leer())
+
+        async def pedir(numero, comando, **argumentos):
+            futuro = asyncio.get_running_loop().create_future()
+            pendientes[numero] = futuro
+            inicio = time.perf_counter()
+            escritor.write((json.dumps({"id": numero, "comando": comando, "argumentos": argumentos, "token": servidor.token}) + "\n").encode())
+            await escritor.drain()
+            respuesta = await futuro
+            latencias.append(time.perf_counter() - inicio)
+            return respuesta
+
+        await pedir(1, "estado")
+        await pedir(2, "lista", desde=0, cantidad=20)
+        await pedir(3, "buscar", consulta="pista")
+        listos.append(i)
+        if len(listos) == CLIENTES_CONTROL:
+            todos_listos.set()
+        await todos_listos.wait()
+        if i < 10:
+            await pedir(4, "siguiente")  # Cada cambio llega a todos los clientes
+        if i == 0:
+            await asyncio.get_running_loop().run_in_executor(None, empujar_descarga)
+        await asyncio.sleep(1.0)
+        recibidos.append(eventos)
+        descargas.append(titulos == ["busqueda de prueba", "Pista resuelta"])
+        escritor.close()
+        tarea.cancel()
+
+    async def correr():
+        listos, todos_listos = [], asyncio.Event()
+        await asyncio.gather(*(cliente(i, listos, todos_listos) for i in range(CLIENTES_CONTROL)))
+
+    async def intruso(lineas):
+        lector, escritor = await asyncio.open_connection("127.0.0.1", servidor.puerto)
+        escritor.write(lineas)
+        respuestas = await asyncio.wait_for(lector.read(), 5)  # Hasta que el servidor corta
+        escritor.close()
+        return respuestas.count(b'"ok": true')
+
+    segundos, _ = cronometrar(lambda: asyncio.run(correr()))
+    pedido = json.dumps({"id": 1, "comando": "estado"})
+    pagina_web = f"POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: text/plain\r\nContent-Length: {len(pedido)}\r\n\r\n{pedido}\n"
+    ejecutados_sin_token = asyncio.run(intruso(pagina_web.encode())) + asyncio.run(intruso((pedido + "\n").encode()))
+    m.reproductor.desuscribir(contar)
+    m.reproductor.detener()
+    latencias.sort()
+    return {
+        "clientes": CLIENTES_CONTROL,
+        "total_s": segundos,
+        "pedido_p50_ms": statistics.median(latencias) * 1000,
+        "pedido_p99_ms": latencias[int(len(latencias) * 0.99)] * 1000,
+        "eventos_perdidos": len(emitidos) - min(recibidos),
+        "descargas_perdidas": descargas.count(False),  # Clientes sin el progreso de la descarga
+        "ejecutados_sin_token": ejecutados_sin_token  # Un fetch de una pagina web y un pedido sin token: se cortan sin respuesta
+    }
+
+
+def medir_ordenes(m):
+    llenar_lista(m, 50)
+    reproductor = m.reproductor
+    canciones = list(reproductor.lista.orden)
+    azar = random.Random(22)
+    ordenes = [("siguiente",)] * 30 + [("anterior",)] * 20 + [("alternar_pausa",)] * 5 + [("tocar_actual",)] * 3 + [("detener",)]
+    ReproductorSintetico.abiertos = []
+    reproductor.pedir("tocar_actual")
+    reproductor.ordenes.join()
+
+    enviadas = 0
+    inicio = time.perf_counter()
+    while (transcurrido := time.perf_counter() - inicio) < SEGUNDOS_ORDENES:
+        for _ in range(int(transcurrido * ORDENES_POR_S) - enviadas):
+            eleccion = azar.random()
+            if eleccion < 0.1:
+                reproductor.pedir("saltar", azar.choice(canciones))
+            elif eleccion < 0.15:
+                reproductor.pedir("posicionar", azar.random() * DURACION_SINTETICA)
+            else:
+                reproductor.pedir(*azar.choice(ordenes))
+            enviadas += 1
+        time.sleep(0.001)
+    reproductor.ordenes.join()
+    total = time.perf_counter() - inicio
+    time.sleep(0.2)  # Que el motor cierre lo que haya quedado por cerrar
+
+    actual = reproductor.instantanea["actual"]
+    vivos = [p for p in ReproductorSintetico.abiertos if not p.cerrado]
+    resultado = {
+        "ordenes": enviadas,
+        "ordenes_por_s": enviadas / total,
+        "aperturas_por_orden": len(ReproductorSintetico.abiertos) / enviadas,  # Sin agrupar, cada salto abriria su propio reproductor
+        "reproductores_sin_cerrar": max(len(vivos) - 2, 0),  # El que suena y el preparado para el relevo
+        "instantanea_desfasada": int(actual is not None and actual["pos"] != reproductor.lista.posicion(reproductor.lista.PTR))
+    }
+    reproductor.detener()
+    return resultado
+
+
+def medir_biblioteca(m):
+    reproductor = m.reproductor
+    reproductor.detener()
+    reiniciar_caches(m)
+    viejo = time.time() - m.EDAD_TEMPORALES - 60
+    for i in range(ARCHIVOS_BIBLIOTECA):
+        open(os.path.join(m.MUSIC_FOLDER, f"v{i:010d}.wav"), "wb").close()
+    for i in range(20):
+        ruta = os.path.join(m.MUSIC_FOLDER, f"temp_v{i:010d}.webm.part")  # Descargas cortadas hace rato
+        open(ruta, "wb").close()
+        os.utime(ruta, (viejo, viejo))
+
+    lista = m.lista_reproduccion
+    with reproductor.candado:
+        lista.diario = None
+        lista.vaciar()
+        for i, datos in enumerate(fixture_lista(CANCIONES_BIBLIOTECA)):
+            ajena = f"C:\\Users\\otro\\Music\\{datos['video_id']}.wav" if i < ARCHIVOS_BIBLIOTECA else None  # Otra maquina
+            lista.agregar(m.NodoCancion(datos["titulo"], datos["url"], datos["miniatura"], ajena, datos["video_id"]))
+        lista.guardar(m.PLAYLIST_FILE)
+        lista.abrir_diario(m.PLAYLIST_FILE)  # Como en la aplicacion: cada reubicacion es una linea del diario
+
+    resultado = {}
+    resultado["reconciliar_s"], _ = cronometrar(m.reconciliador.reconciliar)
+    resultado["reubicadas"] = sum(1 for c in lista.orden if c.file_path and os.path.dirname(c.file_path) == m.MUSIC_FOLDER)
+    resultado["temporales_restantes"] = sum(1 for nombre in os.listdir(m.MUSIC_FOLDER) if nombre.startswith("temp_"))
+    resultado["sin_cambios_s"], _ = cronometrar(m.reconciliador.reconciliar)  # Lo que cuesta cada revision sin inotify
+
+    m.reconciliador.iniciar()
+    resultado["inotify"] = int(bool(m.reconciliador.vigilante))
+    if m.reconciliador.vigilante:
+        cancion = lista.orden[ARCHIVOS_BIBLIOTECA]
+        inicio = time.perf_counter()
+        open(os.path.join(m.MUSIC_FOLDER, f"{cancion.video_id}.wav"), "wb").close()  # Copiado a mano
+        esperar(lambda: cancion.file_path is not None, 30)
+        resultado["archivo_nuevo_s"] = time.perf_counter() - inicio  # Incluye ESPERA_EVENTOS
+        time.sleep(m.ESPERA_EVENTOS + 0.5)  # Que termine de guardar antes de medir el borrado
+        inicio = time.perf_counter()
+        os.remove(cancion.file_path)
+        esperar(lambda: cancion.file_path is None, 30)
+        resultado["archivo_borrado_s"] = time.perf_counter() - inicio
+    with reproductor.candado:
+        lista.diario = None
+        lista.vaciar()
+    reiniciar_caches(m)
+    return resultado
+
+
+def medir_arranque(carpeta):
+    escribir_lista(os.path.join(carpeta, "playlist.json"), fixture_lista(100000))
+    programa = f"""
+import importlib.util, json, sys, time
+inicio = time.perf_counter()
+spec = importlib.util.spec_from_file_location("reproductor_arranque", {os.path.join(carpeta, "main.py")!r})
+m = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(m)
+importado = time.perf_counter() - inicio
+m.gestor_descargas.agregar = lambda *args, **kwargs: None  # Sin red: la primera cancion no tiene archivo
+m.precargador.actualizar = lambda: None
+paginas = []
+m.reproductor.suscribir(lambda evento, datos: paginas.append(time.perf_counter() - inicio) if evento == "lista" else None)
+m.reproductor.iniciar()
+iniciado = time.perf_counter() - inicio
+while not m.reproductor.cargada:
+    time.sleep(0.005)
+print(json.dumps({{"importar_s": importado, "iniciar_s": iniciado - importado, "lista_s": time.perf_counter() - inicio,
+                  "primera_pagina_s": paginas[0], "yt_dlp_importado": "yt_dlp" in sys.modules}}))
+"""
+    tiempos = []
+    for _ in range(3):
+        salida = subprocess.run([sys.executable, "-c", programa], capture_output=True, text=True, cwd=carpeta, timeout=300)
+        tiempos.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+    resultado = {clave: statistics.median(t[clave] for t in tiempos) for clave in ("importar_s", "iniciar_s", "primera_pagina_s", "lista_s")}
+    resultado["yt_dlp_antes_de_la_lista"] = int(any(t["yt_dlp_importado"] for t in tiempos))
+    return resultado
+
+
+def medir_migracion(m):
+    carpeta = tempfile.mkdtemp(prefix="migracion_")
+    archivo = os.path.join(carpeta, "playlist.json")
+    shutil.copy(os.path.join(RAIZ, "playlist.json"), archivo)  # La que viene con el repo, guardada por la primera version
+    with open(archivo, "r", encoding="utf-8") as f:
+        originales = json.load(f)
+    lista = m.ListaReproduccion()
+    lista.cargar(archivo)
+    lista.guardar(archivo)
+    with open(archivo, "r", encoding="utf-8") as f:
+        guardadas = json.load(f)
+    shutil.rmtree(carpeta, ignore_errors=True)
+    return {
+        "migrada": int(lista.migrada),
+        "canciones_perdidas": len(originales) - len(guardadas),
+        "sin_id": sum(1 for d in guardadas if not d["video_id"]),
+        "id_distinto_de_la_portada": sum(1 for o, d in zip(originales, guardadas) if d["video_id"] and f"/{d['video_id']}/" not in o["miniatura"]),
+        "urls_firmadas": sum(1 for d in guardadas if m.es_url_directa(d["url"]))  # Deberian quedar en stream_url o descartadas
+    }
+
+
+def medir_telemetria(m):
+    telemetria = m.Telemetria()
+
+    def tramo():
+        with telemetria.medir("benchmark"):
+            pass
+    veces = 100000
+    resultado = {
+        "tramo_us": timeit.timeit(tramo, number=veces) / veces * 1e6,
+        "contador_us": timeit.timeit(lambda: telemetria.contar("benchmark"), number=veces) / veces * 1e6
+    }
+    telemetria.activa = False
+    resultado["tramo_apagada_us"] = timeit.timeit(tramo, number=veces) / veces * 1e6
+    return resultado
+
+
+def aplanar(datos, prefijo=""):
+    planos = {}
+    for clave, valor in datos.items():
+        nombre = f"{prefijo}{clave}"
+        if isinstance(valor, dict):
+            planos.update(aplanar(valor, nombre + "."))
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            planos[nombre] = valor
+    return planos
+
+
+def mejor_alto(nombre):
+    return nombre.endswith("_por_s") or nombre.endswith((".clientes", ".ordenes", ".reubicadas", ".inotify"))
+
+
+def mejor(actual, nueva, nombre=""):
+    if isinstance(actual, dict) and isinstance(nueva, dict):
+        return {clave: mejor(valor, nueva.get(clave), f"{nombre}.{clave}") for clave, valor in actual.items()}
+    numeros = [v for v in (actual, nueva) if isinstance(v, (int, float)) and not isinstance(v, bool)]
+    if len(numeros) < 2:
+        return actual
+    return max(numeros) if mejor_alto(nombre) else min(numeros)  # Cada medicion por separado, la mejor de las vueltas
+
+
+def comparar(actual, base):
+    regresiones = []
+    planos_base = aplanar(base)
+    for nombre, valor in aplanar(actual).items():
+        anterior = planos_base.get(nombre)
+        if anterior is None:
+            continue
+        diferencia = anterior - valor if mejor_alto(nombre) else valor - anterior
+        minimo = next((v for sufijo, v in MINIMOS.items() if nombre.endswith(sufijo)), 0)
+        if diferencia > max(abs(anterior) * TOLERANCIA, minimo):
+            regresiones.append({"medicion": nombre, "base": anterior, "actual": valor})
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del reproductor, sin red ni ventana")
+    parser.add_argument("--grande", action="store_true", help="Tambien listas de 1.000.000 de canciones")
+    parser.add_argument("--solo", help="Secciones separadas por coma: lista, interfaz, reproduccion, descargas, miniaturas, audio, ordenes, control, biblioteca, arranque, migracion, telemetria")
+    parser.add_argument("--salida", help="Archivo donde escribir el JSON en vez de stdout")
+    parser.add_argument("--guardar-base", action="store_true", help="Guarda el resultado como nueva base de comparacion")
+    parser.add_argument("--latencia", type=float, default=LATENCIA, help="Segundos del extractor falso")
+    parser.add_argument("--ancho-banda", type=float, default=ANCHO_BANDA, help="Bytes por segundo del servidor local")
+    argumentos = parser.parse_args()
+    secciones = set(argumentos.solo.split(",")) if argumentos.solo else None
+    pedida = lambda nombre: secciones is None or nombre in secciones
+
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    carpeta = tempfile.mkdtemp(prefix="benchmark_")
+    salida_real = sys.stdout
+    resultados = {"maquina": {"python": sys.version.split()[0], "plataforma": sys.platform, "cpus": os.cpu_count()}}
+    regresiones = []
+    try:
+        with contextlib.redirect_stdout(sys.stderr):  # Los print del reproductor y de yt-dlp no ensucian el JSON
+            m = cargar_reproductor(carpeta)
+            servidor = abrir_servidor_audio(argumentos.ancho_banda)
+            base_wav = os.path.join(carpeta, "base.wav")
+            generar_wav(base_wav, 30.0)
+            with open(base_wav, "rb") as f:
+                servidor.archivos["/base.wav"] = f.read()
+            servidor.archivos["/portada.jpg"] = os.urandom(30 * 1024)  # Sin ffmpeg se guarda tal cual
+            resueltos, agregar_extractor = instalar_extractor(m, servidor, argumentos.latencia)
+
+            tamanos = TAMANOS + ((TAMANO_GRANDE,) if argumentos.grande else ())
+            mediciones = {
+                "lista": lambda: {str(n): medir_lista(m, n) for n in tamanos},
+                "interfaz": lambda: {str(n): medir_interfaz(carpeta, servidor, n, argumentos.latencia) for n in TAMANOS_INTERFAZ},
+                "reproduccion": lambda: medir_reproduccion(m),
+                "descargas": lambda: medir_descargas(m, servidor, resueltos, agregar_extractor),
+                "miniaturas": lambda: medir_miniaturas(m, servidor),
+                "audio": lambda: medir_audio(m),
+                "ordenes": lambda: medir_ordenes(m),
+                "control": lambda: medir_control(m),
+                "biblioteca": lambda: medir_biblioteca(m),
+                "arranque": lambda: medir_arranque(carpeta),
+                "migracion": lambda: medir_migracion(m),
+                "telemetria": lambda: medir_telemetria(m)
+            }
+            for nombre, medir in mediciones.items():
+                if pedida(nombre):
+                    resultados[nombre] = medir()
+
+            if not argumentos.guardar_base and os.path.exists(BASE_FILE):
+                with open(BASE_FILE, "r", encoding="utf-8") as f:
+                    base = json.load(f)
+                regresiones = comparar(resultados, base)
+                for _ in range(REPETICIONES):
+                    dudosas = {r["medicion"].split(".")[0] for r in regresiones} & REPETIBLES
+                    if not dudosas:
+                        break
+                    for nombre in dudosas:
+                        resultados[nombre] = mejor(resultados[nombre], mediciones[nombre](), nombre)  # Con una sola CPU una vuelta lenta puede ser ruido
+                    regresiones = comparar(resultados, base)
+                resultados["regresiones"] = regresiones
+    finally:
+        shutil.rmtree(carpeta, ignore_errors=True)
+
+    faltan = [f"{nombre}: {programa}" for nombre, seccion in resultados.items() if isinstance(seccion, dict) for programa in seccion.get("faltan", [])]
+    if argumentos.guardar_base:
+        base = {}
+        if os.path.exists(BASE_FILE):
+            with open(BASE_FILE, "r", encoding="utf-8") as f:
+                base = json.load(f)  # Con --solo solo se reemplazan las secciones medidas
+        base.update(resultados)
+        with open(BASE_FILE, "w", encoding="utf-8") as f:
+            json.dump(base, f, ensure_ascii=False, indent=2)
+
+    texto = json.dumps(resultados, ensure_ascii=False, indent=2)
+    if argumentos.salida:
+        with open(argumentos.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        salida_real.write(texto + "\n")
+    for regresion in regresiones:
+        print(f"Regresion en {regresion['medicion']}: {regresion['base']:.4g} -> {regresion['actual']:.4g}", file=sys.stderr)
+    for falta in faltan:
+        print(f"No se pudo medir {falta}", file=sys.stderr)
+    return 1 if regresiones or faltan else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,73 +1,743 @@
 
 import flet as ft 
 
-from ffpyplayer.player import MediaPlayer 
-import yt_dlp 
-
 import threading  
+import asyncio
+import sys
 import subprocess
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 import time  
+from collections import deque
 
 import json  
 import os 
+import ntpath
+import glob
+import urllib.request
+import hashlib
+import re
+import random
+import bisect
+import math
+import heapq
+import unicodedata
+import select
+import struct
+import ctypes
+import ctypes.util
+import socket
+import secrets
+import hmac
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+INICIO_PROCESO = time.perf_counter()  # Para medir el arranque: ventana pintada y lista cargada
+yt_dlp = None  # Se importa recien en la primera busqueda o descarga: tarda casi medio segundo
+MediaPlayer = None  # Y ffpyplayer al abrir el primer audio
+
+def cargar_yt_dlp():
+    global yt_dlp
+    if yt_dlp is None:
+        import yt_dlp as modulo
+        yt_dlp = modulo
+    return yt_dlp
+
+def cargar_ffpyplayer():
+    global MediaPlayer
+    if MediaPlayer is None:
+        from ffpyplayer.player import MediaPlayer as clase
+        MediaPlayer = clase
+    return MediaPlayer
 
-estado_pausado = False  
-reproduccion_id = 0 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MUSIC_FOLDER = os.path.join(BASE_DIR, "music")
 PLAYLIST_FILE = os.path.join(BASE_DIR, "playlist.json")
+METADATA_FILE = os.path.join(BASE_DIR, "metadata.json")  # Duracion, codec, etc. de cada archivo ya analizado
+MANIFIESTO_FILE = os.path.join(MUSIC_FOLDER, "manifest.json")  # Archivos descargados por id de video
+MINIATURAS_FOLDER = os.path.join(BASE_DIR, "thumbnails")  # Portadas ya achicadas, por hash del contenido
+EXTENSIONES_AUDIO = ('.mp3', '.m4a', '.webm', '.opus', '.ogg', '.wav')
+USAR_DIARIO = True  # Guarda cada cambio como una linea en playlist.json.log en vez de reescribir todo
+MAX_OPS_DIARIO = 500  # Operaciones en el diario antes de compactarlo en playlist.json
+MIN_RENUMERAR = 1024  # Claves intercaladas o borradas que se toleran antes de renumerar la lista entera
+MAX_DESCARGAS = 4  # Descargas que corren al mismo tiempo: con mas, la cancion que se espera comparte la conexion con todas las otras
+MAX_DESCARGAS_FONDO = 2  # Descargas de listas importadas, aparte y con sus propias instancias de yt-dlp para no demorar la cancion pedida
+MAX_IMPORTAR = 1000  # Canciones que se toman como maximo de una lista o canal de YouTube
+PRECARGA_SIGUIENTES = 3  # Canciones que se bajan por adelantado despues de la actual
+PRECARGA_ANTERIORES = 1  # Y antes de la actual, para anterior()
+MAX_MB_PRECARGA = 2048  # No se precarga si la carpeta de musica ya ocupa mas que esto
+MAX_MB_MUSICA = 4096  # Sobre esto se borran los archivos que ninguna cancion usa, del menos usado al mas
+MAX_MB_MINIATURAS = 100  # Sobre esto se borran las portadas usadas hace mas tiempo
+LADO_MINIATURA = 300  # Portada de la cancion actual
+LADO_MINIATURA_FILA = 40  # Portada chica de cada fila de la lista
+MINIATURA_VACIA = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGNwcnICAAGQAMfpYXBSAAAAAElFTkSuQmCC"  # PNG gris de 1x1, sin red
+LIMITE_PRECARGA = 2 * 1024 * 1024  # Bytes por segundo para cada descarga anticipada, None sin limite
+CONVERTIR_MP3 = False  # Se guarda el audio tal cual viene (opus/webm, m4a); True para pasarlo a mp3 aparte
+PREPARAR_ANTES = 5.0  # Segundos antes del final en que se abre la siguiente cancion en pausa
+CROSSFADE = 0.0  # Segundos de fundido entre canciones, 0 para pasar sin hueco
+AGRUPAR_SALTOS = 0.03  # Segundos que se esperan mas saltos seguidos: solo se abre la cancion donde terminan
+TRANSMITIR = True  # Suena desde la url directa mientras se descarga, en vez de esperar el archivo
+ESPERA_BUFFER = 1.0  # Segundos sin avanzar que cuentan como corte del stream
+PAUSA_BUFFER = 2.0  # Segundos en pausa para que el stream vuelva a llenar el buffer
+MAX_HISTORIAL = 1000  # Canciones que recuerda el modo aleatorio para volver con anterior()
+MAX_CANDIDATOS = 500  # Canciones que se puntuan por palabra en la busqueda aproximada, de las mas parecidas a las menos
+LOTE_INICIO = 500  # Canciones por tanda al revisar archivos e indexar despues de cargar la lista
+VIGILAR_CARPETA = True  # Sigue los cambios de la carpeta de musica con inotify; sin inotify se revisa cada PERIODO_REVISION
+PERIODO_REVISION = 60.0  # Segundos entre revisiones de la carpeta cuando no hay inotify; solo se escanea si cambio
+ESPERA_EVENTOS = 0.5  # Segundos sin eventos para dar por terminada una rafaga (una descarga, una copia de varios archivos)
+EDAD_TEMPORALES = 3600  # Segundos sin cambios para dar por abandonado un temp_* de una descarga que se corto
+TAMANO_BLOQUE = 100  # Filas que se crean de una vez; el resto se agrega al bajar con el scroll
+ALTO_FILA = 62  # Alto fijo de cada fila, para que la lista no tenga que medirlas
+MARGEN_URL = 300  # Segundos antes de vencer en que la url directa ya se considera vencida
+PREFIJO_MINIATURA = "https://i.ytimg.com/vi/"  # Portadas de YouTube: se arman con el id del video
+PORTADAS_YOUTUBE = ("hqdefault.jpg", "mqdefault.jpg", "sddefault.jpg", "maxresdefault.jpg", "hq720.jpg", "default.jpg")
+SERVIDOR_CONTROL = False  # Con la ventana abierta el control local (JSON por lineas) solo se abre si se pide; sin ventana siempre
+SOCKET_CONTROL = os.path.join(BASE_DIR, "control.sock")  # Socket Unix con permisos solo para el usuario: una pagina web no llega
+HOST_CONTROL = "127.0.0.1"  # Solo desde esta maquina
+PUERTO_CONTROL = 8765  # TCP solo donde no hay sockets Unix, o si se pide un puerto; siempre con token
+TOKEN_CONTROL_FILE = os.path.join(BASE_DIR, "control.token")  # Lo que hay que mandar en el primer pedido por TCP
+MAX_EVENTOS_CLIENTE = 1000  # Eventos sin leer antes de desconectar a un cliente lento
+LIMITE_LINEA_CONTROL = 64 * 1024  # Bytes por pedido
+TELEMETRIA = True  # Tiempos y fallos de descargas, ffprobe, guardado, etc.; cuesta unos pocos microsegundos por medicion
+MAX_EVENTOS_TELEMETRIA = 1000  # Ultimos eventos que se guardan en memoria
+BALDES_TIEMPO = (0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Limites de los histogramas, en segundos
+PUERTO_METRICAS = 8766  # /metrics en formato Prometheus y /eventos en JSON; None para no abrirlo
+TRAZA_FILE = None  # Ruta de un .jsonl donde se anota cada evento; None para no escribirlo
+
+class Tramo:
+    __slots__ = ("telemetria", "nombre", "etiquetas", "inicio")  # Uno por cada medicion: que sea liviano
+
+    def __init__(self, telemetria, nombre, etiquetas):
+        self.telemetria = telemetria  
+        self.nombre = nombre  
+        self.etiquetas = etiquetas  
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, error, traza):
+        if isinstance(error, DescargaCancelada):
+            error = None  # Cancelar no es un fallo
+        self.telemetria.registrar(self.nombre, time.perf_counter() - self.inicio, error, **self.etiquetas)
+        return False  # La excepcion sigue su camino
+
+class Telemetria:
+    def __init__(self, capacidad=MAX_EVENTOS_TELEMETRIA):
+        self.activa = TELEMETRIA  
+        self.tiempos = {}  # (nombre, etiquetas) -> cantidad por balde de BALDES_TIEMPO (el ultimo es +Inf) y la suma
+        self.contadores = {}  # (nombre, etiquetas) -> total
+        self.eventos = deque(maxlen=capacidad)  # Ultimos tramos y fallos; los mas viejos se pisan
+        self.traza = None  # Archivo JSONL con cada evento, si se pidio
+        self.candado = threading.Lock()
+
+    def medir(self, nombre, **etiquetas):
+        return Tramo(self, nombre, etiquetas)  # with telemetria.medir("ffprobe"): ...
+
+    def registrar(self, nombre, segundos, error=None, **etiquetas):
+        if not self.activa:
+            return
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        evento = {"t": time.time(), "tipo": "tramo", "nombre": nombre, "segundos": round(segundos, 6), **etiquetas}
+        with self.candado:
+            serie = self.tiempos.get(clave)
+            if serie is None:
+                serie = self.tiempos[clave] = [0] * (len(BALDES_TIEMPO) + 1) + [0.0]
+            serie[bisect.bisect_left(BALDES_TIEMPO, segundos)] += 1
+            serie[-1] += segundos
+            if error is not None:
+                evento["error"] = str(error) or type(error).__name__
+                if not getattr(error, "contado", False):  # Un tramo de adentro ya lo pudo contar
+                    self.sumar(("fallos", (("donde", nombre),)), 1)
+                    error.contado = True  # Ni los tramos ni el except de afuera lo vuelven a contar
+            self.anotar(evento)
+
+    def contar(self, nombre, cantidad=1, **etiquetas):
+        if not self.activa:
+            return
+        with self.candado:
+            self.sumar((nombre, tuple(sorted(etiquetas.items()))), cantidad)
+
+    def fallo(self, donde, error):
+        if not self.activa or getattr(error, "contado", False):
+            return  # Ya lo conto el tramo por el que paso
+        with self.candado:
+            self.sumar(("fallos", (("donde", donde),)), 1)
+            self.anotar({"t": time.time(), "tipo": "fallo", "donde": donde, "error": str(error) or type(error).__name__})
+
+    def sumar(self, clave, cantidad):
+        self.contadores[clave] = self.contadores.get(clave, 0) + cantidad
+
+    def anotar(self, evento):
+        self.eventos.append(evento)
+        if self.traza:
+            self.traza.write(json.dumps(evento, ensure_ascii=False) + "\n")
+
+    def abrir_traza(self, archivo):
+        self.traza = open(archivo, "a", encoding="utf-8", buffering=1)  # Una linea por evento, sin esperar al cierre
+
+    def recientes(self, cantidad=100):
+        with self.candado:
+            return list(self.eventos)[-cantidad:]
+
+    def prometheus(self):
+        with self.candado:
+            tiempos = {clave: list(serie) for clave, serie in self.tiempos.items()}
+            contadores = dict(self.contadores)
+
+        lineas = []
+        vistos = set()
+        for (nombre, etiquetas), serie in sorted(tiempos.items()):
+            metrica = f"reproductor_{nombre}_segundos"
+            if metrica not in vistos:
+                vistos.add(metrica)
+                lineas.append(f"# TYPE {metrica} histogram")
+            acumulado = 0
+            for limite, cantidad in zip(BALDES_TIEMPO + ("+Inf",), serie):
+                acumulado += cantidad
+                lineas.append(f"{metrica}_bucket{formato_etiquetas(etiquetas + (('le', limite),))} {acumulado}")
+            lineas.append(f"{metrica}_sum{formato_etiquetas(etiquetas)} {serie[-1]:.6f}")
+            lineas.append(f"{metrica}_count{formato_etiquetas(etiquetas)} {acumulado}")
+        for (nombre, etiquetas), total in sorted(contadores.items()):
+            metrica = f"reproductor_{nombre}_total"
+            if metrica not in vistos:
+                vistos.add(metrica)
+                lineas.append(f"# TYPE {metrica} counter")
+            lineas.append(f"{metrica}{formato_etiquetas(etiquetas)} {total}")
+        return "\n".join(lineas) + "\n"
+
+    def servir(self, host=HOST_CONTROL, puerto=PUERTO_METRICAS):
+        telemetria = self
+
+        class Pedido(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    cuerpo, tipo = telemetria.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/eventos":
+                    cuerpo, tipo = json.dumps(telemetria.recientes(), ensure_ascii=False).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def log_message(self, *args):
+                pass  # Sin una linea en consola por cada consulta
+
+        try:
+            servidor = ThreadingHTTPServer((host, puerto), Pedido)
+        except OSError as e:
+            print(f"No se pudieron exponer las metricas en {host}:{puerto}: {e}")
+            return None
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        return servidor
+
+def formato_etiquetas(etiquetas):
+    if not etiquetas:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in etiquetas) + "}"
+
+telemetria = Telemetria()
 
 class NodoCancion:
-    def __init__(self, titulo, url, miniatura, file_path=None):
+    __slots__ = ("titulo", "pagina", "portada", "file_path", "video_id", "stream_url", "expira",
+                 "anterior", "siguiente", "posicion")  # Sin __dict__ por nodo: cuenta con listas enormes
+
+    def __init__(self, titulo, url, miniatura, file_path=None, video_id=None, stream_url=None, expira=None):
         self.titulo = titulo  
-        self.url = url 
+        self.video_id = sys.intern(video_id) if video_id else video_id  # Id estable del video, None en canciones viejas
+        self.url = url  # Pagina del video, no vence; None si no se conoce
         self.miniatura = miniatura 
         self.file_path = file_path  
+        self.stream_url = stream_url  # Url directa del audio, vence en unas horas
+        self.expira = expira  # Epoch en que vence stream_url, None si no se sabe
 
         self.anterior = None 
         self.siguiente = None  
+        self.posicion = 0  # Indice absoluto dentro de ListaReproduccion.orden
+
+    @property
+    def url(self):
+        return self.pagina or url_de_video(self.video_id)
+
+    @url.setter
+    def url(self, url):
+        self.pagina = None if url == url_de_video(self.video_id) else url  # La de siempre se arma con el id
+
+    @property
+    def miniatura(self):
+        if type(self.portada) is int:
+            return f"{PREFIJO_MINIATURA}{self.video_id}/{PORTADAS_YOUTUBE[self.portada]}"
+        return self.portada
+
+    @miniatura.setter
+    def miniatura(self, miniatura):
+        base = f"{PREFIJO_MINIATURA}{self.video_id}/"
+        nombre = miniatura[len(base):] if self.video_id and miniatura and miniatura.startswith(base) else None
+        self.portada = PORTADAS_YOUTUBE.index(nombre) if nombre in PORTADAS_YOUTUBE else miniatura  # Portada estandar: solo su numero
+
+    @property
+    def duracion(self):
+        return duracion_de(self.file_path)  # Sale de la cache, sin ffprobe
+
+    def stream_vigente(self):
+        return bool(self.stream_url and self.expira and self.expira - MARGEN_URL > time.time())
+
+    def fuente(self):
+        if self.stream_vigente():
+            return self.stream_url  # Se baja directo, sin pasar por el extractor
+        if self.url:
+            return self.url
+        return f"ytsearch1:{self.titulo}"  # Playlist vieja sin id: se busca de nuevo por titulo
+
+    def actualizar_fuente(self, info):
+        miniatura = self.miniatura
+        self.video_id = sys.intern(info['id']) if info.get('id') else self.video_id
+        self.miniatura = miniatura  # Se compacta de nuevo con el id que llego
+        self.url = info.get('webpage_url') or url_de_video(self.video_id) or self.url
+        self.stream_url = info.get('url')
+        self.expira = expiracion_de(self.stream_url) if self.stream_url else None
+
+    def texto_busqueda(self):
+        datos = cache_metadatos.consultar(self.file_path) if self.file_path else None
+        extras = [datos.get("artista"), datos.get("album")] if datos else []
+        return " ".join([self.titulo] + [e for e in extras if e])  # Titulo mas etiquetas del archivo
 
     def to_dict(self):
         return {
             "titulo": self.titulo,
             "url": self.url,
             "miniatura": self.miniatura,
-            "file_path": self.file_path
+            "file_path": self.file_path,
+            "video_id": self.video_id,
+            "stream_url": self.stream_url,
+            "expira": self.expira
         }  # Convierte el nodo en un diccionario 
 
     @staticmethod
     def from_dict(data):
+        video_id = data.get("video_id") or id_de_miniatura(data["miniatura"])  # Las guardadas antes del id lo tienen en la portada
+        url, stream_url, expira = data["url"], data.get("stream_url"), data.get("expira")
+        if "expira" not in data and es_url_directa(url):  # Formato viejo: url guardaba el link firmado
+            url, stream_url, expira = url_de_video(video_id), url, expiracion_de(url)
+        if expira and expira - MARGEN_URL <= time.time():
+            stream_url = expira = None  # Ya vencida: ocupa cerca de 1 KB y no sirve para nada
         return NodoCancion(
             data["titulo"],
-            data["url"],
+            url,
             data["miniatura"],
-            data.get("file_path")
+            data.get("file_path"),
+            video_id,
+            stream_url,
+            expira
         )  # Crea un nodo desde un diccionario 
 
+def es_url_directa(url):
+    if not url:
+        return False
+    partes = urlparse(url)
+    return partes.netloc.endswith("googlevideo.com") or "videoplayback" in partes.path
+
+def expiracion_de(url):
+    try:
+        return int(parse_qs(urlparse(url).query)["expire"][0])
+    except (KeyError, ValueError):
+        return None
+
+def id_de_miniatura(miniatura):
+    partes = urlparse(miniatura or "")
+    ruta = partes.path.split("/")
+    if partes.netloc.endswith("ytimg.com") and len(ruta) > 2 and ruta[1] in ("vi", "vi_webp") and ruta[2]:
+        return ruta[2]  # i.ytimg.com/vi/<id>/hqdefault.jpg
+    return None
+
+def url_de_video(video_id):
+    return f"https://www.youtube.com/watch?v={video_id}" if video_id else None
+
+def normalizar(texto):
+    if texto.isascii():
+        return texto.lower()  # Sin tildes que quitar: lo mas comun, y mucho mas rapido
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))  # Sin tildes: "canción" -> "cancion"
+
+def palabras(texto):
+    return re.findall(r"\w+", normalizar(texto))
+
+def trigramas(palabra):
+    palabra = f" {palabra} "
+    return {palabra[i:i + 3] for i in range(len(palabra) - 2)}
+
+def distancia(a, b):
+    previa, actual = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        anterior, previa, actual = previa, actual, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            actual[j] = min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                actual[j] = min(actual[j], anterior[j - 2] + 1)  # Dos letras cruzadas cuentan como un solo error
+    return actual[len(b)]
+
+def primeros_json(texto, cantidad):
+    decodificador = json.JSONDecoder()
+    primeros = []
+    i = texto.find("[") + 1
+    try:
+        while len(primeros) < cantidad:
+            i = texto.find("{", i)  # Salta la coma y la sangria hasta el proximo objeto
+            if i < 0:
+                break
+            d, i = decodificador.raw_decode(texto, i)
+            primeros.append(d)
+    except ValueError:
+        return []  # Se deja que json.loads diga que esta roto
+    return primeros
+
+class IndiceBusqueda:
+    def __init__(self):
+        self.por_palabra = {}  # Palabra -> nodos cuyo titulo la contiene; el nodo solo, sin set, si es uno
+        self.palabras = []  # Ordenadas, para buscar por prefijo con bisect
+        self.desordenadas = False  # Si se agregaron palabras al final desde el ultimo sort
+        self.por_trigrama = None  # Trigrama -> palabras, para la busqueda aproximada: se arma recien en la primera
+        self.de_nodo = {}  # Nodo -> sus palabras, tambien para no reindexar si no cambiaron
+        self.candado = threading.RLock()
+
+    def agregar(self, cancion):
+        with self.candado:
+            propias = tuple({sys.intern(p) for p in palabras(cancion.texto_busqueda())})  # Una sola copia de cada palabra para todo el indice
+            self.de_nodo[cancion] = propias
+            for palabra in propias:
+                nodos = self.por_palabra.get(palabra)
+                if nodos is None:
+                    self.por_palabra[palabra] = cancion  # La mayoria de las palabras (numeros, nombres) estan en un solo titulo
+                    self.palabras.append(palabra)  # Se ordena una sola vez, al buscar: insort por palabra era cuadratico
+                    self.desordenadas = True
+                    if self.por_trigrama is not None:
+                        self.agregar_trigramas(palabra)
+                elif isinstance(nodos, set):
+                    nodos.add(cancion)
+                elif nodos is not cancion:
+                    self.por_palabra[palabra] = {nodos, cancion}
+
+    def nodos(self, palabra):
+        nodos = self.por_palabra[palabra]
+        return nodos if isinstance(nodos, set) else (nodos,)
+
+    def agregar_trigramas(self, palabra):
+        for trigrama in trigramas(palabra):
+            self.por_trigrama.setdefault(trigrama, set()).add(palabra)
+
+    def ordenar(self):
+        if self.desordenadas:
+            self.palabras.sort()  # Timsort: casi ordenadas, es lineal
+            self.desordenadas = False
+
+    def eliminar(self, cancion):
+        with self.candado:
+            self.ordenar()
+            for palabra in self.de_nodo.pop(cancion, ()):
+                nodos = self.por_palabra[palabra]
+                if isinstance(nodos, set):
+                    nodos.discard(cancion)
+                    if nodos:
+                        continue
+                del self.por_palabra[palabra]  # Ya ningun titulo la usa
+                del self.palabras[bisect.bisect_left(self.palabras, palabra)]
+                for trigrama in trigramas(palabra) if self.por_trigrama is not None else ():
+                    grupo = self.por_trigrama[trigrama]
+                    grupo.discard(palabra)
+                    if not grupo:
+                        del self.por_trigrama[trigrama]
+
+    def vaciar(self):
+        with self.candado:
+            self.por_palabra, self.palabras, self.por_trigrama, self.de_nodo = {}, [], None, {}
+            self.desordenadas = False
+
+    def actualizar(self, cancion):
+        with self.candado:
+            if cancion in self.de_nodo and set(self.de_nodo[cancion]) != set(palabras(cancion.texto_busqueda())):
+                self.eliminar(cancion)  # Llegaron etiquetas nuevas del archivo
+                self.agregar(cancion)
+
+    def con_prefijo(self, prefijo):
+        i = bisect.bisect_left(self.palabras, prefijo)
+        while i < len(self.palabras) and self.palabras[i].startswith(prefijo):
+            yield self.palabras[i]
+            i += 1
+
+    def buscar(self, consulta, limite=20):
+        partes = palabras(consulta)
+        if not partes:
+            return []
+        with self.candado:
+            self.ordenar()
+            encontrados = self.por_prefijo(partes, limite)
+            if not encontrados:
+                encontrados = self.aproximado(partes, limite)  # Tolera errores de tipeo
+        return encontrados
+
+    def por_prefijo(self, partes, limite):
+        coincidencias = [list(self.con_prefijo(parte)) for parte in partes]
+        tamanos = [sum(len(self.nodos(p)) for p in lista) for lista in coincidencias]
+        base = tamanos.index(min(tamanos))  # Se parte de la palabra mas selectiva
+        resto = [parte for i, parte in enumerate(partes) if i != base]
+
+        encontrados = []
+        vistos = set()
+        for palabra in coincidencias[base]:
+            for cancion in self.nodos(palabra):
+                if cancion in vistos:
+                    continue
+                vistos.add(cancion)
+                propias = self.de_nodo[cancion]
+                if all(any(p.startswith(parte) for p in propias) for parte in resto):
+                    encontrados.append(cancion)
+                    if len(encontrados) >= limite:
+                        return encontrados
+        return encontrados
+
+    def parecidas(self, parte):
+        if self.por_trigrama is None:
+            self.por_trigrama = {}
+            for palabra in self.palabras:
+                self.agregar_trigramas(palabra)  # La mayoria de las busquedas encuentra por prefijo: no se paga antes
+        buscados = trigramas(parte)
+        comunes = {}
+        for trigrama in buscados:
+            for palabra in self.por_trigrama.get(trigrama, ()):
+                comunes[palabra] = comunes.get(palabra, 0) + 1
+        similitudes = {}
+        for palabra, n in comunes.items():
+            similitud = n / (len(buscados) + len(palabra) - n)  # Jaccard: una palabra tiene len(palabra) trigramas, sin armarlos
+            if similitud >= 0.3:
+                similitudes[palabra] = similitud
+        if not similitudes:
+            for palabra, n in comunes.items():
+                if n >= 2 and abs(len(palabra) - len(parte)) <= 1 and distancia(parte, palabra) <= 1:
+                    similitudes[palabra] = 0.3  # Una letra cambiada o dos cruzadas en una palabra corta rompen casi todos sus trigramas
+        return similitudes
+
+    def aproximado(self, partes, limite):
+        puntajes = {}
+        cortadas = []  # (similitudes, vistas) de las partes que llegaron a MAX_CANDIDATOS
+        for parte in partes:
+            similitudes = self.parecidas(parte)
+            vistas = {}  # Cancion -> similitud de su palabra mas parecida a esta parte
+            for palabra in sorted(similitudes, key=similitudes.get, reverse=True):
+                similitud = similitudes[palabra]
+                for cancion in self.nodos(palabra):
+                    if cancion not in vistas:
+                        vistas[cancion] = similitud
+                        if len(vistas) >= MAX_CANDIDATOS:
+                            break  # Una palabra comun ("artista") no obliga a recorrer toda la lista
+                if len(vistas) >= MAX_CANDIDATOS:
+                    cortadas.append((similitudes, vistas))
+                    break
+            for cancion, similitud in vistas.items():
+                puntajes[cancion] = puntajes.get(cancion, 0) + similitud
+        for similitudes, vistas in cortadas:
+            for cancion in puntajes:
+                if cancion not in vistas:  # Quedo afuera del corte: se mira en sus propias palabras
+                    puntajes[cancion] += max((similitudes.get(p, 0) for p in self.de_nodo[cancion]), default=0)
+        return heapq.nlargest(limite, puntajes, key=puntajes.get)
+
+class OrdenAleatorio:
+    def __init__(self, lista, azar=None):
+        self.lista = lista
+        self.azar = azar or random.Random()
+        self.historial = [lista.PTR] if lista.PTR else []  # Lo que sono, en orden, y las ya sorteadas para despues
+        self.cursor = len(self.historial) - 1  # Indice de la actual en historial
+        self.candado = threading.Lock()  # La precarga consulta las proximas desde otros hilos
+        self.nueva_ronda()
+
+    def nueva_ronda(self):
+        self.pendientes = list(self.lista.orden)  # Copia de punteros: la lista no se reenlaza ni se guarda
+        self.sorteadas = 0  # pendientes[:sorteadas] ya salieron en esta ronda (Fisher-Yates de a un paso)
+        self.sonadas = set(self.historial[self.cursor:self.cursor + 1])
+
+    def sortear(self, otra_ronda=True):
+        for _ in range(2):
+            while self.sorteadas < len(self.pendientes):
+                i = self.sorteadas
+                j = self.azar.randrange(i, len(self.pendientes))
+                self.pendientes[i], self.pendientes[j] = self.pendientes[j], self.pendientes[i]
+                self.sorteadas += 1
+                cancion = self.pendientes[i]
+                if cancion in self.sonadas or not self.lista.contiene(cancion):
+                    continue  # Las eliminadas se descartan recien cuando salen sorteadas
+                self.sonadas.add(cancion)
+                return cancion
+            if not otra_ronda or not self.lista.longitud:
+                return None
+            self.nueva_ronda()  # Con repetir todas: se vuelve a mezclar la lista entera
+        return None
+
+    def extender(self, hasta, otra_ronda=True):
+        while len(self.historial) <= hasta:
+            cancion = self.sortear(otra_ronda)
+            if cancion is None:
+                return False
+            self.historial.append(cancion)
+        return True
+
+    def sincronizar(self):
+        ptr = self.lista.PTR
+        if ptr is not None and (self.cursor < 0 or self.historial[self.cursor] is not ptr):
+            self.elegir(ptr)  # PTR cambio por fuera (se elimino la actual, se cargo la lista)
+
+    def elegir(self, cancion):
+        for futura in self.historial[self.cursor + 1:]:
+            self.sonadas.discard(futura)
+            self.pendientes.append(futura)  # Sorteadas por adelantado: vuelven al sorteo
+        del self.historial[self.cursor + 1:]
+        self.historial.append(cancion)
+        self.cursor += 1
+        self.sonadas.add(cancion)
+
+    def siguiente(self):
+        with self.candado:
+            self.sincronizar()
+            self.cursor += 1
+            while self.extender(self.cursor):
+                cancion = self.historial[self.cursor]
+                if self.lista.contiene(cancion):
+                    if self.cursor > 2 * MAX_HISTORIAL:
+                        del self.historial[:self.cursor - MAX_HISTORIAL]  # De a bloques: costo constante por cancion
+                        self.cursor = MAX_HISTORIAL
+                    return cancion
+                del self.historial[self.cursor]  # Se elimino despues de sortearla
+            self.cursor -= 1
+            return None
+
+    def anterior(self):
+        with self.candado:
+            self.sincronizar()
+            for i in range(self.cursor - 1, -1, -1):
+                if self.lista.contiene(self.historial[i]):
+                    self.cursor = i
+                    return self.historial[i]
+            return None  # Al principio del historial no hay a donde volver
+
+    def saltar(self, cancion):
+        with self.candado:
+            self.elegir(cancion)
+
+    def agregar(self, cancion):
+        self.pendientes.append(cancion)  # Queda en la parte sin sortear de la ronda actual
+
+    def proximas(self, cantidad):
+        with self.candado:
+            self.sincronizar()
+            self.extender(self.cursor + cantidad)
+            return [c for c in self.historial[self.cursor + 1:self.cursor + 1 + cantidad] if self.lista.contiene(c)]
+
+    def previas(self, cantidad):
+        with self.candado:
+            return [c for c in reversed(self.historial[max(self.cursor - cantidad, 0):max(self.cursor, 0)]) if self.lista.contiene(c)]
+
+    def al_final(self):
+        with self.candado:
+            self.sincronizar()
+            return not self.extender(self.cursor + 1, otra_ronda=False)
+
 class ListaReproduccion:
     def __init__(self):
         self.PTR = None 
         self.longitud = 0  
+        self.orden = []  # Nodos en orden absoluto, para ubicar posiciones sin recorrer
+        self.enteras = 0  # Claves enteras repartidas (0, 1, 2...): las que se agregan al final
+        self.intercaladas = []  # Claves fraccionarias repartidas entre dos vecinas, ordenadas
+        self.borradas = []  # Claves de nodos que ya no estan, ordenadas: corren a las de atras sin renumerarlas
+        self.busqueda = IndiceBusqueda()
+
+        self.archivo = None
+        self.diario = None  # Ruta del diario de operaciones, None si no se usa
+        self.pendientes = []  # Operaciones aun no escritas en el diario
+        self.ops_diario = 0
+        self.ptr_guardado = None  # Cancion actual segun el diario
+        self.estado_diario = "nuevo"
+        self.base = None  # (archivo, sha1) de la ultima foto leida o escrita, para no volver a leerla
+        self.migrada = False  # Si cargar() convirtio un playlist.json viejo
+        self.cargando = False  # Mientras cargar() arma los nodos, sin indexarlos todavia
+        self.aleatorio = None  # OrdenAleatorio mientras se mezcla; None para seguir el orden de la lista
+
+    def registrar(self, op):
+        if self.diario:
+            self.pendientes.append(op)
+
+    def posicion(self, cancion):
+        clave = cancion.posicion  # Cuantas claves repartidas hay antes, menos las borradas
+        return math.ceil(clave) + bisect.bisect_left(self.intercaladas, clave) - bisect.bisect_left(self.borradas, clave)
+
+    def dar_claves(self, pos, cantidad):
+        nuevas = self.orden[pos:pos + cantidad]  # Ya ubicadas en orden: solo ellas cambian de clave
+        if pos + cantidad == len(self.orden):
+            for cancion in nuevas:
+                cancion.posicion = self.enteras  # Al final: enteras, sin tocar las listas ordenadas
+                self.enteras += 1
+            return
+        desde = self.orden[pos - 1].posicion if pos > 0 else -1.0
+        hasta = self.orden[pos + cantidad].posicion
+        paso = (hasta - desde) / (cantidad + 1)
+        claves = [desde + paso * (i + 1) for i in range(cantidad)]
+        if not desde < claves[0] <= claves[-1] < hasta or len(set(claves)) < cantidad:
+            self.renumerar()  # Se acabo la precision del float entre esas dos: todas enteras de nuevo
+            return
+        for cancion, clave in zip(nuevas, claves):
+            cancion.posicion = clave
+            bisect.insort(self.intercaladas, clave)
+
+    def borrar_claves(self, canciones):
+        for cancion in canciones:
+            bisect.insort(self.borradas, cancion.posicion)
+
+    def renumerar(self):
+        for i, cancion in enumerate(self.orden):
+            cancion.posicion = i
+        self.enteras = len(self.orden)
+        self.intercaladas = []
+        self.borradas = []
+
+    def ordenar_claves(self):
+        if len(self.intercaladas) + len(self.borradas) > max(len(self.orden), MIN_RENUMERAR):
+            self.renumerar()  # Cada tanto, para que las listas ordenadas no crezcan sin limite: O(1) amortizado
 
     def agregar(self, cancion):
+        self.insertar(cancion, len(self.orden))  # Al final de la lista, entre la ultima y la primera del circulo
+
+    def insertar(self, cancion, pos):
         if not self.PTR:
             self.PTR = cancion  
             cancion.siguiente = cancion.anterior = cancion 
         else:
-            FINAL = self.PTR.anterior 
-            FINAL.siguiente = cancion  
-            cancion.anterior = FINAL 
-            cancion.siguiente = self.PTR  
-            self.PTR.anterior = cancion  
-
+            ANTERIOR = self.orden[pos - 1]
+            SIGUIENTE = ANTERIOR.siguiente 
+            ANTERIOR.siguiente = cancion  
+            cancion.anterior = ANTERIOR 
+            cancion.siguiente = SIGUIENTE  
+            SIGUIENTE.anterior = cancion  
+
+        self.orden.insert(pos, cancion)
+        self.dar_claves(pos, 1)  # Entre la de antes y la de despues: las demas no cambian
         self.longitud += 1  
+        if self.aleatorio:
+            self.aleatorio.agregar(cancion)
+        if not self.cargando:
+            self.busqueda.agregar(cancion)
+        cache_descargas.retener(cancion.file_path)
+        if self.diario:
+            self.registrar({"op": "agregar", "pos": pos, "cancion": cancion.to_dict()})  # Al cargar no hay diario: ni se arma
 
     def eliminar(self, cancion):
         if self.longitud == 0:
             return  
         
+        pos = self.posicion(cancion)
         if self.longitud == 1 and self.PTR == cancion:
             self.PTR = None  
         else:
@@ -77,182 +747,2593 @@ class ListaReproduccion:
             cancion.anterior.siguiente = cancion.siguiente  
             cancion.siguiente.anterior = cancion.anterior
 
+        del self.orden[pos]
+        self.borrar_claves([cancion])
         self.longitud -= 1 
-
-        if cancion.file_path and os.path.exists(cancion.file_path):
-            try:
-                os.remove(cancion.file_path)
-            except Exception as e:
-                print(f"Error al eliminar archivo: {e}")
+        self.busqueda.eliminar(cancion)
+        cache_descargas.soltar(cancion.file_path)  # El archivo queda si otra cancion lo usa
+        self.registrar({"op": "eliminar", "pos": pos})
+        self.ordenar_claves()
 
     def siguiente(self):
-        if self.PTR:
+        if self.aleatorio:
+            self.PTR = self.aleatorio.siguiente() or self.PTR
+        elif self.PTR:
             self.PTR = self.PTR.siguiente  
 
     def anterior(self):
-        if self.PTR:
+        if self.aleatorio:
+            self.PTR = self.aleatorio.anterior() or self.PTR
+        elif self.PTR:
             self.PTR = self.PTR.anterior  
 
-    def recorrer(self):
-        canciones = []
+    def mezclar(self, activo):
+        self.aleatorio = OrdenAleatorio(self) if activo else None  # Solo cambia el orden de reproduccion, no la lista
+
+    def proximas(self, cantidad):
+        if self.aleatorio:
+            return self.aleatorio.proximas(cantidad)
+        nodos, nodo = [], self.PTR
+        for _ in range(cantidad if nodo else 0):
+            nodo = nodo.siguiente
+            nodos.append(nodo)
+        return nodos
+
+    def previas(self, cantidad):
+        if self.aleatorio:
+            return self.aleatorio.previas(cantidad)
+        nodos, nodo = [], self.PTR
+        for _ in range(cantidad if nodo else 0):
+            nodo = nodo.anterior
+            nodos.append(nodo)
+        return nodos
+
+    def al_final(self):
+        if self.aleatorio:
+            return self.aleatorio.al_final()
+        return not self.PTR or self.PTR is self.orden[-1]
+
+    def indice(self, cancion):
+        return (self.posicion(cancion) - self.posicion(self.PTR)) % self.longitud  # Indice contado desde PTR
+
+    def en_indice(self, i):
+        return self.orden[(self.posicion(self.PTR) + i) % self.longitud]
+
+    def ir_a(self, i):
         if self.PTR:
-            nodo = self.PTR
-            for _ in range(self.longitud):  
-                canciones.append(nodo)
-                nodo = nodo.siguiente
-        return canciones  
+            self.PTR = self.en_indice(i)
+
+    def buscar(self, consulta, limite=20):
+        return sorted(self.busqueda.buscar(consulta, limite), key=self.posicion)  # En el orden de la lista
+
+    def saltar(self, cancion):
+        if self.contiene(cancion):
+            self.PTR = cancion
+            if self.aleatorio:
+                self.aleatorio.saltar(cancion)
+
+    def intercambiar(self, pos):
+        b = (pos + 1) % len(self.orden)
+        primero, segundo = self.orden[pos], self.orden[b]  # Nodos contiguos en el circulo
+
+        primero.anterior.siguiente = segundo 
+        segundo.anterior = primero.anterior  
+
+        primero.siguiente = segundo.siguiente  
+        segundo.siguiente.anterior = primero  
+
+        segundo.siguiente = primero 
+        primero.anterior = segundo 
+
+        self.orden[pos], self.orden[b] = segundo, primero
+        primero.posicion, segundo.posicion = segundo.posicion, primero.posicion  # Siguen creciendo en orden, tambien al dar la vuelta
+        self.registrar({"op": "intercambiar", "pos": pos})
+
+    def actualizar_archivo(self, cancion, file_path):
+        cache_descargas.soltar(cancion.file_path)
+        cancion.file_path = file_path
+        cache_descargas.retener(file_path)
+        self.registrar({"op": "archivo", "pos": self.posicion(cancion), "file_path": file_path})
+
+    def mover(self, cancion, pasos):
+        if self.longitud <= 1:  
+            return False
+
+        actual = self.posicion(cancion)
+        destino = max(0, min(self.longitud - 1, actual + pasos))  # No se da la vuelta al circulo
+        if abs(destino - actual) == 1:
+            self.intercambiar(min(actual, destino))  # Un lugar: el intercambio ya es una sola operacion
+            return True
+        return self.empalmar([cancion], destino)  # Un solo corte y una linea del diario, no un intercambio por paso
+
+    def desenlazar(self, canciones):
+        for cancion in canciones:
+            cancion.anterior.siguiente = cancion.siguiente  # Los vecinos no elegidos quedan unidos entre si
+            cancion.siguiente.anterior = cancion.anterior
+
+    def empalmar(self, canciones, pos):
+        k = len(canciones)
+        if not k or k >= self.longitud:
+            return False
+        seleccion = set(canciones)
+        posiciones = [self.posicion(c) for c in canciones]
+        pos = max(0, min(pos, self.longitud - k))  # Indice de la primera en la lista sin las elegidas
+        if posiciones == list(range(pos, pos + k)):
+            return False  # Ya estaban ahi y en ese orden
+
+        self.desenlazar(canciones)
+        inicio = min(min(posiciones), pos)  # Fuera de [inicio, fin) nada cambia de lugar
+        fin = max(max(posiciones) + 1, pos + k)
+        resto = [c for c in self.orden[inicio:fin] if c not in seleccion]
+        self.orden[inicio:fin] = resto[:pos - inicio] + canciones + resto[pos - inicio:]  # Una sola pasada por el tramo, no k intercambios
+        self.borrar_claves(canciones)
+        self.dar_claves(pos, k)
+        ANTERIOR = self.orden[pos - 1] if pos > 0 else self.orden[-1]
+        SIGUIENTE = ANTERIOR.siguiente
+        for cancion in canciones:
+            ANTERIOR.siguiente = cancion
+            cancion.anterior = ANTERIOR
+            ANTERIOR = cancion
+        ANTERIOR.siguiente = SIGUIENTE
+        SIGUIENTE.anterior = ANTERIOR
+
+        self.registrar({"op": "empalmar", "posiciones": posiciones, "pos": pos})  # Una linea del diario para todo el bloque
+        self.ordenar_claves()
+        return True
+
+    def eliminar_varias(self, canciones):
+        seleccion = set(canciones)
+        if not seleccion:
+            return
+        posiciones = sorted(self.posicion(c) for c in seleccion)
+        siguiente = self.PTR
+        if self.PTR in seleccion and not self.aleatorio and len(seleccion) < self.longitud:
+            while siguiente in seleccion:
+                siguiente = siguiente.siguiente  # La primera que sigue y no se borra
+
+        self.desenlazar(seleccion)
+        inicio, fin = posiciones[0], posiciones[-1] + 1
+        self.orden[inicio:fin] = [c for c in self.orden[inicio:fin] if c not in seleccion]  # Solo el tramo entre la primera y la ultima: lo de atras se corre en bloque
+        self.borrar_claves(seleccion)
+        self.longitud = len(self.orden)
+        for cancion in seleccion:
+            self.busqueda.eliminar(cancion)
+            cache_descargas.soltar(cancion.file_path)
+
+        if not self.orden:
+            self.PTR = None
+        elif self.PTR in seleccion:
+            self.PTR = (self.aleatorio.siguiente() if self.aleatorio else siguiente) or self.orden[0]
+        self.registrar({"op": "eliminar_varias", "posiciones": posiciones})
+        self.ordenar_claves()
+
+    def contiene(self, cancion):
+        pos = self.posicion(cancion)
+        return 0 <= pos < len(self.orden) and self.orden[pos] is cancion
+
+    def recorrer(self):
+        if not self.PTR:
+            return
+        inicio = self.posicion(self.PTR)
+        for i in range(inicio - len(self.orden), inicio):
+            yield self.orden[i]  # Desde PTR dando la vuelta, sin copiar la lista (indices negativos al principio)
+
+    def __iter__(self):
+        return self.recorrer()
+
+    def __len__(self):
+        return self.longitud
 
     def vaciar(self):
-        for cancion in self.recorrer():  
-            if cancion.file_path and os.path.exists(cancion.file_path):
-                try:
-                    os.remove(cancion.file_path)
-                except Exception as e:
-                    print(f"Error al eliminar archivo: {e}")
+        for cancion in self.orden:  
+            cache_descargas.soltar(cancion.file_path)  # Los archivos los borra la cache si hace falta
         self.PTR = None  
         self.longitud = 0
+        self.orden = []
+        self.enteras = 0
+        self.intercaladas = []
+        self.borradas = []
+        self.busqueda.vaciar()
+        if self.aleatorio:
+            self.aleatorio = OrdenAleatorio(self)  # Sigue mezclando lo que se agregue despues
 
     def guardar(self, archivo):
-        with open(archivo, "w", encoding="utf-8") as f:
-            json.dump([c.to_dict() for c in self.recorrer()], f, ensure_ascii=False, indent=2)
-
-    def cargar(self, archivo):
+        temporal = archivo + ".tmp"
+        with telemetria.medir("guardar_lista"):
+            texto = json.dumps([c.to_dict() for c in self.orden], ensure_ascii=False, indent=2)  # En el orden en que se muestra
+            with open(temporal, "w", encoding="utf-8") as f:
+                f.write(texto)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporal, archivo)  # Un corte a mitad de escritura no deja el archivo truncado
+        self.base = (archivo, hashlib.sha1(texto.encode("utf-8")).hexdigest())
+
+    def cargar(self, archivo, al_empezar=None):
         if not os.path.exists(archivo):
             return  
+        self.diario = None
         self.vaciar()
-        with open(archivo, "r", encoding="utf-8") as f:
-            datos = json.load(f)
-            for d in datos:
-                if "file_path" in d and d["file_path"] and not os.path.exists(d["file_path"]):
-                    d["file_path"] = None
+        self.cargando = True  # El indice y los archivos se revisan despues, en segundo plano
+        try:
+            with open(archivo, "rb") as f:
+                crudo = f.read()
+            self.base = (archivo, hashlib.sha1(crudo).hexdigest())  # Firma del diario: el contenido, no el inodo
+            texto = crudo.decode("utf-8")
+            primeros = primeros_json(texto, TAMANO_BLOQUE) if al_empezar else []
+            for d in primeros:
+                self.agregar(NodoCancion.from_dict(d))
+            if primeros:
+                al_empezar()  # La primera pagina se puede mostrar sin esperar al resto del archivo ni al diario
+            datos = json.loads(texto)
+            self.migrada = any("expira" not in d for d in datos)  # Guardada por una version anterior
+            for d in datos[len(primeros):]:
                 self.agregar(NodoCancion.from_dict(d)) 
 
+            if self.orden:
+                self.PTR = self.orden[0]
+            for op in self.leer_diario(archivo):
+                self.aplicar(op)
+        finally:
+            self.cargando = False
+        self.ptr_guardado = self.PTR
+
+    def completar(self, candado, lote=LOTE_INICIO):
+        canciones = list(self.orden)  # Los archivos que faltan los revisa el reconciliador, con un solo escaneo
+        for i in range(0, len(canciones), lote):
+            parte = canciones[i:i + lote]
+            with candado:
+                for cancion in parte:
+                    if not self.contiene(cancion):
+                        continue  # Se elimino mientras tanto
+                    if cancion not in self.busqueda.de_nodo:
+                        self.busqueda.agregar(cancion)
+
+    def leer_diario(self, archivo):
+        diario = archivo + ".log"
+        self.estado_diario = "nuevo"  # nuevo, valido, roto o ajeno
+        if not os.path.exists(diario):
+            return []
+        ops = []
+        with open(diario, "r", encoding="utf-8") as f:
+            for i, linea in enumerate(f):
+                try:
+                    op = json.loads(linea)
+                except ValueError:
+                    self.estado_diario = "roto"  # Linea cortada por un cierre inesperado
+                    break
+                if i == 0:
+                    st = os.stat(archivo)
+                    if op.get("base") not in (self.firma(archivo), [st.st_size, st.st_mtime_ns, st.st_ino]):  # Los diarios de antes guardaban el inodo
+                        self.estado_diario = "ajeno"  # Es de otra version de playlist.json
+                        return []
+                    self.estado_diario = "valido"
+                    continue
+                ops.append(op)
+        return ops
+
+    def aplicar(self, op):
+        if op["op"] == "agregar":
+            self.insertar(NodoCancion.from_dict(op["cancion"]), op["pos"])
+        elif op["op"] == "eliminar":
+            self.eliminar(self.orden[op["pos"]])
+        elif op["op"] == "intercambiar":
+            self.intercambiar(op["pos"])
+        elif op["op"] == "empalmar":
+            self.empalmar([self.orden[p] for p in op["posiciones"]], op["pos"])
+        elif op["op"] == "eliminar_varias":
+            self.eliminar_varias([self.orden[p] for p in op["posiciones"]])
+        elif op["op"] == "archivo":
+            self.actualizar_archivo(self.orden[op["pos"]], op["file_path"])
+        elif op["op"] == "actual":
+            self.PTR = self.orden[op["pos"]]
+
+    def firma(self, archivo):
+        if self.base and self.base[0] == archivo:
+            return self.base[1]
+        with open(archivo, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()  # Igual en una copia, un backup o una carpeta sincronizada
+
+    def abrir_diario(self, archivo):
+        self.archivo = archivo
+        self.diario = archivo + ".log"
+        self.pendientes = []
+        if not os.path.exists(archivo):
+            self.compactar()
+            return
+        ops = self.leer_diario(archivo)
+        if self.estado_diario == "ajeno":
+            apartado = f"{self.diario}.{time.strftime('%Y%m%d-%H%M%S')}"
+            os.replace(self.diario, apartado)  # Puede tener cambios que no llegaron a la foto: no se pisa
+            print(f"El diario no corresponde a {archivo}; se guardo aparte en {apartado}")
+        if self.migrada:
+            self.compactar()  # Se reescribe una vez en el formato nuevo
+        elif self.estado_diario == "valido":
+            self.ops_diario = len(ops)  # cargar() ya lo aplico, se sigue escribiendo al final
+        elif self.estado_diario == "roto":
+            self.compactar()  # No se puede seguir escribiendo detras de una linea cortada
+        else:
+            self.iniciar_diario()
+
+    def iniciar_diario(self):
+        with open(self.diario, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"base": self.firma(self.archivo)}) + "\n")
+        self.ops_diario = 0
+
+    def guardar_cambios(self):
+        if not self.diario:
+            return
+        if self.PTR is not self.ptr_guardado and self.PTR:
+            self.registrar({"op": "actual", "pos": self.posicion(self.PTR)})  # Para retomar en la misma cancion
+            self.ptr_guardado = self.PTR
+        if self.pendientes:
+            with telemetria.medir("guardar_diario"), open(self.diario, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in self.pendientes))
+                f.flush()
+                os.fsync(f.fileno())
+            self.ops_diario += len(self.pendientes)
+            self.pendientes = []
+
+        if self.ops_diario >= MAX_OPS_DIARIO:
+            self.compactar()
+
+    def compactar(self):
+        self.guardar(self.archivo)
+        self.iniciar_diario()
+        self.ptr_guardado = None  # La foto no guarda la actual, se anota en el diario nuevo
+        self.guardar_cambios()
+
 lista_reproduccion = ListaReproduccion()  
-player = None 
-reproduciendo = False  
+
+class CacheMetadatos:
+    def __init__(self, archivo):
+        self.archivo = archivo 
+        self.datos = {}  # Ruta -> metadatos del archivo
+        self.cambios = False 
+        self.candado = threading.Lock()
+        if os.path.exists(archivo):
+            try:
+                with open(archivo, "r", encoding="utf-8") as f:
+                    self.datos = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error al leer metadatos: {e}")
+
+    def clave(self, file_path):
+        return os.path.normcase(os.path.abspath(file_path))
+
+    def consultar(self, file_path):
+        return self.datos.get(self.clave(file_path))  # Sin tocar el disco; el escaneo revalida
+
+    def consultar_original(self, file_path):
+        return self.consultar(file_path) or self.datos.get(ntpath.normcase(file_path))  # Tambien rutas guardadas en Windows
+
+    def obtener(self, file_path):
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        datos = self.consultar(file_path)
+        if datos and datos["mtime"] == st.st_mtime_ns and datos["tamano"] == st.st_size:
+            return datos
+        return None
+
+    def analizar(self, file_path):
+        datos = self.obtener(file_path)
+        if datos:
+            return datos
+
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None  # Se borro mientras tanto
+        datos = {
+            "duracion": None, "bitrate": None, "codec": None, "frecuencia": None, "artista": None, "album": None,
+            "tamano": st.st_size, "mtime": st.st_mtime_ns, "hash": hash_archivo(file_path)
+        }
+        try:
+            cmd = [
+                'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                '-show_entries', 'format=duration,bit_rate:format_tags=artist,album:stream=codec_name,sample_rate',
+                '-of', 'json', file_path
+            ]
+            with telemetria.medir("ffprobe"):
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            info = json.loads(result.stdout)
+            formato = info.get("format", {})
+            stream = (info.get("streams") or [{}])[0]
+            datos["duracion"] = float(formato["duration"]) if formato.get("duration") else None
+            datos["bitrate"] = int(formato["bit_rate"]) if formato.get("bit_rate") else None
+            datos["codec"] = stream.get("codec_name")
+            datos["frecuencia"] = int(stream["sample_rate"]) if stream.get("sample_rate") else None
+            etiquetas = {k.lower(): v for k, v in formato.get("tags", {}).items()}
+            datos["artista"] = etiquetas.get("artist")
+            datos["album"] = etiquetas.get("album")
+        except (OSError, ValueError) as e:
+            print(f"Error al analizar {file_path}: {e}")
+            telemetria.fallo("analizar", e)
+            return datos  # No se guarda, se reintenta en el proximo escaneo
+
+        with self.candado:
+            self.datos[self.clave(file_path)] = datos
+            self.cambios = True
+        return datos
+
+    def guardar(self):
+        with self.candado:
+            if not self.cambios:
+                return
+            datos = dict(self.datos)
+            self.cambios = False
+        temporal = self.archivo + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, self.archivo)
+
+    def escanear(self, carpeta):
+        with self.candado:
+            for clave in [c for c in self.datos if not os.path.exists(c)]:
+                del self.datos[clave]  # Archivos que ya no estan
+                self.cambios = True
+        with os.scandir(carpeta) as entradas:
+            for entrada in entradas:
+                if entrada.is_file() and entrada.name.lower().endswith(EXTENSIONES_AUDIO):
+                    self.analizar(entrada.path)
+        self.guardar()
+
+def hash_archivo(file_path):
+    h = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+def duracion_de(file_path):
+    if not file_path:
+        return None
+    datos = cache_metadatos.consultar(file_path)
+    return datos["duracion"] if datos else None
+
+def formato_tiempo(segundos):
+    segundos = int(segundos)
+    horas, resto = divmod(segundos, 3600)
+    if horas:
+        return f"{horas}:{resto // 60:02d}:{resto % 60:02d}"
+    return f"{resto // 60}:{resto % 60:02d}"
+
+cache_metadatos = CacheMetadatos(METADATA_FILE)
 
 if not os.path.exists(MUSIC_FOLDER):
     os.makedirs(MUSIC_FOLDER)
 
-def descargar_mp3(url, titulo):
-    safe_title = "".join(c for c in titulo if c.isalnum() or c in " -_").rstrip() 
-    output_path = os.path.join(MUSIC_FOLDER, f"{safe_title}.mp3")  
+class CacheDescargas:
+    def __init__(self, carpeta, manifiesto, max_bytes):
+        self.carpeta = carpeta 
+        self.manifiesto = manifiesto 
+        self.max_bytes = max_bytes 
+        self.archivos = {}  # Nombre de archivo -> {"id", "tamano", "usado"}
+        self.por_id = {}  # Id del video -> nombre de archivo
+        self.referencias = {}  # Nombre de archivo -> canciones de la lista que lo usan
+        self.total = 0  # Bytes de todos los archivos del manifiesto
+        self.cambios = False 
+        self.candado = threading.RLock()
+        if os.path.exists(manifiesto):
+            try:
+                with open(manifiesto, "r", encoding="utf-8") as f:
+                    self.archivos = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error al leer el manifiesto: {e}")
+        for nombre, datos in self.archivos.items():
+            if datos.get("id"):
+                self.por_id[datos["id"]] = nombre
+            self.total += datos["tamano"]
+
+    def nombre(self, file_path):
+        return os.path.basename(file_path) if file_path else None
+
+    def descartar(self, file_path):
+        nombre = self.nombre(file_path)
+        with self.candado:
+            if nombre in self.referencias:
+                return  # Alguna cancion todavia lo usa; se va con la limpieza normal
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            print(f"Error al eliminar archivo: {e}")
+            return
+        with self.candado:
+            self.quitar(nombre)
+
+    def buscar(self, video_id):
+        with self.candado:
+            nombre = self.por_id.get(video_id)
+            if nombre is None:
+                return None
+            file_path = os.path.join(self.carpeta, nombre)
+            if not os.path.exists(file_path):
+                self.quitar(nombre)  # Lo borraron a mano
+                return None
+            self.usar(file_path)
+            return file_path
+
+    def registrar(self, file_path, video_id=None, usado=None):
+        nombre = self.nombre(file_path)
+        try:
+            tamano = os.path.getsize(file_path)
+        except OSError:
+            return
+        with self.candado:
+            self.quitar(nombre)
+            self.archivos[nombre] = {"id": video_id, "tamano": tamano, "usado": usado or time.time()}
+            if video_id:
+                self.por_id[video_id] = nombre
+            self.total += tamano
+            self.cambios = True
+
+    def quitar(self, nombre):
+        datos = self.archivos.pop(nombre, None)
+        if datos is None:
+            return
+        if datos.get("id") and self.por_id.get(datos["id"]) == nombre:
+            del self.por_id[datos["id"]]
+        self.total -= datos["tamano"]
+        self.cambios = True
+
+    def usar(self, file_path):
+        with self.candado:
+            datos = self.archivos.get(self.nombre(file_path))
+            if datos:
+                datos["usado"] = time.time()  # Se guarda con el proximo cambio del manifiesto
+                self.cambios = True
+
+    def retener(self, file_path):
+        nombre = self.nombre(file_path)
+        if nombre:
+            with self.candado:
+                self.referencias[nombre] = self.referencias.get(nombre, 0) + 1
+
+    def soltar(self, file_path):
+        nombre = self.nombre(file_path)
+        if not nombre:
+            return
+        with self.candado:
+            n = self.referencias.get(nombre, 0) - 1
+            if n > 0:
+                self.referencias[nombre] = n
+            else:
+                self.referencias.pop(nombre, None)
+
+    def liberar(self):
+        with self.candado:
+            if self.total <= self.max_bytes:
+                return
+            libres = sorted(
+                (datos["usado"], nombre) for nombre, datos in self.archivos.items()
+                if nombre not in self.referencias
+            )
+            borrar = []
+            total = self.total
+            for _, nombre in libres:
+                if total <= self.max_bytes:
+                    break
+                borrar.append(nombre)
+                total -= self.archivos[nombre]["tamano"]
 
-    if os.path.exists(output_path):
+        for nombre in borrar:  # Fuera del candado: el disco puede tardar
+            try:
+                os.remove(os.path.join(self.carpeta, nombre))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error al eliminar archivo: {e}")
+                continue  # En uso; se intenta en la proxima limpieza
+            with self.candado:
+                if nombre not in self.referencias:
+                    self.quitar(nombre)
+
+    def sincronizar(self):
+        with self.candado:
+            conocidos = set(self.archivos)
+        vistos = set()
+        with os.scandir(self.carpeta) as entradas:
+            for entrada in entradas:
+                nombre = entrada.name
+                if not entrada.is_file() or not nombre.lower().endswith(EXTENSIONES_AUDIO) or nombre.startswith("temp_"):
+                    continue
+                vistos.add(nombre)
+                if nombre not in conocidos:
+                    self.registrar(entrada.path, usado=entrada.stat().st_mtime)  # Descargas viejas, nombradas por titulo
+        with self.candado:
+            for nombre in conocidos - vistos:
+                self.quitar(nombre)
+        self.liberar()
+        self.guardar()
+
+    def guardar(self):
+        with self.candado:
+            if not self.cambios:
+                return
+            datos = {nombre: dict(d) for nombre, d in self.archivos.items()}
+            self.cambios = False
+        temporal = self.manifiesto + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, self.manifiesto)
+
+cache_descargas = CacheDescargas(MUSIC_FOLDER, MANIFIESTO_FILE, MAX_MB_MUSICA * 1024 * 1024)
+
+if not os.path.exists(MINIATURAS_FOLDER):
+    os.makedirs(MINIATURAS_FOLDER)
+
+class CacheMiniaturas:
+    def __init__(self, carpeta, max_bytes, lados=(LADO_MINIATURA, LADO_MINIATURA_FILA)):
+        self.carpeta = carpeta 
+        self.archivo = os.path.join(carpeta, "index.json")
+        self.max_bytes = max_bytes 
+        self.lados = lados 
+        self.por_url = {}  # Url de la portada -> hash de su contenido
+        self.archivos = {}  # Hash -> {"tamano", "usado"}
+        self.avisos = {}  # Url en descarga -> funciones a llamar cuando este lista
+        self.fallidas = set()  # Urls que no se pudieron bajar en esta sesion, para no insistir sin red
+        self.cambios = False 
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="miniatura")
+        self.candado = threading.Lock()
+        if os.path.exists(self.archivo):
+            try:
+                with open(self.archivo, "r", encoding="utf-8") as f:
+                    datos = json.load(f)
+                self.por_url, self.archivos = datos["por_url"], datos["archivos"]
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error al leer miniaturas: {e}")
+
+    def ruta(self, clave, lado):
+        return os.path.join(self.carpeta, f"{clave}_{lado}.jpg")
+
+    def local(self, url, lado=LADO_MINIATURA):
+        with self.candado:
+            clave = self.por_url.get(url)
+            if clave is None or clave not in self.archivos:
+                return None
+            self.archivos[clave]["usado"] = time.time()
+            self.cambios = True
+        file_path = self.ruta(clave, lado)
+        return file_path if os.path.exists(file_path) else None
+
+    def pedir(self, url, aviso=None):
+        if not url or not url.startswith(("http://", "https://")) or self.local(url):
+            return
+        with self.candado:
+            if url in self.fallidas:
+                return
+            pendiente = url in self.avisos
+            avisos = self.avisos.setdefault(url, [])
+            if aviso:
+                avisos.append(aviso)
+        if not pendiente:
+            self.pool.submit(self.descargar, url)
+
+    def descargar(self, url):
+        try:
+            with telemetria.medir("bajar_miniatura"), urllib.request.urlopen(url, timeout=10) as respuesta:
+                datos = respuesta.read()
+            clave = hashlib.sha256(datos).hexdigest()[:32]  # La misma imagen en dos urls se guarda una vez
+            tamano = 0
+            for lado in self.lados:
+                tamano += self.achicar(datos, self.ruta(clave, lado), lado)
+            with self.candado:
+                self.por_url[url] = clave
+                self.archivos[clave] = {"tamano": tamano, "usado": time.time()}
+                self.cambios = True
+            self.liberar()
+            self.guardar()
+        except Exception as e:
+            with self.candado:
+                self.fallidas.add(url)
+            print(f"Error al bajar la miniatura {url}: {e}")
+            telemetria.fallo("miniatura", e)
+        finally:
+            with self.candado:
+                avisos = self.avisos.pop(url, [])
+            for aviso in avisos:
+                try:
+                    aviso()
+                except Exception as e:
+                    print(f"Error al avisar miniatura: {e}")
+
+    def achicar(self, datos, destino, lado):
+        temporal = destino + ".tmp"
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y', '-i', 'pipe:0',
+            '-vf', f"scale={lado}:{lado}:force_original_aspect_ratio=decrease",
+            '-frames:v', '1', '-q:v', '4', '-f', 'image2', temporal
+        ]
+        try:
+            with telemetria.medir("achicar_miniatura"):
+                result = subprocess.run(cmd, input=datos, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            ok = result.returncode == 0 and os.path.exists(temporal)
+        except OSError:
+            ok = False  # Sin ffmpeg se guarda la imagen tal cual
+        if not ok:
+            with open(temporal, "wb") as f:
+                f.write(datos)
+        os.replace(temporal, destino)
+        return os.path.getsize(destino)
+
+    def liberar(self):
+        with self.candado:
+            total = sum(d["tamano"] for d in self.archivos.values())
+            if total <= self.max_bytes:
+                return
+            borrar = []
+            for clave in sorted(self.archivos, key=lambda c: self.archivos[c]["usado"]):
+                if total <= self.max_bytes:
+                    break
+                total -= self.archivos.pop(clave)["tamano"]
+                borrar.append(clave)
+            for url in [u for u, c in self.por_url.items() if c in borrar]:
+                del self.por_url[url]
+            self.cambios = True
+        for clave in borrar:
+            for lado in self.lados:
+                try:
+                    os.remove(self.ruta(clave, lado))
+                except OSError:
+                    pass
+
+    def guardar(self):
+        with self.candado:
+            if not self.cambios:
+                return
+            datos = {"por_url": self.por_url, "archivos": self.archivos}
+            self.cambios = False
+            temporal = self.archivo + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(datos, f)  # Dentro del candado: lo llaman los dos hilos de descarga
+            os.replace(temporal, self.archivo)
+
+cache_miniaturas = CacheMiniaturas(MINIATURAS_FOLDER, MAX_MB_MINIATURAS * 1024 * 1024)
+
+OPCIONES_YDL = {
+    'format': 'bestaudio/best',
+    'quiet': True,
+    'noplaylist': True,
+    'extract_flat': False,
+    'default_search': 'ytsearch',
+    'retries': 10,
+    'fragment-retries': 10,
+    'no-overwrites': True,
+    'continue_dl': True,
+    'ignoreerrors': True,
+    'no-cache-dir': True,
+}
+
+class InstanciaYoutubeDL:
+    def __init__(self, opciones):
+        self.ydl = cargar_yt_dlp().YoutubeDL(opciones)
+        self.progreso = None  # Hook de la descarga que usa la instancia en este momento
+        self.limite = None  # Funcion que da el limite de esa descarga, que puede cambiar mientras corre
+        self.ydl.add_progress_hook(self.avisar)
+        self.ydl.add_postprocessor_hook(self.avisar)
+
+    def avisar(self, d):
+        if self.limite:
+            self.ydl.params['ratelimit'] = self.limite()  # yt-dlp lo relee en cada bloque
+        if self.progreso:
+            self.progreso(d)
+
+class PoolYoutubeDL:
+    def __init__(self, opciones, tamano):
+        self.opciones = opciones 
+        self.tamano = tamano 
+        self.libres = queue.LifoQueue()  # La ultima usada es la mas caliente
+        self.creadas = 0 
+        self.candado = threading.Lock()
+
+    def tomar(self):
+        try:
+            return self.libres.get_nowait()
+        except queue.Empty:
+            pass
+        with self.candado:
+            crear = self.creadas < self.tamano
+            if crear:
+                self.creadas += 1
+        if crear:
+            try:
+                return InstanciaYoutubeDL(self.opciones)
+            except Exception:
+                with self.candado:
+                    self.creadas -= 1  # El lugar queda libre para el proximo intento
+                raise
+        return self.libres.get()  # Todas ocupadas, se espera a que vuelva una
+
+    def devolver(self, instancia):
+        instancia.progreso = None
+        instancia.limite = None
+        instancia.ydl.params['ratelimit'] = None
+        self.libres.put(instancia)
+
+    def calentar(self):
+        instancia = self.tomar()
+        try:
+            for nombre in ('YoutubeSearch', 'Youtube'):
+                instancia.ydl.get_info_extractor(nombre)  # Carga los extractores antes de la primera busqueda
+        except Exception as e:
+            print(f"Error al preparar yt-dlp: {e}")
+        finally:
+            self.devolver(instancia)
+
+pool_youtube = PoolYoutubeDL(OPCIONES_YDL, MAX_DESCARGAS)
+pool_youtube_fondo = PoolYoutubeDL(OPCIONES_YDL, MAX_DESCARGAS_FONDO)  # Las importaciones no ocupan las de la cancion pedida
+
+def nombre_seguro(titulo, video_id=None):
+    if video_id:
+        return re.sub(r"[^\w-]", "", video_id)  # \w es isalnum() mas "_"
+    return re.sub(r"[^\w -]", "", titulo).rstrip()  # Nombre del archivo sin extension
+
+def archivo_existente(base):
+    for ext in EXTENSIONES_AUDIO:
+        file_path = os.path.join(MUSIC_FOLDER, base + ext)
+        if os.path.exists(file_path):
+            return file_path
+    return None
+
+def temporales(temp_path):
+    return glob.glob(glob.escape(temp_path.replace('%(ext)s', '')) + '*')  # temp_<nombre>.<cualquier extension>
+
+def archivo_descargado(info, temp_path):
+    descargas = (info or {}).get('requested_downloads') or [{}]
+    file_path = descargas[0].get('filepath')
+    if file_path and os.path.exists(file_path):
+        return file_path
+    for file_path in temporales(temp_path):
+        if not file_path.endswith(('.part', '.ytdl')):
+            return file_path  # Por si yt-dlp no informo la ruta final
+    return None
+
+def descargar_mp3(url, titulo, progreso=None, cancelado=None, limite=None, video_id=None, info=None, pool=None):
+    if video_id:
+        guardado = cache_descargas.buscar(video_id)
+        if guardado:
+            return guardado  # El mismo video ya se bajo, aunque fuera con otro titulo
+    safe_title = nombre_seguro(titulo, video_id)
+
+    output_path = archivo_existente(safe_title)
+    if output_path:
+        cache_descargas.registrar(output_path, video_id)
         return output_path  
 
     temp_path = os.path.join(MUSIC_FOLDER, f"temp_{safe_title}.%(ext)s")  
 
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'outtmpl': temp_path,
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-        'quiet': True,
-        'retries': 10,
-        'fragment-retries': 10,
-        'extract-audio': True,
-        'audio-format': 'mp3',
-        'audio-quality': '0',
-        'no-overwrites': True,
-        'continue_dl': True,
-        'ignoreerrors': True,
-        'no-cache-dir': True,
-    }
-
+    pool = pool or pool_youtube
+    instancia = pool.tomar()
+    instancia.ydl.params['outtmpl']['default'] = temp_path
+    instancia.limite = limite if callable(limite) else None
+    instancia.ydl.params['ratelimit'] = limite() if callable(limite) else limite
+    instancia.progreso = progreso
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)  
-            if not info:
-                raise Exception("No se pudo obtener información del video")
-
-            ydl.download([url])  
-
-            for ext in ['.webm', '.m4a', '.mp3', '.part']:
-                temp_file = temp_path.replace('%(ext)s', ext[1:])
-                if os.path.exists(temp_file):
-                    for _ in range(5):
-                        try:
-                            os.rename(temp_file, output_path)
-                            break
-                        except (PermissionError, OSError):
-                            time.sleep(1)
-                    else:
-                        raise Exception(f"No se pudo renombrar el archivo: {temp_file}")
-                    break
-
-            if not os.path.exists(output_path):
-                raise Exception("No se generó el archivo MP3")
+        with telemetria.medir("descarga", resuelta=bool(info)):
+            if info:
+                resultado = instancia.ydl.process_ie_result(info, download=True)  # Ya resuelto: no se vuelve a consultar el extractor
+            else:
+                resultado = instancia.ydl.extract_info(url, download=True)
+                if not resultado:
+                    raise Exception("No se pudo obtener información del video")
+        if cancelado and cancelado():
+            raise DescargaCancelada("Descarga cancelada")
+
+        temp_file = archivo_descargado(resultado, temp_path)
+        if not temp_file:
+            raise Exception("No se generó el archivo de audio")
+        output_path = os.path.join(MUSIC_FOLDER, safe_title + os.path.splitext(temp_file)[1])  # Con la extension real
+        for _ in range(5):
+            try:
+                os.replace(temp_file, output_path)
+                break
+            except (PermissionError, OSError):
+                telemetria.contar("reintentos_renombrar")
+                time.sleep(1)
+        else:
+            raise Exception(f"No se pudo renombrar el archivo: {temp_file}")
 
-            return output_path
+        telemetria.contar("bytes_descargados", os.path.getsize(output_path))  # Con la suma de "descarga": el ritmo medio
+        cache_descargas.registrar(output_path, video_id)
+        if CONVERTIR_MP3 and not output_path.endswith(".mp3"):
+            conversor_mp3.convertir(output_path, video_id)  # Aparte: la cancion ya se puede escuchar asi
+        return output_path
 
     except Exception as e:
         
-        for ext in ['.webm', '.m4a', '.mp3', '.part']:
-            temp_file = temp_path.replace('%(ext)s', ext[1:])
-            if os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
+        for temp_file in temporales(temp_path):
+            try:
+                os.remove(temp_file)
+            except:
+                pass
+        if isinstance(e, DescargaCancelada):
+            raise
         print(f"Error al descargar MP3: {e}")
+        telemetria.fallo("descargar", e)
         return None
+    finally:
+        pool.devolver(instancia)
+
+class ConversorMP3:
+    def __init__(self, trabajadores=os.cpu_count() or 2):
+        self.pool = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix="conversion")  # Cada hilo espera su proceso de ffmpeg
+        self.aviso = None  # Se llama con (archivo viejo, archivo mp3) al terminar cada conversion
+
+    def convertir(self, file_path, video_id=None):
+        return self.pool.submit(self.ejecutar, file_path, video_id)
+
+    def ejecutar(self, file_path, video_id):
+        destino = os.path.splitext(file_path)[0] + ".mp3"
+        temporal = destino + ".tmp"
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y', '-i', file_path,
+            '-vn', '-codec:a', 'libmp3lame', '-b:a', '192k', '-f', 'mp3', temporal
+        ]
+        try:
+            with telemetria.medir("convertir_mp3"):
+                result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            print(f"Error al convertir {file_path}: {e}")
+            return None
+        if result.returncode != 0:
+            print(f"Error al convertir {file_path}: {result.stderr.strip()}")
+            telemetria.fallo("convertir_mp3", result.stderr.strip())
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            return None
+
+        os.replace(temporal, destino)
+        cache_descargas.registrar(destino, video_id)
+        cache_metadatos.analizar(destino)
+        cache_metadatos.guardar()
+        if self.aviso:
+            self.aviso(file_path, destino)
+        return destino
+
+conversor_mp3 = ConversorMP3()
+
+def resolver(texto, pool=None):
+    pool = pool or pool_youtube
+    instancia = pool.tomar()
+    try:
+        for _ in range(3): 
+            try:
+                with telemetria.medir("resolver"):
+                    info = instancia.ydl.extract_info(texto, download=False)  
+                if not info:
+                    continue
+
+                if 'entries' in info:
+                    entradas = [e for e in info['entries'] if e]
+                    if not entradas:
+                        continue
+                    info = entradas[0]  
 
-def obtener_info_cancion(texto):
+                if not (info.get('url') or info.get('webpage_url')):
+                    continue
+                return info  # Con los formatos ya elegidos, listo para descargar
+
+            except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+                print(f"Intento fallido: {e}")
+                time.sleep(2)
+                continue
+    finally:
+        pool.devolver(instancia)
+
+    raise Exception("No se pudo obtener información de la canción después de varios intentos")
+
+def nodo_de_info(info):
+    titulo = info.get('title', 'Sin título')  
+    miniatura = info.get('thumbnail')  # None: se muestra la portada vacia local
+    cancion = NodoCancion(titulo, None, miniatura)
+    cancion.actualizar_fuente(info)  # Pagina e id para siempre, url directa mientras no venza
+    return cancion
+
+def es_url_lista(texto):
+    partes = urlparse(texto)
+    if "youtube.com" not in partes.netloc and "youtu.be" not in partes.netloc:
+        return False
+    ruta = partes.path
+    return "list" in parse_qs(partes.query) or ruta.startswith(("/playlist", "/channel/", "/c/", "/user/", "/@"))
+
+def es_raiz_de_canal(ruta):
+    return re.fullmatch(r"/(@[^/]+|(channel|c|user)/[^/]+)/?", ruta) is not None  # /@x/videos o /@x/streams ya son una pestaña
+
+def enumerar_lista(url):
+    partes = urlparse(url)
+    if "list" not in parse_qs(partes.query) and es_raiz_de_canal(partes.path):
+        url = f"{partes.scheme}://{partes.netloc}{partes.path.rstrip('/')}/videos"  # Un canal lista sus pestañas; se toman los videos
     ydl_opts = {
-        'format': 'bestaudio/best',
         'quiet': True,
-        'noplaylist': True,
-        'extract_flat': False,
-        'default_search': 'ytsearch',
+        'extract_flat': 'in_playlist',  # Solo ids y titulos, sin resolver cada video
+        'noplaylist': False,
+        'playlistend': MAX_IMPORTAR,
         'ignoreerrors': True,
-        'retries': 10,
-        'fragment-retries': 10,
     }
-
+    with cargar_yt_dlp().YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if not info:
+        raise Exception("No se pudo leer la lista")
+
+    canciones = []
+    for entrada in info.get('entries') or []:
+        if not entrada or not entrada.get('id'):
+            continue
+        if entrada.get('_type') == 'playlist' or entrada.get('ie_key') == 'YoutubeTab':
+            continue  # Pestañas de un canal, no videos
+        miniaturas = entrada.get('thumbnails') or []
+        miniatura = miniaturas[-1]['url'] if miniaturas else f"https://i.ytimg.com/vi/{entrada['id']}/hqdefault.jpg"
+        canciones.append(NodoCancion(
+            entrada.get('title') or 'Sin título',
+            url_de_video(entrada['id']),
+            miniatura,
+            video_id=entrada['id']
+        ))  # Sin archivo ni url directa: se completan al descargarla
+    return canciones
+
+def obtener_info_cancion(texto, descargar=True):
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            for _ in range(3): 
-                try:
-                    info = ydl.extract_info(texto, download=False)  
-                    if not info:
-                        continue
+        info = resolver(texto)
+        cancion = nodo_de_info(info)
+        if not descargar:
+            return cancion  
 
-                    if 'entries' in info:
-                        info = info['entries'][0]  
+        cancion.file_path = descargar_mp3(cancion.fuente(), cancion.titulo, video_id=cancion.video_id, info=info)  
+        if not cancion.file_path:
+            raise Exception("No se pudo descargar el archivo MP3")
+        return cancion  
 
-                    titulo = info.get('title', 'Sin título')  
-                    miniatura = info.get('thumbnail', 'https://via.placeholder.com/200') 
-                    url = info.get('url') or info.get('webpage_url')  
+    except Exception as e:
+        raise Exception(f"Error al obtener información: {str(e)}")
 
-                    if not url:
-                        continue
+class DescargaCancelada(Exception):
+    pass
+
+class TrabajoDescarga:
+    def __init__(self, clave, texto, cancion=None, limite=None):
+        self.clave = clave 
+        self.texto = texto 
+        self.cancion = cancion  # None hasta que se resuelve la busqueda
+        self.info = None  # Resultado de yt-dlp, para descargar sin volver a resolver
+        self.estado = "en cola"  # en cola, resolviendo, descargando, convirtiendo, listo, fallido, cancelado
+        self.progreso = 0.0 
+        self.file_path = None 
+        self.error = None 
+        self.cancelado = False 
+        self.avisos = []  # Funciones que reciben el trabajo en cada cambio
+        self.terminado = threading.Event()
+        self.futuro = None 
+        self.en_lista = cancion is not None  # Si el nodo ya esta en la lista de reproduccion
+        self.limite = limite  # Bytes por segundo, None sin limite
+        self.fondo = False  # Si espera en la cola de las listas importadas
+
+class GestorDescargas:
+    def __init__(self, max_trabajos=MAX_DESCARGAS, max_fondo=MAX_DESCARGAS_FONDO):
+        self.pool = ThreadPoolExecutor(max_workers=max_trabajos, thread_name_prefix="descarga")
+        self.pool_fondo = ThreadPoolExecutor(max_workers=max_fondo, thread_name_prefix="importacion")
+        self.trabajos = {}  # Trabajos en curso por clave, para no repetir descargas
+        self.renovando = set()  # Canciones cuya url directa se esta resolviendo de nuevo
+        self.resueltas = {}  # Clave de una busqueda ya resuelta -> (titulo, miniatura, video_id)
+        self.candado = threading.Lock()
+
+    def clave(self, cancion, texto=None):
+        if cancion and cancion.video_id:
+            return cancion.video_id  # Dos titulos distintos pueden ser el mismo video
+        return (cancion.titulo if cancion else texto).strip().lower()
+
+    def agregar(self, texto, aviso=None, cancion=None, limite=None, fondo=False):
+        clave = self.clave(cancion, texto)
+        with self.candado:
+            trabajo = self.trabajos.get(clave)
+            if trabajo is None or trabajo.cancelado:
+                trabajo = TrabajoDescarga(clave, texto, cancion, limite)
+                trabajo.fondo = fondo
+                self.trabajos[clave] = trabajo
+                nuevo = True
+            else:
+                nuevo = trabajo.fondo and not fondo and trabajo.futuro is not None and trabajo.futuro.cancel()  # Seguia en la cola de fondo, pasa adelante
+                if nuevo:
+                    trabajo.fondo = False
+                if not limite:
+                    trabajo.limite = None  # Alguien la necesita ya: la descarga en curso lo nota en el proximo bloque
+            if aviso and aviso not in trabajo.avisos:
+                trabajo.avisos.append(aviso)
+
+        if nuevo:
+            trabajo.futuro = (self.pool_fondo if trabajo.fondo else self.pool).submit(self.ejecutar, trabajo)
+        return trabajo
+
+    def activos(self):
+        with self.candado:
+            return set(self.trabajos.values())  # Copia: los hilos de descarga cambian el dict; un trabajo puede estar bajo dos claves
+
+    def trabajo_de(self, cancion):
+        with self.candado:
+            for trabajo in self.trabajos.values():
+                if trabajo.cancion is cancion:
+                    return trabajo
+        return None
 
-                    file_path = descargar_mp3(url, titulo)  
-                    if not file_path:
-                        continue
+    def cancelar(self, trabajo):
+        trabajo.cancelado = True
+        if trabajo.futuro and trabajo.futuro.cancel():
+            self.terminar(trabajo, "cancelado")  # No habia empezado
 
-                    return NodoCancion(titulo, url, miniatura, file_path)  
+    def cambiar(self, trabajo, estado=None):
+        if estado:
+            trabajo.estado = estado
+        for aviso in list(trabajo.avisos):
+            try:
+                aviso(trabajo)
+            except Exception as e:
+                print(f"Error al avisar descarga: {e}")
+
+    def terminar(self, trabajo, estado):
+        telemetria.contar("trabajos", estado=estado)  # listo, fallido o cancelado
+        with self.candado:
+            for clave in [c for c, t in self.trabajos.items() if t is trabajo]:
+                del self.trabajos[clave]
+        self.cambiar(trabajo, estado)
+        trabajo.terminado.set()
+
+    def progreso(self, trabajo, d):
+        if trabajo.cancelado:
+            raise DescargaCancelada("Descarga cancelada")
+        if d.get('postprocessor'):
+            if d['status'] == 'started':
+                self.cambiar(trabajo, "convirtiendo")
+            return
+        if d['status'] == 'downloading':
+            anterior = int(trabajo.progreso * 100)
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if total:
+                trabajo.progreso = d.get('downloaded_bytes', 0) / total
+            if int(trabajo.progreso * 100) != anterior or trabajo.estado != "descargando":
+                self.cambiar(trabajo, "descargando")  # Solo se avisa cuando cambia el porcentaje
+
+    def ejecutar(self, trabajo):
+        try:
+            pool = pool_youtube_fondo if trabajo.fondo else pool_youtube
+            if trabajo.cancion is None:
+                trabajo.cancion = self.recordada(trabajo.clave)
+            if trabajo.cancion is None:
+                self.cambiar(trabajo, "resolviendo")
+                trabajo.info = resolver(trabajo.texto, pool)
+                trabajo.cancion = nodo_de_info(trabajo.info)
+                if trabajo.cancion.video_id:
+                    with self.candado:
+                        self.resueltas[trabajo.clave] = (trabajo.cancion.titulo, trabajo.cancion.miniatura, trabajo.cancion.video_id)
+                otro = self.registrar_titulo(trabajo)
+                if otro:
+                    otro.terminado.wait()  # La misma cancion ya se esta bajando por otra busqueda
+                    trabajo.file_path = otro.file_path
+                    self.terminar(trabajo, "listo" if trabajo.file_path else "fallido")
+                    return
+
+            if trabajo.cancelado:
+                raise DescargaCancelada("Descarga cancelada")
+            if trabajo.fondo and espacio_musica() > MAX_MB_PRECARGA * 1024 * 1024:
+                raise DescargaCancelada("Sin espacio")  # Se baja recien cuando se pida
+
+            cancion = trabajo.cancion
+            if not (trabajo.info or cancion.stream_vigente() or (cancion.video_id and cache_descargas.buscar(cancion.video_id))):
+                self.cambiar(trabajo, "resolviendo")
+                trabajo.info = resolver(cancion.fuente(), pool)  # Primero la url directa, para poder sonar ya
+                cancion.actualizar_fuente(trabajo.info)
+
+            self.cambiar(trabajo, "descargando")
+            bajar = lambda fuente: descargar_mp3(
+                fuente, cancion.titulo,
+                progreso=lambda d: self.progreso(trabajo, d),
+                cancelado=lambda: trabajo.cancelado,
+                limite=lambda: trabajo.limite,
+                video_id=cancion.video_id,
+                info=trabajo.info,
+                pool=pool
+            )
+            fuente = cancion.fuente()
+            trabajo.file_path = bajar(fuente)
+            if not trabajo.file_path and not trabajo.cancelado and fuente == cancion.stream_url:
+                cancion.stream_url = cancion.expira = None  # El link se cayo antes de tiempo
+                trabajo.file_path = bajar(cancion.fuente())
+            trabajo.info = None  # Ya no hace falta y ocupa bastante
+            if trabajo.cancelado:
+                raise DescargaCancelada("Descarga cancelada")
+            if not trabajo.file_path:
+                raise Exception("No se pudo descargar el archivo MP3")
+            cache_metadatos.analizar(trabajo.file_path)  # Una sola vez, aqui y no al reproducir
+            cache_metadatos.guardar()
+            cache_descargas.liberar()  # Si la carpeta paso el limite, se va lo que nadie usa
+            cache_descargas.guardar()
+            self.terminar(trabajo, "listo")
+
+        except DescargaCancelada:
+            self.terminar(trabajo, "cancelado")
+        except Exception as e:
+            trabajo.error = str(e)
+            self.terminar(trabajo, "fallido")
+
+    def renovar(self, canciones):
+        with self.candado:
+            lote = [c for c in canciones if not c.stream_vigente() and c not in self.renovando]
+            self.renovando.update(lote)
+        if lote:
+            self.pool.submit(self.renovar_lote, lote)  # Un solo trabajo para todo el lote
+
+    def renovar_lote(self, canciones):
+        for cancion in canciones:
+            try:
+                cancion.actualizar_fuente(resolver(cancion.fuente()))
+            except Exception as e:
+                print(f"Error al renovar {cancion.titulo}: {e}")
+                telemetria.fallo("renovar", e)
+            finally:
+                with self.candado:
+                    self.renovando.discard(cancion)
+
+    def recordada(self, clave):
+        with self.candado:
+            datos = self.resueltas.get(clave)
+        if not datos or not cache_descargas.buscar(datos[2]):
+            return None  # Sin el archivo hay que resolver igual, para tener la url directa
+        titulo, miniatura, video_id = datos
+        return NodoCancion(titulo, url_de_video(video_id), miniatura, video_id=video_id)
+
+    def registrar_titulo(self, trabajo):
+        clave = self.clave(trabajo.cancion)
+        with self.candado:
+            otro = self.trabajos.get(clave)
+            if otro is not None and otro is not trabajo:
+                return otro
+            self.trabajos[clave] = trabajo
+        return None
 
-                except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
-                    print(f"Intento fallido: {e}")
-                    time.sleep(2)
+gestor_descargas = GestorDescargas()
+
+def espacio_musica():
+    return cache_descargas.total  # Sale del manifiesto, sin recorrer la carpeta
+
+class Precargador:
+    def __init__(self, lista, gestor, siguientes=PRECARGA_SIGUIENTES, anteriores=PRECARGA_ANTERIORES):
+        self.lista = lista 
+        self.gestor = gestor 
+        self.siguientes = siguientes 
+        self.anteriores = anteriores 
+        self.trabajos = {}  # Nodo -> trabajo de precarga en curso
+        self.aviso = None  # Se llama con cada cambio de un trabajo de precarga
+        self.candado = threading.Lock()
+
+    def ventana(self):
+        if not self.lista.PTR:
+            return []
+        nodos = [self.lista.PTR]  # La actual, las siguientes y las anteriores en el orden de reproduccion
+        for cancion in self.lista.proximas(min(self.siguientes, self.lista.longitud - 1)) + self.lista.previas(self.anteriores):
+            if cancion not in nodos:
+                nodos.append(cancion)
+        return nodos
+
+    def actualizar(self):
+        with self.candado:
+            ventana = self.ventana()
+            for cancion, trabajo in list(self.trabajos.items()):
+                if trabajo.terminado.is_set():
+                    del self.trabajos[cancion]
+                elif cancion not in ventana:
+                    self.gestor.cancelar(trabajo)  # El usuario ya paso de largo
+                    del self.trabajos[cancion]
+
+            if espacio_musica() > MAX_MB_PRECARGA * 1024 * 1024:
+                sin_archivo = [c for c in ventana if not (c.file_path and os.path.exists(c.file_path))]
+                self.gestor.renovar(sin_archivo)  # Sin lugar para bajarlas, al menos quedan listas para pedir
+                return
+
+            for cancion in ventana:
+                if cancion in self.trabajos or cancion is self.lista.PTR:
+                    continue  # La actual la pide tocar_actual sin limite
+                if cancion.file_path and os.path.exists(cancion.file_path):
                     continue
+                self.trabajos[cancion] = self.gestor.agregar(cancion.titulo, self.aviso, cancion=cancion, limite=LIMITE_PRECARGA)
 
-        raise Exception("No se pudo obtener información de la canción después de varios intentos")
+precargador = Precargador(lista_reproduccion, gestor_descargas)
 
-    except Exception as e:
-        raise Exception(f"Error al obtener información: {str(e)}")
+tiempos_cambio = {}  # Modo -> segundos entre pedir una cancion y que empiece a sonar
 
+def registrar_cambio(inicio, modo="archivo"):
+    tiempos = tiempos_cambio.setdefault(modo, deque(maxlen=50))  # archivo, stream, descarga o relevo
+    tiempos.append(time.perf_counter() - inicio)
+    telemetria.registrar("cambio_cancion", tiempos[-1], modo=modo)  # Sin print: se ve en /metrics o en la traza
 
+class MotorReproduccion:
+    def __init__(self):
+        self.player = None 
+        self.estado = "detenido"  # detenido, reproduciendo, pausado
+        self.generacion = None  # Numero del player que suena, para ignorar avisos de reproductores viejos
+        self.contador = 0 
+        self.eof = False 
+        self.al_terminar = None 
+        self.al_pasar = None  # Se llama cuando la siguiente cancion toma el relevo sin detenerse
+        self.proxima = None  # Devuelve el archivo que sigue, o None si aun no esta
+        self.siguiente = None  # (player, numero, file_path) abierto en pausa antes del final
+        self.fundido = False 
+        self.duracion = None  # De la cache, mientras ffpyplayer no informa la suya
+        self.transmitiendo = False  # Si suena desde una url en vez de un archivo
+        self.ultimo_pts = 0.0 
+        self.ultimo_avance = 0.0  # Cuando se vio avanzar la posicion por ultima vez
+        self.reanudar_en = 0.0  # Fin de la pausa por falta de buffer
+        self.al_cargar = None  # Se llama con True al cortarse el stream y con False al seguir
+        self.inicio = None  # Momento del pedido, hasta que se oye el primer sonido
+        self.modo = None 
+        self.candado = threading.Lock()
+        self.despertar = threading.Event()  # Lo activan las ordenes y el aviso de fin de ffpyplayer
+        self.hilo = threading.Thread(target=self.bucle, daemon=True, name="reproductor")
+        self.hilo.start()
+
+    def aviso_player(self, numero, selector, valor):
+        if selector == 'eof' and numero == self.generacion:
+            self.eof = True  # Sin candado: ffpyplayer llama desde sus hilos y close_player los espera
+            self.despertar.set()
+
+    def abrir(self, file_path, pausado=False, desde=None):
+        self.contador += 1
+        numero = self.contador
+        ff_opts = {'vn': True, 'sn': True}
+        if pausado:
+            ff_opts['paused'] = True  # Abre y llena el buffer sin sonar
+        if desde:
+            ff_opts['ss'] = desde  # Retoma donde se corto el stream
+        with telemetria.medir("abrir_audio"):
+            player = cargar_ffpyplayer()(
+                file_path,
+                callback=lambda selector, valor: self.aviso_player(numero, selector, valor),
+                ff_opts=ff_opts
+            )
+        return player, numero
+
+    def reproducir(self, file_path, al_terminar=None, al_pasar=None, proxima=None, stream=False, inicio=None, modo="archivo", al_cargar=None, desde=None):
+        with self.candado:
+            self.cerrar()
+            self.player, self.generacion = self.abrir(file_path, desde=desde)
+            self.transmitiendo = stream
+            self.duracion = None if stream else duracion_de(file_path)
+            self.eof = False
+            self.al_terminar = al_terminar
+            self.al_pasar = al_pasar
+            self.proxima = proxima
+            self.al_cargar = al_cargar
+            self.inicio, self.modo = inicio, modo
+            self.ultimo_pts, self.ultimo_avance = 0.0, time.perf_counter()
+            self.estado = "reproduciendo"
+        self.despertar.set()
+
+    def pausar(self):
+        with self.candado:
+            if self.estado in ("reproduciendo", "cargando"):
+                self.player.set_pause(True)
+                if self.fundido:
+                    self.siguiente[0].set_pause(True)
+                self.estado = "pausado"
+        self.despertar.set()
+
+    def reanudar(self):
+        with self.candado:
+            if self.estado == "pausado":
+                self.player.set_pause(False)
+                if self.fundido:
+                    self.siguiente[0].set_pause(False)
+                self.estado = "reproduciendo"
+                self.ultimo_avance = time.perf_counter()  # La pausa del usuario no es un corte
+        self.despertar.set()
+
+    def detener(self):
+        with self.candado:
+            self.cerrar()
+        self.despertar.set()
+
+    def posicionar(self, segundos):
+        with self.candado:
+            if not self.player:
+                return False
+            if self.fundido:
+                self.descartar_siguiente()  # Se volvio atras en pleno fundido
+            self.player.seek(segundos, relative=False, accurate=False)
+            self.eof = False
+            self.ultimo_pts, self.ultimo_avance = segundos, time.perf_counter()
+        self.despertar.set()  # El final cambio: se recalcula cuando preparar la siguiente
+        return True
+
+    def cerrar(self):
+        self.descartar_siguiente()
+        if self.player:
+            try:
+                self.player.close_player()  
+            except Exception:
+                pass  
+            self.player = None 
+        self.estado = "detenido"
+        self.generacion = None
+        self.transmitiendo = False
+        self.inicio = None
+
+    def descartar_siguiente(self):
+        if self.siguiente:
+            try:
+                self.siguiente[0].close_player()
+            except Exception:
+                pass
+            self.siguiente = None
+            if self.fundido:
+                self.player.set_volume(1.0)
+            self.fundido = False
+
+    def archivo_siguiente(self):
+        with self.candado:
+            return self.siguiente[2] if self.siguiente else None
+
+    def posicion(self):
+        with self.candado:
+            return self.player.get_pts() if self.player else 0.0
+
+    def restante(self):
+        duracion = self.player.get_metadata().get('duration') or self.duracion
+        if not duracion:
+            return None
+        return duracion - self.player.get_pts()
+
+    def termino(self):
+        if self.estado != "reproduciendo":
+            return False
+        if self.eof:
+            return True
+        if self.siguiente:
+            restante = self.restante()
+            if restante is not None and restante <= 0.02:
+                return True  # Solo para el relevo sin hueco: la siguiente ya esta abierta y arranca en el borde
+        return self.player.get_frame(show=False)[1] == 'eof'  # Respaldo si el aviso no llega
+
+    def espera(self):
+        if self.estado == "cargando":
+            return max(self.reanudar_en - time.perf_counter(), 0.02)
+        if self.estado != "reproduciendo":
+            return None  # Nada que vigilar hasta la proxima orden
+        if self.inicio is not None:
+            return 0.02  # Hasta oir el primer sonido, para medirlo
+        restante = self.restante()
+        if restante is None:
+            return 0.5 if self.transmitiendo else 1.0  # Duracion aun desconocida, se confia en el aviso de ffpyplayer
+        if self.fundido:
+            return 0.05  # Pasos del fundido
+        limites = [restante if self.siguiente else max(restante, 0.0) + 0.5]  # Sin siguiente termina el aviso de eof: esto es el respaldo
+        if self.transmitiendo:
+            limites.append(0.5)  # Para notar a tiempo si el stream se corta
+        if self.siguiente is None and self.proxima:
+            faltan = restante - PREPARAR_ANTES - CROSSFADE
+            limites.append(faltan if faltan > 0 else 1.0)  # Si la siguiente aun no esta se reintenta
+        elif self.siguiente and CROSSFADE:
+            limites.append(restante - CROSSFADE)
+        return max(min(limites), 0.02)
+
+    def hay_que_preparar(self):
+        if self.estado != "reproduciendo" or self.siguiente or not self.proxima:
+            return False
+        restante = self.restante()
+        return restante is not None and restante <= PREPARAR_ANTES + CROSSFADE
+
+    def preparar_siguiente(self):
+        generacion = self.generacion
+        file_path = self.proxima()  # Fuera del candado: consulta la lista
+        if not file_path or not os.path.exists(file_path):
+            return
+        player, numero = self.abrir(file_path, pausado=True)
+        with self.candado:
+            if self.generacion != generacion or self.siguiente:
+                player.close_player()  # Cambio la pista mientras se abria
+                return
+            self.siguiente = (player, numero, file_path)
+
+    def primer_sonido(self):
+        if self.inicio is None or self.estado != "reproduciendo" or self.player.get_pts() <= 0:
+            return None
+        inicio, self.inicio = self.inicio, None
+        return inicio, self.modo
+
+    def se_corto(self):
+        if not self.transmitiendo:
+            return False
+        restante = self.restante()
+        return restante is None or restante > 5.0  # El stream termino antes que la cancion
+
+    def vigilar_buffer(self):
+        if not self.transmitiendo:
+            return None
+        ahora = time.perf_counter()
+        if self.estado == "cargando":
+            if ahora < self.reanudar_en:
+                return None
+            self.player.set_pause(False)  # Ya hubo tiempo de llenar el buffer
+            self.estado = "reproduciendo"
+            self.ultimo_avance = ahora
+            return False
+        if self.estado != "reproduciendo":
+            return None
+        pts = self.player.get_pts()
+        if pts != self.ultimo_pts or pts <= 0:  # Antes del primer sonido no cuenta como corte
+            self.ultimo_pts, self.ultimo_avance = pts, ahora
+            return None
+        if ahora - self.ultimo_avance < ESPERA_BUFFER:
+            return None
+        self.player.set_pause(True)  # Se pausa entero en vez de sonar a saltos
+        self.estado = "cargando"
+        self.reanudar_en = ahora + PAUSA_BUFFER
+        return True
+
+    def mezclar(self):
+        if not CROSSFADE or not self.siguiente or self.estado != "reproduciendo":
+            return
+        restante = self.restante()
+        if restante is None or restante > CROSSFADE:
+            return
+        entrante = self.siguiente[0]
+        if not self.fundido:
+            self.fundido = True
+            entrante.set_volume(0.0)
+            entrante.set_pause(False)
+        nivel = max(restante, 0.0) / CROSSFADE
+        self.player.set_volume(nivel)
+        entrante.set_volume(1.0 - nivel)
+
+    def pasar_a_siguiente(self):
+        player, numero, file_path = self.siguiente
+        self.siguiente = None
+        viejo = self.player
+        self.player, self.generacion = player, numero
+        self.duracion = duracion_de(file_path)
+        self.eof = False
+        self.fundido = False
+        self.transmitiendo = False
+        player.set_volume(1.0)
+        player.set_pause(False)  # Arranca justo en el borde, ya abierto y con buffer
+        try:
+            viejo.close_player()
+        except Exception:
+            pass
+        return file_path
+
+    def bucle(self):
+        while True:
+            with self.candado:
+                espera = self.espera()
+            self.despertar.wait(espera)
+            self.despertar.clear()
+
+            with self.candado:
+                preparar = self.hay_que_preparar()
+                sonido = self.primer_sonido()
+                cargando = self.vigilar_buffer()
+                al_cargar = self.al_cargar
+            if sonido:
+                registrar_cambio(*sonido)
+            if cargando:
+                telemetria.contar("cortes_stream")
+            if cargando is not None and al_cargar:
+                al_cargar(cargando)
+            if preparar:
+                self.preparar_siguiente()
+
+            with self.candado:
+                self.mezclar()
+                if not self.termino():
+                    continue
+                inicio = time.perf_counter()
+                al_terminar, al_pasar = self.al_terminar, self.al_pasar
+                file_path = None
+                cortado = self.se_corto()
+                if self.siguiente and al_pasar and not cortado:
+                    file_path = self.pasar_a_siguiente()
+                else:
+                    self.cerrar()
+            if file_path:
+                al_pasar(file_path, inicio)
+            elif al_terminar:
+                al_terminar(cortado)  # Fuera del candado: suele pedir la siguiente pista
+
+motor = MotorReproduccion()
+
+SALTOS = ("siguiente", "anterior", "saltar", "fin")  # Ordenes que solo mueven PTR: se agrupan
+ORDENES = SALTOS + ("tocar_actual", "pausar", "reanudar", "alternar_pausa", "detener", "posicionar", "poner_aleatorio", "poner_repetir",
+                   "tocar_esperada", "transmitir_esperada", "relevo")  # Las tres ultimas las piden los hilos de descarga y del motor
+REPETICIONES = ("todas", "una", "no")  # todas: la lista da la vuelta; una: se repite la actual; no: para al final
+
+class Reproductor:
+    def __init__(self, lista, motor, gestor, precargador):
+        self.lista = lista  
+        self.motor = motor  
+        self.gestor = gestor  
+        self.precargador = precargador  
+        self.esperando = None  # Cancion que debe sonar apenas termine su descarga
+        self.inicio_cambio = None  # Momento en que se pidio la cancion actual, para medir el hueco entre canciones
+        self.corte = {"cancion": None, "desde": 0.0}  # Donde se corto el stream de la cancion actual
+        self.cargando = False  
+        self.iniciado = False  
+        self.tiempos_inicio = {}  # Segundos desde que arranco el proceso: "ventana", "primera_pagina" y "lista"
+        self.cargada = False  # Si ya se leyo playlist.json
+        self.repetir = "todas"
+        self.oyentes = []  # Funciones (evento, datos): la interfaz y el servidor de control
+        self.candado = threading.RLock()
+        self.ordenes = queue.Queue()  # (orden, argumentos) de la interfaz, del control y del fin de cada cancion
+        self.instantanea = {"estado": "detenido", "cargando": False, "actual": None, "aleatorio": False, "repetir": "todas"}  # Se reemplaza entera: se lee sin candado
+        precargador.aviso = self.al_cambiar_descarga
+        conversor_mp3.aviso = self.al_convertir
+        self.hilo = threading.Thread(target=self.atender_ordenes, daemon=True, name="ordenes")
+        self.hilo.start()
+
+    def suscribir(self, oyente):
+        self.oyentes.append(oyente)
+
+    def desuscribir(self, oyente):
+        if oyente in self.oyentes:
+            self.oyentes.remove(oyente)
+
+    def emitir(self, evento, **datos):
+        if evento in ("cancion", "estado", "carga"):
+            self.publicar()
+        for oyente in list(self.oyentes):
+            try:
+                oyente(evento, datos)
+            except Exception as e:
+                print(f"Error al avisar {evento}: {e}")  # Un cliente roto no frena a los demas
+                telemetria.fallo("evento", e)
+
+    def publicar(self):
+        with self.candado:
+            self.instantanea = {
+                "estado": self.motor.estado,
+                "cargando": self.cargando,
+                "actual": self.describir(self.lista.PTR),
+                "aleatorio": self.lista.aleatorio is not None,
+                "repetir": self.repetir
+            }
+
+    def pedir(self, orden, *argumentos):
+        if orden not in ORDENES:
+            raise ValueError(f"Orden desconocida: {orden}")
+        if orden == "poner_repetir" and argumentos[0] not in REPETICIONES:
+            raise ValueError(f"Modo de repeticion desconocido: {argumentos[0]}")
+        self.ordenes.put((orden, argumentos))  # Vuelve enseguida: la ejecuta el hilo de ordenes
+
+    def atender_ordenes(self):
+        pendiente = None
+        while True:
+            orden, argumentos = pendiente or self.ordenes.get()
+            pendiente = None
+            try:
+                with telemetria.medir("orden", orden=orden):
+                    if orden in SALTOS:
+                        pendiente = self.agrupar_saltos(orden, argumentos)
+                    else:
+                        getattr(self, orden)(*argumentos)
+            except Exception as e:
+                print(f"Error en la orden {orden}: {e}")
+                telemetria.fallo("orden", e)
+            finally:
+                self.ordenes.task_done()
+
+    def agrupar_saltos(self, orden, argumentos):
+        inicio = time.perf_counter()
+        agrupados = 0
+        siguiente_orden = None
+        while True:
+            with self.candado:
+                terminada = False
+                if orden == "fin":
+                    terminada = not self.avanzar()
+                elif orden == "siguiente":
+                    self.lista.siguiente()
+                elif orden == "anterior":
+                    self.lista.anterior()
+                elif self.lista.contiene(argumentos[0]):
+                    self.lista.saltar(argumentos[0])  # Se pudo eliminar mientras esperaba en la cola
+            if agrupados:
+                self.ordenes.task_done()
+            agrupados += 1
+            try:
+                orden, argumentos = self.ordenes.get(timeout=0 if orden == "fin" else AGRUPAR_SALTOS)  # El fin de una cancion no espera
+            except queue.Empty:
+                break
+            if orden not in SALTOS:
+                siguiente_orden = (orden, argumentos)  # Se ejecuta despues de abrir la cancion elegida
+                break
+        if agrupados > 1:
+            telemetria.contar("saltos_agrupados", agrupados - 1)
+        if terminada:
+            self.detener()  # Sin repetir: se llego al final de la lista
+        else:
+            self.tocar_actual(inicio)  # Una sola apertura para toda la rafaga
+        return siguiente_orden
+
+    def avanzar(self):
+        if self.repetir == "una":
+            return True  # Vuelve a sonar la misma
+        if self.repetir == "no" and self.lista.al_final():
+            return False
+        self.lista.siguiente()
+        return True
+
+    def poner_aleatorio(self, activo):
+        with self.candado:
+            if activo != (self.lista.aleatorio is not None):
+                self.lista.mezclar(activo)
+                self.revisar_siguiente()  # La preparada para el relevo ya no es la que sigue
+                self.precargador.actualizar()
+            self.emitir("estado", estado=self.motor.estado)
+
+    def poner_repetir(self, modo):
+        with self.candado:
+            self.repetir = modo
+            self.revisar_siguiente()
+            self.emitir("estado", estado=self.motor.estado)
+
+    def iniciar(self):
+        with self.candado:
+            if self.iniciado:
+                return
+            self.iniciado = True
+        threading.Thread(target=self.arrancar, daemon=True).start()  # La ventana queda usable mientras se carga
+
+    def arrancar(self):
+        with self.candado:
+            self.lista.cargar(PLAYLIST_FILE, al_empezar=self.primera_pagina)
+            if USAR_DIARIO:
+                self.lista.abrir_diario(PLAYLIST_FILE)
+            elif self.lista.migrada:
+                self.lista.guardar(PLAYLIST_FILE)
+            self.cargada = True
+            self.tiempos_inicio["lista"] = time.perf_counter() - INICIO_PROCESO
+            self.emitir("lista")
+
+        if self.lista.longitud > 0:
+            with self.candado:
+                ventana = self.precargador.ventana()
+            reconciliador.reconciliar(ventana)  # Si sus archivos estan con otra ruta no se vuelven a bajar
+            self.pedir("tocar_actual")  # Con la lista ya pintada
+        self.lista.completar(self.candado)  # Indice de busqueda, por tandas
+        reconciliador.iniciar()  # Antes del escaneo, para no perder lo que cambie mientras tanto
+        reconciliador.reconciliar()  # Rutas de otra maquina, archivos borrados o renombrados y temporales abandonados
+        self.escanear()
+        pool_youtube.calentar()  # La primera busqueda no paga la carga de yt-dlp
+
+    def primera_pagina(self):
+        self.tiempos_inicio["primera_pagina"] = time.perf_counter() - INICIO_PROCESO
+        self.emitir("lista")  # Con lo leido hasta aca; al terminar llega otro "lista" con todo y el diario aplicado
+
+    def describir(self, cancion):
+        if cancion is None:
+            return None
+        return {
+            "pos": self.lista.posicion(cancion) if self.lista.contiene(cancion) else None,
+            "titulo": cancion.titulo,
+            "video_id": cancion.video_id,
+            "duracion": cancion.duracion,
+            "descargada": bool(cancion.file_path)
+        }
+
+    def estado(self):
+        return {
+            **self.instantanea,  # Sin candado: un pedido de estado no espera a que termine un cambio de cancion
+            "canciones": self.lista.longitud,
+            "descargas": len(self.gestor.activos()),
+            "inicio": self.tiempos_inicio
+        }
+
+    def pagina(self, desde=0, cantidad=100):
+        with self.candado:
+            return [self.describir(c) for c in self.lista.orden[desde:desde + cantidad]]
+
+    def en_posicion(self, pos):
+        with self.candado:
+            if not 0 <= pos < self.lista.longitud:
+                raise IndexError(f"No hay canción en la posición {pos}")
+            return self.lista.orden[pos]
+
+    def pausar(self):  
+        self.motor.pausar()  
+        self.emitir("estado", estado=self.motor.estado)
+
+    def reanudar(self):
+        self.motor.reanudar()
+        self.emitir("estado", estado=self.motor.estado)
+
+    def alternar_pausa(self):
+        if self.motor.estado == "pausado":
+            self.reanudar()  
+        else:
+            self.pausar()  
+
+    def posicionar(self, segundos):
+        if self.motor.posicionar(float(segundos)):
+            self.emitir("estado", estado=self.motor.estado)
+
+    def parar(self):
+        self.esperando = None  
+        self.motor.detener()  
+        self.poner_carga(False)
+
+    def detener(self):  
+        with self.candado:
+            self.parar()
+        self.emitir("estado", estado=self.motor.estado)
+
+    def anterior(self):  
+        with self.candado:
+            self.parar()  
+            self.lista.anterior()  
+            self.tocar_actual()  
+
+    def siguiente(self):  
+        with self.candado:
+            self.parar()  
+            self.lista.siguiente()  
+            self.tocar_actual()  
+
+    def saltar(self, cancion):
+        with self.candado:
+            if not self.lista.contiene(cancion):
+                return False  # Se elimino mientras se mostraba el resultado
+            self.parar()
+            self.lista.saltar(cancion)
+            self.tocar_actual()
+            return True
+
+    def mover(self, cancion, pasos):
+        with self.candado:
+            antes = self.lista.posicion(cancion)
+            if not self.lista.mover(cancion, pasos):  
+                return False
+            despues = self.lista.posicion(cancion)
+            self.guardar_lista() 
+            self.emitir("movida", cancion=cancion, antes=antes, despues=despues)
+            return True
 
+    def eliminar(self, cancion):
+        with self.candado:
+            if not self.lista.contiene(cancion):
+                return False
+            trabajo = self.gestor.trabajo_de(cancion)
+            if trabajo:
+                self.gestor.cancelar(trabajo)  
+
+            if self.lista.PTR == cancion:  
+                if self.lista.longitud == 1:
+                    self.detener()  
+                else:
+                    self.siguiente() 
+
+            pos = self.lista.posicion(cancion)
+            self.lista.eliminar(cancion)  
+            self.guardar_lista()  
+            self.emitir("eliminada", cancion=cancion, pos=pos)
+            return True
+
+    def mover_varias(self, canciones, destino):
+        with self.candado:
+            canciones = sorted({c for c in canciones if self.lista.contiene(c)}, key=self.lista.posicion)  # En el orden de la lista
+            if destino == "actual":
+                canciones = [c for c in canciones if c is not self.lista.PTR]  # La actual queda donde esta
+            if not canciones:
+                return False
+            if destino == "inicio":
+                pos = 0
+            elif destino == "final":
+                pos = self.lista.longitud - len(canciones)
+            elif destino == "actual":
+                actual = self.lista.posicion(self.lista.PTR)
+                pos = actual + 1 - bisect.bisect_left([self.lista.posicion(c) for c in canciones], actual)
+            else:
+                pos = int(destino)  # Indice en la lista sin las elegidas
+            if not self.lista.empalmar(canciones, pos):
+                return False
+            self.guardar_lista()  # Una escritura para todo el bloque
+            self.precargador.actualizar()
+            self.emitir("lista")  # Y un solo redibujo
+            return True
+
+    def eliminar_varias(self, canciones):
+        with self.candado:
+            canciones = [c for c in set(canciones) if self.lista.contiene(c)]
+            if not canciones:
+                return False
+            for cancion in canciones:
+                trabajo = self.gestor.trabajo_de(cancion)
+                if trabajo:
+                    self.gestor.cancelar(trabajo)
+            sonaba = self.lista.PTR in canciones
+            if sonaba:
+                self.parar()
+            self.lista.eliminar_varias(canciones)
+            self.guardar_lista()
+            self.emitir("lista")
+            if sonaba and self.lista.PTR:
+                self.tocar_actual()
+            elif sonaba:
+                self.emitir("estado", estado=self.motor.estado)
+            else:
+                self.precargador.actualizar()
+            return True
 
-def main(page: ft.Page):  
-    global lista_reproduccion, player, reproduciendo  
+    def buscar(self, consulta, limite=10):
+        return self.lista.buscar(consulta, limite=limite)
+
+    def agregar(self, texto):
+        texto = texto.strip() 
+        if not texto:
+            return False  
+
+        if es_url_lista(texto):
+            threading.Thread(target=self.importar, args=(texto,), daemon=True).start()
+        else:
+            self.gestor.agregar(texto, self.al_cambiar_descarga)  # La busqueda y descarga siguen en segundo plano
+            self.emitir("descarga", trabajo=None)
+        return True
+
+    def importar(self, url):
+        self.emitir("importando", url=url)
+        try:
+            canciones = enumerar_lista(url)
+        except Exception as e:
+            self.emitir("error", mensaje=f"Error al importar la lista: {e}")
+            self.emitir("descarga", trabajo=None)
+            return
+
+        with self.candado:
+            estaba_vacia = self.lista.longitud == 0
+            for cancion in canciones:
+                self.lista.agregar(cancion)  
+            self.guardar_lista()  # Una sola escritura para toda la lista
+            self.emitir("lista")  # Y un solo refresco
+            for cancion in canciones:
+                self.gestor.agregar(cancion.titulo, self.al_cambiar_descarga, cancion=cancion, fondo=True)
+                cache_miniaturas.pedir(cancion.miniatura)
+            if estaba_vacia and canciones:
+                self.tocar_actual()
+            else:
+                self.precargador.actualizar()  # Las primeras pueden caer en la ventana y pasan adelante
+            self.emitir("descarga", trabajo=None)
+
+    def al_cambiar_descarga(self, trabajo):
+        with self.candado:
+            cancion = trabajo.cancion
+
+            if cancion and not trabajo.en_lista and trabajo.estado not in ("resolviendo", "fallido", "cancelado"):
+                trabajo.en_lista = True  
+                cache_miniaturas.pedir(cancion.miniatura)  # En segundo plano, para no usar la red al cambiar de cancion
+                self.lista.agregar(cancion)  
+                self.guardar_lista()  
+                self.emitir("agregada", cancion=cancion, pos=self.lista.longitud - 1)
+                if self.lista.longitud == 1:
+                    self.esperando = cancion  
+                    self.inicio_cambio = None  # La primera cancion no cuenta como cambio
+                else:
+                    self.precargador.actualizar()  # La nueva puede caer dentro de la ventana de precarga
+
+            if (TRANSMITIR and trabajo.estado == "descargando" and self.esperando is cancion
+                    and self.lista.PTR is cancion and cancion.stream_vigente()):
+                self.pedir("transmitir_esperada", cancion)  # Recien resuelta: ya hay url directa
+
+            if trabajo.estado == "listo" and self.lista.contiene(cancion):
+                self.lista.actualizar_archivo(cancion, trabajo.file_path)  
+                self.lista.busqueda.actualizar(cancion)
+                self.guardar_lista() 
+                self.emitir("archivos", canciones=[cancion])
+                if self.esperando is cancion and self.lista.PTR is cancion:
+                    self.pedir("tocar_esperada", cancion)  # La abre el hilo de ordenes, no el de la descarga
+            elif trabajo.estado == "fallido":
+                if self.esperando is cancion:
+                    self.esperando = None
+                    self.poner_carga(False)
+                self.emitir("error", mensaje=f"Error al agregar canción: {trabajo.error}")
+
+            self.emitir("descarga", trabajo=trabajo)
+
+    def al_convertir(self, viejo, nuevo):
+        with self.candado:
+            for cancion in self.lista.orden:
+                if cancion.file_path == viejo:
+                    self.lista.actualizar_archivo(cancion, nuevo)
+            self.guardar_lista()
+        cache_descargas.descartar(viejo)  # Si suena justo ahora, queda para la limpieza de la cache
+
+    def guardar_lista(self):
+        if self.lista.diario:
+            self.lista.guardar_cambios()  # Solo se agregan las operaciones nuevas al diario
+        else:
+            self.lista.guardar(PLAYLIST_FILE)
+        self.revisar_siguiente()
+
+    def escanear(self):
+        cache_descargas.sincronizar()  # Suma al manifiesto lo que haya en la carpeta y aplica el limite
+        cache_metadatos.escanear(MUSIC_FOLDER)  # En segundo plano: solo analiza archivos nuevos o cambiados
+        for cancion in list(self.lista.orden):
+            self.lista.busqueda.actualizar(cancion)  # Suma artista y album al indice
+        with self.candado:
+            self.emitir("archivos", canciones=None)  # Todas
+
+    def fin_de_cancion(self, cortado=False):
+        cancion = self.lista.PTR
+        if cortado and cancion:
+            self.corte["cancion"], self.corte["desde"] = cancion, self.motor.ultimo_pts  # Se cayo el stream a mitad
+            with self.candado:
+                self.esperando = cancion  # Sigue cuando este el archivo
+                self.inicio_cambio = time.perf_counter()  # La espera se cuenta desde el corte
+                self.poner_carga(True)
+                if cancion.file_path and os.path.exists(cancion.file_path):
+                    self.pedir("tocar_esperada", cancion)  # La descarga ya termino: se sigue desde el archivo
+            return
+        print("Fin de cancion")
+        self.pedir("fin")  # El hilo del motor no abre la siguiente: lo hace el de ordenes
+
+    def proxima_cancion(self):
+        with self.candado:  # Lo consulta el hilo del motor; en aleatorio puede sortear la siguiente
+            if self.repetir == "una":
+                cancion = self.lista.PTR
+            elif self.repetir == "no" and self.lista.al_final():
+                cancion = None
+            else:
+                cancion = next(iter(self.lista.proximas(1)), None)
+        if cancion and cancion.file_path and os.path.exists(cancion.file_path):
+            return cancion.file_path
+        return None  # Sin archivo todavia: al final se pasa por tocar_actual
+
+    def relevo_de_cancion(self, file_path, inicio):
+        self.pedir("relevo", file_path, inicio, self.motor.generacion)  # El hilo del motor solo avisa
+
+    def relevo(self, file_path, inicio, generacion):
+        with self.candado:
+            if self.motor.generacion != generacion:
+                return  # Ya se abrio otra cancion: el relevo quedo viejo
+            self.avanzar()  
+            cancion = self.lista.PTR
+            if cancion.file_path != file_path:
+                self.tocar_actual()  # La lista cambio mientras se preparaba el relevo
+                return
+            registrar_cambio(inicio, "relevo")
+            cache_descargas.usar(file_path)
+            self.emitir("cancion", cancion=cancion)
+            self.precargador.actualizar()  
+
+    def revisar_siguiente(self):
+        if self.motor.archivo_siguiente() not in (None, self.proxima_cancion()):
+            with self.motor.candado:
+                self.motor.descartar_siguiente()  # Se movio o borro la que seguia
+
+    def reproducir(self, file_path, modo="archivo"):
+        desde = self.corte["desde"] if self.corte["cancion"] is self.lista.PTR else None
+        self.corte["cancion"] = None
+        self.motor.reproducir(
+            file_path, al_terminar=self.fin_de_cancion, al_pasar=self.relevo_de_cancion, proxima=self.proxima_cancion,
+            inicio=self.inicio_cambio, modo=modo, desde=desde  # El motor registra el tiempo al oir el primer sonido
+        )
+        cache_descargas.usar(file_path)  # Para el orden de la limpieza por antiguedad
+        self.poner_carga(False)
+        self.emitir("estado", estado=self.motor.estado)
+
+    def transmitir(self, cancion):
+        self.esperando = None  # La descarga sigue, pero solo para la cache
+        self.motor.reproducir(
+            cancion.stream_url, al_terminar=self.fin_de_cancion, al_pasar=self.relevo_de_cancion, proxima=self.proxima_cancion,
+            stream=True, inicio=self.inicio_cambio, modo="stream", al_cargar=self.poner_carga
+        )
+        self.poner_carga(False)
+        self.emitir("estado", estado=self.motor.estado)
+
+    def poner_carga(self, cargando):
+        if cargando != self.cargando:
+            self.cargando = cargando
+            self.emitir("carga", cargando=cargando)
+
+    def tocar_esperada(self, cancion):
+        with self.candado:
+            if self.esperando is cancion and self.lista.PTR is cancion:
+                self.tocar_actual()  # Si se salto a otra mientras tanto, ya la abrio el salto
+
+    def transmitir_esperada(self, cancion):
+        with self.candado:
+            if self.esperando is cancion and self.lista.PTR is cancion and cancion.stream_vigente():
+                self.transmitir(cancion)
+
+    def tocar_actual(self, inicio=None):
+        with self.candado:
+            cancion = self.lista.PTR  
+            if not cancion:
+                return  
+            desde_descarga = self.esperando is cancion
+            if not desde_descarga:
+                self.inicio_cambio = inicio or time.perf_counter()  # Si llega de una descarga se sigue midiendo desde el pedido
+            self.parar() 
+            self.emitir("cancion", cancion=cancion)
+
+            if cancion.file_path and os.path.exists(cancion.file_path):
+                self.reproducir(cancion.file_path, "descarga" if desde_descarga else "archivo")  
+            else:
+                if TRANSMITIR and cancion.stream_vigente():
+                    self.transmitir(cancion)  # No hace falta esperar el archivo entero
+                else:
+                    self.esperando = cancion  # Suena cuando el gestor termine la descarga o resuelva la url
+                    self.poner_carga(True)
+                self.gestor.agregar(cancion.titulo, self.al_cambiar_descarga, cancion=cancion)  
+
+            self.precargador.actualizar()  
+
+reproductor = Reproductor(lista_reproduccion, motor, gestor_descargas, precargador)
+
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_DELETE = 0x8, 0x40, 0x80, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW, IN_IGNORED = 0x400, 0x800, 0x4000, 0x8000
+IN_CLOEXEC = 0o2000000
+MASCARA_INOTIFY = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+class VigilanteInotify:
+    def __init__(self, carpeta):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify solo existe en Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if libc.inotify_add_watch(self.fd, os.fsencode(carpeta), MASCARA_INOTIFY) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch {carpeta}")
+
+    def leer(self, espera=None):
+        listos, _, _ = select.select([self.fd], [], [], espera)
+        if not listos:
+            return []
+        datos = os.read(self.fd, 64 * 1024)
+        eventos = []
+        i = 0
+        while i + 16 <= len(datos):
+            _, mascara, cookie, largo = struct.unpack_from("iIII", datos, i)  # La cookie une las dos mitades de un renombre
+            nombre = datos[i + 16:i + 16 + largo].split(b"\0", 1)[0]
+            eventos.append((mascara, cookie, os.fsdecode(nombre)))
+            i += 16 + largo
+        return eventos
+
+    def cerrar(self):
+        os.close(self.fd)
+
+
+class Reconciliador:
+    def __init__(self, reproductor, carpeta):
+        self.reproductor = reproductor  
+        self.lista = reproductor.lista  
+        self.carpeta = carpeta  
+        self.archivos = {}  # Nombre -> ruta de cada audio de la carpeta
+        self.por_clave = {}  # Nombre o nombre sin extension, en minusculas -> ruta
+        self.renombres = {}  # Nombre viejo -> nuevo, de los renombres de la ultima rafaga de eventos
+        self.vigilante = None  
+        self.candado = threading.Lock()  # El escaneo completo y los eventos de inotify no se pisan
+
+    def escanear_carpeta(self):
+        archivos, temporales = {}, []
+        with os.scandir(self.carpeta) as entradas:
+            for entrada in entradas:
+                nombre = entrada.name
+                if nombre.startswith("temp_") or nombre.endswith((".part", ".ytdl", ".tmp")):
+                    temporales.append(entrada)
+                elif nombre.lower().endswith(EXTENSIONES_AUDIO) and entrada.is_file():
+                    archivos[nombre] = entrada.path
+        return archivos, temporales
+
+    def agregar_archivo(self, nombre, ruta):
+        self.archivos[nombre] = ruta
+        self.por_clave.setdefault(nombre.lower(), ruta)
+        self.por_clave.setdefault(os.path.splitext(nombre)[0].lower(), ruta)
+
+    def quitar_archivo(self, nombre):
+        ruta = self.archivos.pop(nombre, None)
+        for clave in (nombre.lower(), os.path.splitext(nombre)[0].lower()):
+            if ruta and self.por_clave.get(clave) == ruta:
+                del self.por_clave[clave]
+
+    def vigente(self, file_path):
+        if not file_path:
+            return False
+        carpeta, nombre = os.path.split(file_path)
+        if os.path.normcase(carpeta) == os.path.normcase(self.carpeta):
+            return nombre in self.archivos  # Sin tocar el disco
+        return os.path.exists(file_path)
+
+    def claves(self, cancion):
+        claves = []
+        if cancion.video_id:
+            claves.append(nombre_seguro(cancion.titulo, cancion.video_id).lower())
+        if cancion.file_path:
+            claves.append(re.split(r"[\\/]", cancion.file_path)[-1].lower())  # Tambien rutas de Windows de otra maquina
+        claves.append(nombre_seguro(cancion.titulo).lower())
+        return claves
+
+    def ubicar(self, cancion):
+        nombre = self.renombres.get(cache_descargas.nombre(cancion.file_path))
+        if nombre in self.archivos:
+            return self.archivos[nombre]  # Renombrado dentro de la carpeta
+        if cancion.video_id:
+            nombre = cache_descargas.por_id.get(cancion.video_id)  # Bajado antes con otro nombre
+            if nombre in self.archivos:
+                return self.archivos[nombre]
+        for clave in self.claves(cancion):
+            if clave in self.por_clave:
+                return self.por_clave[clave]
+        return None
+
+    def enlazar(self, cancion, file_path):
+        if file_path == cancion.file_path:
+            return False
+        self.lista.actualizar_archivo(cancion, file_path)  # None si no aparece: se vuelve a bajar al tocarla
+        return True
+
+    def por_contenido(self, pendientes):
+        with cache_descargas.candado:
+            usados = set(cache_descargas.referencias)
+        tamanos = {tamano for tamano, _ in pendientes}
+        encontrados = {}
+        for nombre, ruta in list(self.archivos.items()):
+            if nombre in usados:
+                continue
+            try:
+                tamano = os.path.getsize(ruta)
+                if tamano not in tamanos:
+                    continue  # Solo se calcula el hash si coincide el tamano
+                datos = cache_metadatos.obtener(ruta)
+                clave = (tamano, datos["hash"] if datos else hash_archivo(ruta))
+            except OSError:
+                continue
+            if clave in pendientes:
+                encontrados[clave] = ruta
+        return encontrados
+
+    def reubicar(self, canciones, incluir=None):
+        cambiadas = []
+        pendientes = {}  # (tamano, hash) del archivo que tenian -> canciones que no se encontraron por nombre
+        for i in range(0, len(canciones), LOTE_INICIO):
+            with self.reproductor.candado:
+                for cancion in canciones[i:i + LOTE_INICIO]:
+                    if not self.lista.contiene(cancion) or self.vigente(cancion.file_path):
+                        continue
+                    if incluir and not incluir(cancion):
+                        continue
+                    nuevo = self.ubicar(cancion)
+                    datos = cache_metadatos.consultar_original(cancion.file_path) if cancion.file_path and not nuevo else None
+                    if datos and datos.get("hash"):
+                        pendientes.setdefault((datos["tamano"], datos["hash"]), []).append(cancion)
+                    if self.enlazar(cancion, nuevo):
+                        cambiadas.append(cancion)
+
+        if pendientes:
+            encontrados = self.por_contenido(pendientes)  # Renombrados o copiados: mismo contenido
+            with self.reproductor.candado:
+                for clave, ruta in encontrados.items():
+                    for cancion in pendientes[clave]:
+                        if self.lista.contiene(cancion) and self.enlazar(cancion, ruta):
+                            cambiadas.append(cancion)
+        return cambiadas
+
+    def reconciliar(self, canciones=None):
+        completo = canciones is None
+        with telemetria.medir("reconciliar", completo=completo), self.candado:
+            archivos, temporales = self.escanear_carpeta()
+            self.archivos, self.por_clave = {}, {}
+            for nombre, ruta in archivos.items():
+                self.agregar_archivo(nombre, ruta)
+            if completo:
+                canciones = list(self.lista.orden)
+
+            cambiadas = self.reubicar(canciones)
+            if completo:
+                self.limpiar(temporales)
+        telemetria.contar("archivos_reubicados", sum(1 for c in cambiadas if c.file_path))
+        self.avisar(cambiadas)
+
+    def limpiar(self, temporales):
+        limite = time.time() - EDAD_TEMPORALES
+        for entrada in temporales:
+            try:
+                if entrada.is_file() and entrada.stat().st_mtime < limite:
+                    os.remove(entrada.path)  # De una descarga o conversion que se corto
+                    telemetria.contar("temporales_borrados")
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error al eliminar temporal: {e}")
+        cache_descargas.liberar()  # Los archivos que ninguna cancion usa siguen el limite de la cache
+        cache_descargas.guardar()
+
+    def avisar(self, cambiadas):
+        if not cambiadas:
+            return
+        with self.reproductor.candado:
+            self.reproductor.guardar_lista()
+            self.reproductor.emitir("archivos", canciones=cambiadas)
+
+    def aplicar_eventos(self, eventos):
+        nuevos, borrados = set(), set()
+        salidas, renombres = {}, {}  # Cookie -> nombre viejo; nombre viejo -> nuevo
+        for mascara, cookie, nombre in eventos:
+            if mascara & IN_Q_OVERFLOW:
+                return self.reconciliar()  # Se perdieron eventos: una pasada completa
+            if not nombre.lower().endswith(EXTENSIONES_AUDIO) or nombre.startswith("temp_"):
+                continue
+            if mascara & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                nuevos.add(nombre)
+                borrados.discard(nombre)
+                if cookie in salidas:
+                    renombres[salidas.pop(cookie)] = nombre
+            elif mascara & (IN_DELETE | IN_MOVED_FROM):
+                borrados.add(nombre)
+                nuevos.discard(nombre)
+                if mascara & IN_MOVED_FROM:
+                    salidas[cookie] = nombre
+        if not nuevos and not borrados:
+            return
 
+        cambiadas = []
+        with self.candado:
+            for nombre in borrados:
+                self.quitar_archivo(nombre)
+                with cache_descargas.candado:
+                    cache_descargas.quitar(nombre)
+            for nombre in nuevos:
+                ruta = os.path.join(self.carpeta, nombre)
+                if not os.path.isfile(ruta):
+                    continue  # Ya se fue
+                self.agregar_archivo(nombre, ruta)
+                if nombre not in cache_descargas.archivos:
+                    cache_descargas.registrar(ruta)  # Copiado a mano
+            bajando = {nombre_seguro(t.cancion.titulo, t.cancion.video_id).lower() for t in self.reproductor.gestor.activos() if t.cancion}
+            with cache_descargas.candado:
+                perdidos = {n for n in borrados if n in cache_descargas.referencias}
+                sueltos = {
+                    n for n in nuevos if n in self.archivos and n not in cache_descargas.referencias
+                    and os.path.splitext(n)[0].lower() not in bajando  # Lo enlaza su propia descarga
+                }
+
+            if perdidos or sueltos:  # Las descargas ya enlazan su archivo: casi nunca hace falta recorrer la lista
+                self.renombres = renombres
+                try:
+                    cambiadas = self.reubicar(
+                        list(self.lista.orden), lambda c: sueltos or cache_descargas.nombre(c.file_path) in perdidos
+                    )
+                finally:
+                    self.renombres = {}
+
+        for nombre in nuevos:
+            if nombre in self.archivos:
+                cache_metadatos.analizar(self.archivos[nombre])  # Duracion de lo copiado a mano
+        cache_metadatos.guardar()
+        cache_descargas.liberar()
+        cache_descargas.guardar()
+        telemetria.contar("archivos_reubicados", sum(1 for c in cambiadas if c.file_path))
+        self.avisar(cambiadas)
+
+    def iniciar(self):
+        if not VIGILAR_CARPETA or self.vigilante is not None:
+            return
+        try:
+            self.vigilante = VigilanteInotify(self.carpeta)
+            destino = self.vigilar
+        except (OSError, AttributeError) as e:
+            print(f"Sin inotify ({e}): se revisa la carpeta cada {PERIODO_REVISION:.0f} s")
+            self.vigilante = False
+            destino = self.revisar
+        threading.Thread(target=destino, daemon=True, name="carpeta").start()
+
+    def vigilar(self):
+        while True:
+            eventos = self.vigilante.leer()
+            while True:
+                mas = self.vigilante.leer(ESPERA_EVENTOS)  # Se junta la rafaga entera
+                if not mas:
+                    break
+                eventos += mas
+            if any(mascara & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) for mascara, _, _ in eventos):
+                print("Se movio o borro la carpeta de musica: se pasa a revisarla cada tanto")
+                self.vigilante.cerrar()
+                return self.revisar()
+            try:
+                self.aplicar_eventos(eventos)
+            except Exception as e:
+                print(f"Error al aplicar cambios de la carpeta: {e}")
+                telemetria.fallo("vigilar", e)
+
+    def marca(self):
+        try:
+            return os.stat(self.carpeta).st_mtime_ns
+        except OSError:
+            return None
+
+    def revisar(self):
+        marca = self.marca()
+        while True:
+            time.sleep(PERIODO_REVISION)
+            if self.marca() == marca:
+                continue  # Nada entro ni salio de la carpeta
+            marca = self.marca()
+            try:
+                self.reconciliar()
+            except Exception as e:
+                print(f"Error al revisar la carpeta: {e}")
+                telemetria.fallo("vigilar", e)
+
+reconciliador = Reconciliador(reproductor, MUSIC_FOLDER)
+
+
+class ServidorControl:
+    def __init__(self, reproductor, host=HOST_CONTROL, puerto=None, ruta=SOCKET_CONTROL):
+        self.reproductor = reproductor  
+        self.host = host  
+        self.puerto = puerto  # None: el socket Unix si hay, si no PUERTO_CONTROL
+        self.ruta = ruta if puerto is None and hasattr(socket, "AF_UNIX") else None
+        self.token = None  # Solo por TCP: cualquier pagina web puede escribirle a 127.0.0.1
+        self.loop = None  
+        self.clientes = {}  # Cola de salida -> writer de cada cliente conectado
+        self.listo = threading.Event()
+        self.comandos = {
+            "estado": lambda: reproductor.estado(),
+            "lista": lambda desde=0, cantidad=100: reproductor.pagina(desde, cantidad),
+            "buscar": lambda consulta, limite=10: [reproductor.describir(c) for c in reproductor.buscar(consulta, limite)],
+            "tocar": lambda: reproductor.pedir("tocar_actual"),
+            "pausar": lambda: reproductor.pedir("pausar"),
+            "reanudar": lambda: reproductor.pedir("reanudar"),
+            "alternar_pausa": lambda: reproductor.pedir("alternar_pausa"),
+            "detener": lambda: reproductor.pedir("detener"),
+            "siguiente": lambda: reproductor.pedir("siguiente"),
+            "anterior": lambda: reproductor.pedir("anterior"),
+            "saltar": lambda pos: reproductor.pedir("saltar", reproductor.en_posicion(pos)),
+            "posicionar": lambda segundos: reproductor.pedir("posicionar", float(segundos)),
+            "aleatorio": lambda activo=True: reproductor.pedir("poner_aleatorio", bool(activo)),
+            "repetir": lambda modo: reproductor.pedir("poner_repetir", modo),
+            "mover": lambda pos, pasos: reproductor.mover(reproductor.en_posicion(pos), pasos),
+            "eliminar": lambda pos: reproductor.eliminar(reproductor.en_posicion(pos)),
+            "mover_varias": lambda posiciones, destino: reproductor.mover_varias([reproductor.en_posicion(p) for p in posiciones], destino),
+            "eliminar_varias": lambda posiciones: reproductor.eliminar_varias([reproductor.en_posicion(p) for p in posiciones]),
+            "agregar": lambda texto: reproductor.agregar(texto),
+            "eventos": lambda cantidad=100: telemetria.recientes(cantidad)
+        }
+
+    def iniciar(self):
+        threading.Thread(target=self.servir_siempre, daemon=True).start()
+        self.listo.wait(5)
+
+    def servir_siempre(self):
+        try:
+            asyncio.run(self.servir())
+        except OSError as e:
+            print(f"No se pudo abrir el control en {self.ruta or f'{self.host}:{self.puerto}'}: {e}")  # Otro reproductor ya lo usa
+        finally:
+            self.listo.set()
+
+    async def servir(self):
+        self.loop = asyncio.get_running_loop()
+        if self.ruta:
+            self.liberar_socket()
+            servidor = await asyncio.start_unix_server(self.atender, self.ruta, limit=LIMITE_LINEA_CONTROL)
+            os.chmod(self.ruta, 0o600)
+        else:
+            self.token = secrets.token_urlsafe(32)
+            self.guardar_token()
+            servidor = await asyncio.start_server(self.atender, self.host, PUERTO_CONTROL if self.puerto is None else self.puerto, limit=LIMITE_LINEA_CONTROL)
+            self.puerto = servidor.sockets[0].getsockname()[1]  # Con puerto 0 el sistema elige uno libre
+        self.reproductor.suscribir(self.al_evento)
+        self.listo.set()
+        async with servidor:
+            await servidor.serve_forever()
+
+    def liberar_socket(self):
+        if not os.path.exists(self.ruta):
+            return
+        with socket.socket(socket.AF_UNIX) as prueba:
+            try:
+                prueba.connect(self.ruta)
+            except OSError:
+                os.remove(self.ruta)  # Quedo de un reproductor que no cerro bien
+                return
+        raise OSError(f"Otro reproductor atiende {self.ruta}")
+
+    def guardar_token(self):
+        temporal = TOKEN_CONTROL_FILE + ".tmp"
+        try:
+            os.remove(temporal)
+        except FileNotFoundError:
+            pass
+        fd = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)  # Solo lo lee el usuario
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.token)
+        os.replace(temporal, TOKEN_CONTROL_FILE)
+
+    def al_evento(self, evento, datos):
+        if not self.clientes:
+            return  # Nadie conectado: ni siquiera se arma el mensaje
+        mensaje = self.serializar(evento, datos)  # Una vez para todos los clientes
+        self.loop.call_soon_threadsafe(self.difundir, mensaje)
+
+    def serializar(self, evento, datos):
+        mensaje = {"evento": evento}
+        for clave, valor in datos.items():
+            if isinstance(valor, NodoCancion):
+                valor = self.reproductor.describir(valor)
+            elif isinstance(valor, TrabajoDescarga):
+                titulo = valor.cancion.titulo if valor.cancion else valor.texto  # Sin resolver todavia: lo que se busco
+                valor = {"titulo": titulo, "estado": valor.estado, "progreso": valor.progreso}
+            elif clave == "canciones" and valor is not None:
+                valor = [self.reproductor.describir(c) for c in valor]
+            mensaje[clave] = valor
+        return (json.dumps(mensaje, ensure_ascii=False) + "\n").encode()
+
+    def difundir(self, mensaje):
+        for cola, writer in list(self.clientes.items()):
+            try:
+                cola.put_nowait(mensaje)
+            except asyncio.QueueFull:
+                del self.clientes[cola]  # Cliente lento: se corta en vez de acumular eventos sin limite
+                writer.close()
+
+    async def atender(self, reader, writer):
+        cola = asyncio.Queue(maxsize=MAX_EVENTOS_CLIENTE)
+        envio = asyncio.create_task(self.enviar(cola, writer))
+        autenticado = self.token is None  # Por el socket Unix ya controlan los permisos del archivo
+        if autenticado:
+            self.clientes[cola] = writer
+        try:
+            while linea := await reader.readline():
+                pedido = self.leer(linea)
+                if pedido is None:
+                    break  # No es JSON (un POST de un navegador, por ejemplo): se corta sin ejecutar nada
+                if not autenticado:
+                    if not hmac.compare_digest(str(pedido.get("token", "")).encode(), self.token.encode()):
+                        break
+                    autenticado = True
+                    self.clientes[cola] = writer  # Recien ahora recibe eventos
+                    if "comando" not in pedido:
+                        cola.put_nowait(self.responder({"id": pedido.get("id"), "ok": True, "resultado": None}))
+                        continue
+                cola.put_nowait(await self.ejecutar(pedido))
+        except (ConnectionError, ValueError, asyncio.QueueFull):
+            pass  # Se desconecto, mando una linea gigante o no lee lo que se le manda
+        finally:
+            self.clientes.pop(cola, None)
+            envio.cancel()
+            writer.close()
+
+    async def enviar(self, cola, writer):
+        try:
+            while True:
+                writer.write(await cola.get())
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    def leer(self, linea):
+        try:
+            pedido = json.loads(linea)
+        except ValueError:
+            return None  # UnicodeDecodeError tambien es ValueError
+        return pedido if isinstance(pedido, dict) else None
+
+    def responder(self, respuesta):
+        return (json.dumps(respuesta, ensure_ascii=False) + "\n").encode()
+
+    async def ejecutar(self, pedido):
+        try:
+            comando = self.comandos[pedido["comando"]]
+            argumentos = pedido.get("argumentos") or {}
+            # El nucleo bloquea (candados, disco): se corre fuera del loop para no frenar a los demas clientes
+            resultado = await self.loop.run_in_executor(None, lambda: comando(**argumentos))
+            respuesta = {"id": pedido.get("id"), "ok": True, "resultado": resultado}
+        except Exception as e:
+            respuesta = {"id": pedido.get("id"), "ok": False, "error": str(e) or type(e).__name__}
+        return self.responder(respuesta)
+
+
+
+def main(page: ft.Page):  
     page.title = "🎵 Reproductor Musical"  
     page.theme_mode = ft.ThemeMode.DARK  
     page.horizontal_alignment = ft.CrossAxisAlignment.CENTER  
@@ -289,57 +3370,28 @@ def main(page: ft.Page):
         text_align=ft.TextAlign.CENTER  
     )
 
+    texto_carga = ft.Text("", size=14, color=ft.colors.GREY_400)
+
     imagen_cancion = ft.Image(
-        src="https://via.placeholder.com/300",  
+        src_base64=MINIATURA_VACIA,  
         width=300, 
         height=300,  
         fit=ft.ImageFit.CONTAIN,  
         border_radius=ft.border_radius.all(10)  
     )
 
-    def pausar(_=None): 
-        global player  
-        if player:  
-            player.toggle_pause()  
-
-    def detener(_=None):  
-        global player, reproduciendo  
-        if player:  
-            try:
-                player.close_player()  
-            except:
-                pass  
-            player = None  
-        reproduciendo = False  
-
-    def anterior(_=None):  
-        detener()  
-        lista_reproduccion.anterior()  
-        tocar_actual()  
-        actualizar_lista_ui()  
-
-    def siguiente(_=None):  
-        detener()  
-        lista_reproduccion.siguiente()  
-        boton_pausa.icon = ft.icons.PAUSE
-        boton_pausa.tooltip = "Pausar"
-        tocar_actual()  
-        actualizar_lista_ui()  
-
-    
-
     boton_anterior = ft.IconButton(
         icon=ft.icons.SKIP_PREVIOUS,
         icon_size=40,
         tooltip="Canción anterior",
-        on_click=anterior
+        on_click=lambda _: reproductor.pedir("anterior")
     )
 
     boton_play = ft.IconButton(
         icon=ft.icons.PLAY_ARROW,
         icon_size=50,
         tooltip="Reproducir",
-        on_click=lambda _: tocar_actual(),
+        on_click=lambda _: reproductor.pedir("tocar_actual"),
         style=ft.ButtonStyle(bgcolor=ft.colors.BLUE_700)
     )
 
@@ -347,7 +3399,7 @@ def main(page: ft.Page):
         icon=ft.icons.PAUSE,
         icon_size=50,
         tooltip="Pausar",
-        on_click=lambda _: alternar_pausa(),
+        on_click=lambda _: reproductor.pedir("alternar_pausa"),
         style=ft.ButtonStyle(bgcolor=ft.colors.AMBER_700)
     )
 
@@ -355,7 +3407,7 @@ def main(page: ft.Page):
         icon=ft.icons.STOP,
         icon_size=50,
         tooltip="Detener",
-        on_click=detener,
+        on_click=lambda _: reproductor.pedir("detener"),
         style=ft.ButtonStyle(bgcolor=ft.colors.BLUE_700)
     )
 
@@ -363,23 +3415,37 @@ def main(page: ft.Page):
         icon=ft.icons.SKIP_NEXT,
         icon_size=40,
         tooltip="Siguiente canción",
-        on_click=siguiente
+        on_click=lambda _: reproductor.pedir("siguiente")
     )
 
-    def alternar_pausa():
-        global estado_pausado, player
-        if estado_pausado:
-            if player:
-                player.set_pause(False)  
-            boton_pausa.icon = ft.icons.PAUSE
-            boton_pausa.tooltip = "Pausar"
-            estado_pausado = False
-        else:
-            pausar() 
+    boton_aleatorio = ft.IconButton(
+        icon=ft.icons.SHUFFLE,
+        icon_size=30,
+        tooltip="Orden aleatorio",
+        icon_color=ft.colors.GREY_600,
+        on_click=lambda _: reproductor.pedir("poner_aleatorio", not reproductor.instantanea["aleatorio"])
+    )
+
+    boton_repetir = ft.IconButton(
+        icon=ft.icons.REPEAT,
+        icon_size=30,
+        tooltip="Repetir la lista",
+        icon_color=ft.colors.BLUE_400,
+        on_click=lambda _: reproductor.pedir("poner_repetir", REPETICIONES[(REPETICIONES.index(reproductor.instantanea["repetir"]) + 1) % len(REPETICIONES)])
+    )
+
+    def mostrar_boton_pausa():
+        instantanea = reproductor.instantanea
+        if instantanea["estado"] == "pausado":
             boton_pausa.icon = ft.icons.PLAY_ARROW
             boton_pausa.tooltip = "Reanudar"
-            estado_pausado = True
-        page.update()
+        else:
+            boton_pausa.icon = ft.icons.PAUSE
+            boton_pausa.tooltip = "Pausar"
+        boton_aleatorio.icon_color = ft.colors.BLUE_400 if instantanea["aleatorio"] else ft.colors.GREY_600
+        boton_repetir.icon = ft.icons.REPEAT_ONE if instantanea["repetir"] == "una" else ft.icons.REPEAT
+        boton_repetir.icon_color = ft.colors.GREY_600 if instantanea["repetir"] == "no" else ft.colors.BLUE_400
+        boton_repetir.tooltip = {"todas": "Repetir la lista", "una": "Repetir la canción", "no": "Sin repetir"}[instantanea["repetir"]]
 
     controles_reproduccion = ft.Container(
         ft.Stack(
@@ -389,7 +3455,7 @@ def main(page: ft.Page):
                     alignment=ft.MainAxisAlignment.START,
                 ),
                 ft.Row(
-                    [boton_anterior, boton_pausa, boton_siguiente],
+                    [boton_aleatorio, boton_anterior, boton_pausa, boton_siguiente, boton_repetir],
                     alignment=ft.MainAxisAlignment.CENTER,
                     width=float("inf")  
                 )
@@ -399,90 +3465,81 @@ def main(page: ft.Page):
         width=float("inf")
     )
 
-    lista_canciones = ft.Column(  
+    lista_canciones = ft.ListView(  
         spacing=5,  
-        scroll=ft.ScrollMode.AUTO,  
-        expand=True  
+        item_extent=ALTO_FILA,  # Flutter solo dibuja las filas visibles
+        expand=True,  
+        on_scroll_interval=100,
+        on_scroll=lambda e: al_desplazar(e)
     )
 
-    def mover_arriba(cancion):
-        if lista_reproduccion.longitud <= 1:  
-            return
-
-        canciones = lista_reproduccion.recorrer()  
-        current_index = canciones.index(cancion)  
-
-        if current_index == 0:  
+    filas = {}  # Nodo -> fila ya creada, se reutiliza en vez de reconstruirla
+    seleccion = set()  # Nodos marcados para mover o eliminar de una vez
+    casillas = {}  # Nodo -> casilla de su fila
+    textos_duracion = {}  # Nodo -> texto con la duracion de la fila
+    vista = {"cargadas": 0, "actual": None, "total": None}  # Filas creadas, nodo resaltado y segundos de la lista (None: sin sumar)
+    aportes = {}  # Nodo -> segundos que suma al total, solo los que tienen duracion
+
+    def mover_fila(antes, despues):
+        if max(antes, despues) < vista["cargadas"]:
+            lista_canciones.controls.insert(despues, lista_canciones.controls.pop(antes))  # Solo cambian estas filas
+        elif min(antes, despues) < vista["cargadas"]:
+            actualizar_lista_ui()  # Entra o sale de la parte creada
             return
+        lista_canciones.update()
 
-        cancion_anterior = canciones[current_index-1]
-        es_primera = (current_index == 1)  
-
-        cancion_anterior.anterior.siguiente = cancion 
-        cancion.anterior = cancion_anterior.anterior  
-
-        cancion_anterior.siguiente = cancion.siguiente  
-        cancion.siguiente.anterior = cancion_anterior  
+    etiquetas_descarga = {}  # Nodo -> texto con el estado de su descarga
 
-        cancion.siguiente = cancion_anterior 
-        cancion_anterior.anterior = cancion 
+    def texto_estado(trabajo):
+        if trabajo.estado == "descargando" and trabajo.progreso:
+            return f"{int(trabajo.progreso * 100)}%"
+        return trabajo.estado
 
-        if es_primera:  
-            lista_reproduccion.PTR = cancion  
+    def actualizar_texto_descargas():
+        pendientes = len(gestor_descargas.activos())
+        texto_descargas.value = f"Descargando {pendientes} canción(es)..." if pendientes else ""
+        texto_descargas.update()
 
-        lista_reproduccion.guardar(PLAYLIST_FILE) 
-        actualizar_lista_ui()
-
-    def mover_abajo(cancion):
-        if lista_reproduccion.longitud <= 1:  
-            return
-
-        canciones = lista_reproduccion.recorrer()  
-        current_index = canciones.index(cancion) 
-
-        if current_index == len(canciones)-1:  
-            return
-
-        cancion_siguiente = canciones[current_index+1]  
-        es_primera = (current_index == 0)  
-
-        cancion.anterior.siguiente = cancion_siguiente  
-        cancion_siguiente.anterior = cancion.anterior  
-
-        cancion.siguiente = cancion_siguiente.siguiente  
-        cancion_siguiente.siguiente.anterior = cancion  
-
-        cancion_siguiente.siguiente = cancion  
-        cancion.anterior = cancion_siguiente  
-
-        if es_primera and current_index == 0:  
-            lista_reproduccion.PTR = cancion_siguiente  
-
-        lista_reproduccion.guardar(PLAYLIST_FILE)  
-        actualizar_lista_ui()  
+    def mostrar_descarga(trabajo):
+        etiqueta = etiquetas_descarga.get(trabajo.cancion) if trabajo else None
+        if etiqueta:
+            terminado = trabajo.estado in ("listo", "fallido", "cancelado")
+            etiqueta.value = "" if terminado else texto_estado(trabajo)
+            etiqueta.update()
+        actualizar_texto_descargas()
 
     def crear_item_lista(cancion):
+        trabajo = gestor_descargas.trabajo_de(cancion)
+        etiquetas_descarga[cancion] = ft.Text(texto_estado(trabajo) if trabajo else "", size=12, color=ft.colors.GREY_400)
+        textos_duracion[cancion] = ft.Text(formato_tiempo(cancion.duracion) if cancion.duracion else "", size=14, color=ft.colors.GREY_400)
+        miniatura = ft.Image(width=LADO_MINIATURA_FILA, height=LADO_MINIATURA_FILA, fit=ft.ImageFit.COVER, border_radius=ft.border_radius.all(4))
+        poner_miniatura(miniatura, cancion.miniatura, LADO_MINIATURA_FILA, lambda: cancion in filas)
+        casillas[cancion] = ft.Checkbox(value=cancion in seleccion, on_change=lambda e, c=cancion: marcar(c, e.control.value))
         return ft.Container(  
             content=ft.Row(  
                 [
+                    casillas[cancion],
                     ft.IconButton(  
                         icon=ft.icons.ARROW_UPWARD,
-                        on_click=lambda _, c=cancion: mover_arriba(c),  
+                        on_click=lambda _, c=cancion: reproductor.mover(c, -1),  
                         tooltip="Mover arriba",  
                         icon_size=20  
                     ),
                     ft.IconButton(  
                         icon=ft.icons.ARROW_DOWNWARD,
-                        on_click=lambda _, c=cancion: mover_abajo(c), 
+                        on_click=lambda _, c=cancion: reproductor.mover(c, 1), 
                         tooltip="Mover abajo",
                         icon_size=20
                     ),
+                    miniatura,
                     ft.Text(cancion.titulo, expand=True, size=16),  
+                    etiquetas_descarga[cancion],  
+                    textos_duracion[cancion],  
 
                     ft.IconButton(  
                         icon=ft.icons.DELETE,
                         tooltip="Eliminar", 
-                        on_click=lambda _, c=cancion: eliminar_cancion(c),  
+                        on_click=lambda _, c=cancion: reproductor.eliminar(c),  
                         icon_color=ft.colors.RED_400  
                     )
                 ],
@@ -495,151 +3552,252 @@ def main(page: ft.Page):
             border=ft.border.all(1, ft.colors.GREY_700)  
         )
 
+    def fila_de(cancion):
+        fila = filas.get(cancion)
+        if fila is None:
+            fila = filas[cancion] = crear_item_lista(cancion)
+        return fila
+
     def actualizar_lista_ui():
-        lista_canciones.controls.clear()  
-        for cancion in lista_reproduccion.recorrer():  
-            lista_canciones.controls.append(crear_item_lista(cancion))  
-        page.update() 
+        with telemetria.medir("dibujar_lista"):
+            dibujar_lista()
+
+    def dibujar_lista():
+        for cancion in [c for c in filas if not lista_reproduccion.contiene(c)]:
+            del filas[cancion]  # Nodos que ya no estan en la lista
+            etiquetas_descarga.pop(cancion, None)
+            textos_duracion.pop(cancion, None)
+            casillas.pop(cancion, None)
+        seleccion.difference_update([c for c in seleccion if not lista_reproduccion.contiene(c)])
+        for cancion in [c for c in aportes if not lista_reproduccion.contiene(c)]:
+            restar(cancion)  # Quitadas en bloque
+        mostrar_seleccion()
+
+        cargadas = min(lista_reproduccion.longitud, max(vista["cargadas"], TAMANO_BLOQUE))
+        lista_canciones.controls = [fila_de(c) for c in lista_reproduccion.orden[:cargadas]]  
+        vista["cargadas"] = cargadas
+        marcar_actual(enviar=False)
+        mostrar_total()
+        page.update()  # Las filas reutilizadas no se vuelven a enviar
+
+    def marcar_actual(enviar=True):
+        anterior, actual = vista["actual"], lista_reproduccion.PTR
+        for cancion, color in ((anterior, ft.colors.GREY_800), (actual, ft.colors.GREY_900)):
+            fila = filas.get(cancion)
+            if fila is not None and fila.bgcolor != color:
+                fila.bgcolor = color
+                if enviar:
+                    fila.update()  # Solo el color de la fila vieja y la nueva
+        vista["actual"] = actual
+
+    def agregar_fila(cancion):
+        if vista["cargadas"] == lista_reproduccion.longitud - 1:
+            lista_canciones.controls.append(fila_de(cancion))  # Ya se veia el final de la lista
+            vista["cargadas"] += 1
+            lista_canciones.update()
+        sumar(cancion)
+        mostrar_total()
+        texto_total.update()
+
+    def quitar_fila(cancion, pos):
+        if pos < vista["cargadas"]:
+            lista_canciones.controls.pop(pos)
+            vista["cargadas"] -= 1
+            lista_canciones.update()
+        filas.pop(cancion, None)
+        etiquetas_descarga.pop(cancion, None)
+        textos_duracion.pop(cancion, None)
+        casillas.pop(cancion, None)
+        if cancion in seleccion:
+            seleccion.discard(cancion)
+            mostrar_seleccion()
+            barra_seleccion.update()
+        restar(cancion)
+        mostrar_total()
+        texto_total.update()
+
+    def mostrar_seleccion():
+        texto_seleccion.value = f"{len(seleccion)} seleccionada(s)"
+        barra_seleccion.visible = bool(seleccion)
+
+    def marcar(cancion, marcada):
+        if marcada:
+            seleccion.add(cancion)
+        else:
+            seleccion.discard(cancion)
+        mostrar_seleccion()
+        barra_seleccion.update()
+
+    def completar_rango():
+        with reproductor.candado:
+            posiciones = [lista_reproduccion.posicion(c) for c in seleccion if lista_reproduccion.contiene(c)]
+            if not posiciones:
+                return
+            seleccion.update(lista_reproduccion.orden[min(posiciones):max(posiciones) + 1])  # Todo lo que hay entre la primera y la ultima
+        for cancion in seleccion:
+            if cancion in casillas:
+                casillas[cancion].value = True
+        mostrar_seleccion()
+        page.update()
+
+    def limpiar_seleccion(enviar=True):
+        for cancion in seleccion:
+            if cancion in casillas:
+                casillas[cancion].value = False
+        seleccion.clear()
+        mostrar_seleccion()
+        if enviar:
+            page.update()
+
+    def con_seleccion(accion):
+        canciones = list(seleccion)
+        limpiar_seleccion(enviar=False)
+        if not accion(canciones):
+            page.update()  # Si hubo cambios ya los envio el redibujo de la lista
+
+    def mostrar_duraciones(canciones):
+        if canciones is None:
+            vista["total"] = None  # Pudo cambiar cualquiera: se vuelve a sumar una vez
+            canciones = list(textos_duracion)
+        for cancion in canciones:
+            if lista_reproduccion.contiene(cancion):
+                sumar(cancion)
+            texto = textos_duracion.get(cancion)
+            if texto is not None:
+                valor = formato_tiempo(cancion.duracion) if cancion.duracion else ""
+                if texto.value != valor:
+                    texto.value = valor
+                    texto.update()  # Solo los textos que cambiaron, sin recorrer toda la pagina
+        mostrar_total()
+        texto_total.update()
+
+    def al_desplazar(e):
+        if e.pixels < e.max_scroll_extent - ALTO_FILA * 20:
+            return
+        with reproductor.candado:
+            cargadas = vista["cargadas"]
+            if cargadas >= lista_reproduccion.longitud:
+                return
+            nuevas = lista_reproduccion.orden[cargadas:cargadas + TAMANO_BLOQUE]
+            lista_canciones.controls.extend(fila_de(c) for c in nuevas)
+            vista["cargadas"] = cargadas + len(nuevas)
+            marcar_actual(enviar=False)
+            lista_canciones.update()
+
+    def sumar(cancion):
+        if vista["total"] is None:
+            return  # Todavia sin sumar: la primera suma ya la incluye
+        duracion = cancion.duracion or 0
+        vista["total"] += duracion - aportes.pop(cancion, 0)
+        if duracion:
+            aportes[cancion] = duracion
+
+    def restar(cancion):
+        if vista["total"] is not None:
+            vista["total"] -= aportes.pop(cancion, 0)
+
+    def mostrar_total():
+        if vista["total"] is None and reproductor.cargada:
+            aportes.clear()
+            aportes.update((c, c.duracion) for c in lista_reproduccion.orden if c.duracion)
+            vista["total"] = sum(aportes.values())  # Una vez al cargar; despues se ajusta al agregar y quitar
+        if lista_reproduccion.longitud:
+            texto_total.value = f"{lista_reproduccion.longitud} canciones · {formato_tiempo(vista['total'] or 0)}"
+        else:
+            texto_total.value = "" if reproductor.cargada else "Cargando lista..."
+
 
     def mostrar_error(mensaje):
         page.snack_bar = ft.SnackBar(ft.Text(mensaje))  
         page.snack_bar.open = True  
         page.update()  
 
-    def obtener_duracion(file_path):
-        try:
-            cmd = [
-                'ffprobe', '-v', 'error', 
-                '-show_entries', 'format=duration', 
-                '-of', 'default=noprint_wrappers=1:nokey=1', 
-                file_path
-            ]
-            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            return float(result.stdout.strip())
-        except:
-            return None  
-    
-    def reproducir_mp3(file_path):
-        global player, reproduciendo, reproduccion_id
-        mi_id = reproduccion_id
-
-        duracion = obtener_duracion(file_path)
-        if duracion is None:
-            duracion = 300
-
-        player = MediaPlayer(file_path)
-        inicio = time.time()
-
-        try:
-            reproduciendo = True
-            tiempo_transcurrido = 0.0
-            ultimo_reloj = time.time()
-
-            while reproduciendo:
-                if mi_id != reproduccion_id:
-                    break
-
-                tiempo_actual = time.time()
-                if boton_pausa.icon != ft.icons.PLAY_ARROW:
-                    delta = tiempo_actual - ultimo_reloj
-                    tiempo_transcurrido += delta
-
-                    if tiempo_transcurrido >= duracion:
-                        print("Fin de cancion")
-                        siguiente()
-                        break
-
-                ultimo_reloj = tiempo_actual
-                time.sleep(0.1)
-
-        finally:
-            if player:
-                player.close_player()
-
-    def tocar_actual():
-        global reproduccion_id
-        reproduccion_id += 1  
-        
-        global reproduciendo  
-
-        if not lista_reproduccion.PTR:
-            return  
-        detener() 
+    def poner_miniatura(imagen, url, lado, vigente):
+        file_path = cache_miniaturas.local(url, lado)
+        if file_path:
+            imagen.src, imagen.src_base64 = file_path, None  # Del disco, sin red
+            return
+        imagen.src, imagen.src_base64 = None, MINIATURA_VACIA
 
-        cancion = lista_reproduccion.PTR  
+        def lista():
+            if vigente() and imagen.page:
+                poner_miniatura(imagen, url, lado, lambda: False)
+                imagen.update()
+        cache_miniaturas.pedir(url, lista)
 
+    def mostrar_cancion(cancion):
         texto_titulo.value = cancion.titulo  
-        imagen_cancion.src = cancion.miniatura or "https://via.placeholder.com/300" 
-        page.update()  
+        poner_miniatura(imagen_cancion, cancion.miniatura, LADO_MINIATURA, lambda: lista_reproduccion.PTR is cancion)
+        texto_titulo.update()  # Solo el titulo y la portada, sin recorrer toda la pagina
+        imagen_cancion.update()
 
-        if cancion.file_path and os.path.exists(cancion.file_path):
-            reproduciendo = True  
-            threading.Thread(target=reproducir_mp3, args=(cancion.file_path,), daemon=True).start()  
-        else:
-            try:
-                file_path = descargar_mp3(cancion.url, cancion.titulo)  
-                if file_path:  
-                    cancion.file_path = file_path  
-                    lista_reproduccion.guardar(PLAYLIST_FILE) 
-                    reproduciendo = True  
-                    threading.Thread(target=reproducir_mp3, args=(file_path,), daemon=True).start()  
-                else:
-                    mostrar_error("No se pudo descargar el archivo MP3")  
-            except Exception as e:
-                mostrar_error(f"Error al descargar MP3: {e}")  
+    def mostrar_carga(cargando):
+        texto_carga.value = "Cargando..." if cargando else ""
+        texto_carga.update()
 
     def agregar_cancion(texto):
-        texto = texto.strip() 
-        if not texto:
-            return  
-
-        page.splash = ft.ProgressBar()  
-        entrada_busqueda.disabled = True  
-        boton_agregar.disabled = True  
-        page.update()  
-
-        try:
-            cancion = obtener_info_cancion(texto)  
-            lista_reproduccion.agregar(cancion)  
-            lista_reproduccion.guardar(PLAYLIST_FILE)  
-            actualizar_lista_ui() 
-
-            if lista_reproduccion.longitud == 1:
-                tocar_actual()  
-
-        except Exception as e:
-            mostrar_error(f"Error al agregar canción: {str(e)}") 
-
-        finally:
-            page.splash = None  
-            entrada_busqueda.disabled = False  
-            boton_agregar.disabled = False  
+        if reproductor.agregar(texto):
             entrada_busqueda.value = ""  
             page.update()  
 
-    def eliminar_cancion(cancion):
-        global player, reproduciendo  
-
-        if lista_reproduccion.PTR == cancion:  
-            if lista_reproduccion.longitud == 1:
-                detener()  
-                lista_reproduccion.PTR = None  
-                lista_reproduccion.longitud = 0 
-            else:
-                siguiente() 
+    def buscar_en_lista(e):
+        consulta = entrada_filtro.value or ""
+        resultados_filtro.controls = [
+            ft.TextButton(
+                text=cancion.titulo,
+                on_click=lambda _, c=cancion: saltar_a(c)
+            ) for cancion in reproductor.buscar(consulta, limite=10)
+        ]
+        resultados_filtro.update()
+
+    def saltar_a(cancion):
+        reproductor.pedir("saltar", cancion)
+        entrada_filtro.value = ""
+        resultados_filtro.controls = []
+        page.update()
 
-        lista_reproduccion.eliminar(cancion)  
-        lista_reproduccion.guardar(PLAYLIST_FILE)  
-        actualizar_lista_ui()  
+    def mostrar_vacia():
+        texto_titulo.value = "No hay canciones en la lista"  
+        imagen_cancion.src, imagen_cancion.src_base64 = None, MINIATURA_VACIA
+        page.update() 
 
-        if lista_reproduccion.longitud == 0:
-            texto_titulo.value = "No hay canciones en la lista"  
-            imagen_cancion.src = "https://via.placeholder.com/300" 
-            page.update() 
+    def al_evento(evento, datos):
+        if evento == "cancion":
+            mostrar_cancion(datos["cancion"])
+            marcar_actual()
+        elif evento == "estado":
+            mostrar_boton_pausa()
+            controles_reproduccion.update()  # Pausa, aleatorio y repetir
+        elif evento == "carga":
+            mostrar_carga(datos["cargando"])
+        elif evento == "lista":
+            actualizar_lista_ui()
+        elif evento == "agregada":
+            agregar_fila(datos["cancion"])
+        elif evento == "eliminada":
+            quitar_fila(datos["cancion"], datos["pos"])
+            if lista_reproduccion.longitud == 0:
+                mostrar_vacia()
+        elif evento == "movida":
+            mover_fila(datos["antes"], datos["despues"])
+        elif evento == "archivos":
+            mostrar_duraciones(datos["canciones"])
+        elif evento == "descarga":
+            mostrar_descarga(datos["trabajo"])
+        elif evento == "importando":
+            texto_descargas.value = "Importando lista..."
+            texto_descargas.update()
+        elif evento == "error":
+            mostrar_error(datos["mensaje"])
+
+    texto_descargas = ft.Text("", size=14, color=ft.colors.GREY_400)
 
     barra_busqueda = ft.Card(
         content=ft.Container(
-            ft.Row([entrada_busqueda, boton_agregar], alignment=ft.MainAxisAlignment.CENTER, spacing=10), 
+            ft.Column([
+                ft.Row([entrada_busqueda, boton_agregar], alignment=ft.MainAxisAlignment.CENTER, spacing=10), 
+                texto_descargas
+            ], horizontal_alignment=ft.CrossAxisAlignment.CENTER),
             padding=15  
         ),
         elevation=5,
@@ -648,7 +3806,7 @@ def main(page: ft.Page):
 
     panel_info = ft.Card(
         content=ft.Container(
-            ft.Column([texto_titulo, imagen_cancion, controles_reproduccion],  
+            ft.Column([texto_titulo, texto_carga, imagen_cancion, controles_reproduccion],  
                 horizontal_alignment=ft.CrossAxisAlignment.CENTER, spacing=10), 
             padding=20  
         ),
@@ -656,10 +3814,42 @@ def main(page: ft.Page):
         margin=ft.margin.only(bottom=20)  
     )
 
+    texto_total = ft.Text("", size=14, color=ft.colors.GREY_400)
+
+    entrada_filtro = ft.TextField(
+        hint_text="Buscar en la lista",
+        height=40,
+        border_radius=10,
+        prefix_icon=ft.icons.FILTER_LIST,
+        on_change=buscar_en_lista
+    )
+    resultados_filtro = ft.Column(spacing=0)
+
+    texto_seleccion = ft.Text("", size=14)
+    barra_seleccion = ft.Row(
+        [
+            texto_seleccion,
+            ft.IconButton(icon=ft.icons.UNFOLD_MORE, tooltip="Seleccionar todo entre la primera y la última", on_click=lambda _: completar_rango()),
+            ft.IconButton(icon=ft.icons.VERTICAL_ALIGN_TOP, tooltip="Mover al principio", on_click=lambda _: con_seleccion(lambda c: reproductor.mover_varias(c, "inicio"))),
+            ft.IconButton(icon=ft.icons.PLAYLIST_PLAY, tooltip="Mover después de la actual", on_click=lambda _: con_seleccion(lambda c: reproductor.mover_varias(c, "actual"))),
+            ft.IconButton(icon=ft.icons.VERTICAL_ALIGN_BOTTOM, tooltip="Mover al final", on_click=lambda _: con_seleccion(lambda c: reproductor.mover_varias(c, "final"))),
+            ft.IconButton(icon=ft.icons.DELETE_SWEEP, tooltip="Eliminar seleccionadas", icon_color=ft.colors.RED_400, on_click=lambda _: con_seleccion(reproductor.eliminar_varias)),
+            ft.IconButton(icon=ft.icons.CLOSE, tooltip="Quitar la selección", on_click=lambda _: limpiar_seleccion())
+        ],
+        spacing=0,
+        visible=False
+    )
+
     panel_lista = ft.Card(
         content=ft.Container(
             ft.Column([
-                ft.Text("Lista de Reproducción", size=18, weight=ft.FontWeight.BOLD),  
+                ft.Row([
+                    ft.Text("Lista de Reproducción", size=18, weight=ft.FontWeight.BOLD),  
+                    texto_total
+                ], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                entrada_filtro,
+                resultados_filtro,
+                barra_seleccion,
                 ft.Divider(height=10, color=ft.colors.TRANSPARENT),  
                 lista_canciones  
             ], 
@@ -690,11 +3880,27 @@ def main(page: ft.Page):
         ft.Column([barra_busqueda, panel_info, panel_lista, panel_contacto], expand=True, spacing=20)  
     )
 
-    lista_reproduccion.cargar(PLAYLIST_FILE)  
-    actualizar_lista_ui()  
-
-    if lista_reproduccion.longitud > 0:
-        tocar_actual() 
-
-#ft.app(target=main)
-ft.app(target=main) 
\ No newline at end of file
+    reproductor.suscribir(al_evento)  # La interfaz es un cliente mas del nucleo
+    page.on_disconnect = lambda _: reproductor.desuscribir(al_evento)
+    with reproductor.candado:
+        actualizar_lista_ui()  # Vacia si todavia no se cargo: se pinta igual y llega con el evento "lista"
+        if lista_reproduccion.PTR:
+            mostrar_cancion(lista_reproduccion.PTR)  # El nucleo ya estaba andando, por ejemplo sin interfaz
+    reproductor.tiempos_inicio.setdefault("ventana", time.perf_counter() - INICIO_PROCESO)
+    reproductor.iniciar()  # Carga y autoplay en segundo plano, con la ventana ya pintada
+
+
+if __name__ == "__main__":
+    if TRAZA_FILE:
+        telemetria.abrir_traza(TRAZA_FILE)
+    if PUERTO_METRICAS:
+        telemetria.servir()
+    servidor_control = ServidorControl(reproductor)
+    if "--headless" in sys.argv:
+        reproductor.iniciar()
+        servidor_control.servir_siempre()  # Solo el nucleo y el control local, sin ventana
+    else:
+        if SERVIDOR_CONTROL:
+            servidor_control.iniciar()
+        #ft.app(target=main)
+        ft.app(target=main) 